@@ -1,25 +1,28 @@
 import os, os.path
+import ast
 import warnings
 import pickle
-from operator import itemgetter   
+from concurrent.futures import ThreadPoolExecutor
 import numpy
 import numpy.lib.recfunctions
 import astropy.io.ascii
-from astropy.table import join as table_join
-try:
-    import fitsio
-    fitsread= fitsio.read
-except ImportError:
-    import astropy.io.fits as pyfits
-    fitsread= pyfits.getdata
 _APOGEE_LOADED= True
 try:
     import apogee.tools.read as apread
 except (ImportError,RuntimeError): # RuntimeError if apogee env. not setup
     _APOGEE_LOADED= False
-from gaia_tools.load import path, download
-from gaia_tools.util import save_pickles
-def twomass(dr='tgas'):
+from gaia_tools.load import path, download, colstore, memcache, join, \
+    manifest, mirror
+from gaia_tools.load.join import _fill_value
+from gaia_tools.load import _fits, _lock
+from gaia_tools.load._fits import fitsread
+from gaia_tools.util import save_pickles, prefetch
+_ASTRONN_DISTANCES_FIELDS= ['dist','dist_model_error','dist_error',
+                            'weighted_dist','weighted_dist_error']
+_ASTRONN_AGES_FIELDS= ['astroNN_age','astroNN_age_total_std',
+                       'astroNN_age_predictive_std','astroNN_age_model_std']
+@memcache.memoize(lambda a: [path.twomassPath(dr=a['dr'])])
+def twomass(dr='tgas',columns=None,lazy=False):
     """
     NAME:
        twomass
@@ -27,6 +30,8 @@ def twomass(dr='tgas'):
        Load the 2MASS data matched to TGAS data
     INPUT:
        dr= ('tgas') data release
+       columns= (None) if set, only read these columns
+       lazy= (False) if True, return a LazyCatalog that only reads a column when it is first accessed
     OUTPUT:
        data table
     HISTORY:
@@ -37,8 +42,10 @@ def twomass(dr='tgas'):
     filePath= path.twomassPath(dr=dr)
     if not os.path.exists(filePath):
         download.twomass(dr=dr)
-    return fitsread(filePath,1)
+    if lazy: return _lazy_fitsread(filePath,columns=columns)
+    return fitsread(filePath,1,columns=columns)
 
+@memcache.memoize(lambda a: _apogee_sources(path.apogeePath,a))
 def apogee(xmatch=None,**kwargs):
     """
     PURPOSE:
@@ -47,6 +54,8 @@ def apogee(xmatch=None,**kwargs):
        IF the apogee package is not installed:
            dr= (14) SDSS data release
            use_astroNN= (False) if True, swap in astroNN (Leung & Bovy 2019a) parameters (get placed in, e.g., TEFF and TEFF_ERR) and add astroNN distances (Leung & Bovy 2019b) and ages (Mackereth, Bovy, Leung, et al. 2019); use 'use_astroNN_abundances', 'use_astroNN_distances', and 'use_astroNN_ages' to only add abundances, distances, or ages respectively
+           columns= (None) if set, only read these columns (any astroNN distances and ages are added to these)
+           as_columns= (False) if True and astroNN distances or ages are added, return a gaia_tools.load.colstore.ColumnCatalog to which the astroNN columns are attached, which shares the memory of the catalog read from disk, rather than a structured array into which the catalog is copied
 
        ELSE you can use the same keywords as apogee.tools.read.allstar:
 
@@ -67,7 +76,7 @@ def apogee(xmatch=None,**kwargs):
        xmatch= (None) if set, cross-match against a Vizier catalog (e.g., vizier:I/345/gaia2 for Gaia DR2 or vizier:I/350/gaiaedr3 for Gaia EDR3) using gaia_tools.xmatch.cds and return the overlap
        +gaia_tools.xmatch.cds keywords
     OUTPUT:
-       allStar data[,xmatched table]
+       allStar data[,xmatched table] (a gaia_tools.load.colstore.ColumnCatalog with as_columns=True when astroNN distances or ages are added; use numpy.asarray to convert it to a structured array)
     HISTORY:
        2013-09-06 - Written - Bovy (IAS)
        2018-05-09 - Add xmatch - Bovy (UofT)
@@ -75,27 +84,39 @@ def apogee(xmatch=None,**kwargs):
     if not _APOGEE_LOADED:
         _warn_apogee_fallback()
         dr= kwargs.get('dr',14)
+        columns= kwargs.pop('columns',None)
+        as_columns= kwargs.pop('as_columns',False)
         filePath= path.apogeePath(dr=dr)
         if not os.path.exists(filePath):
             download.apogee(dr=dr)
-        data= fitsread(filePath,1)
+        # Also read the columns that we need internally
+        required_columns= []
+        if not xmatch is None:
+            required_columns.extend([kwargs.get('colRA','RA'),
+                                     kwargs.get('colDec','DEC')])
+        data= fitsread(filePath,1,
+                       columns=_add_columns(columns,required_columns))
         #Add astroNN? astroNN files matched line-by-line to allStar, 
         #so match here [ages not matched line-by-line...]
         if kwargs.get('use_astroNN',False) or kwargs.get('astroNN',False) \
                 or kwargs.get('use_astroNN_abundances'):
             _warn_astroNN_abundances()
-            astroNNdata= astroNN()
+            astroNNdata= astroNN(columns=['astroNN','astroNN_error'])
             data= _swap_in_astroNN(data,astroNNdata)
         if kwargs.get('use_astroNN',False) or kwargs.get('astroNN',False) \
                 or kwargs.get('use_astroNN_distances'):
             _warn_astroNN_distances()
-            astroNNDistancesdata= astroNNDistances()
-            data= _add_astroNN_distances(data,astroNNDistancesdata)
+            astroNNDistancesdata= astroNNDistances(\
+                columns=_ASTRONN_DISTANCES_FIELDS)
+            data= _add_astroNN_distances(data,astroNNDistancesdata,
+                                         as_columns=as_columns)
         if kwargs.get('use_astroNN',False) or kwargs.get('astroNN',False) \
                 or kwargs.get('use_astroNN_ages'):
             _warn_astroNN_ages()
-            astroNNAgesdata= astroNNAges()
-            data= _add_astroNN_ages(data,astroNNAgesdata)
+            astroNNAgesdata= astroNNAges(columns=_ASTRONN_AGES_FIELDS)
+            data= _add_astroNN_ages(data,astroNNAgesdata,
+                                    _astroNN_ages_index(filePath,dr=dr),
+                                    as_columns=as_columns)
         if not xmatch is None:
             matchFilePath= filePath
             kwargs.pop('use_astroNN',False)
@@ -104,13 +125,14 @@ def apogee(xmatch=None,**kwargs):
             kwargs.pop('use_astroNN_ages',False)
             kwargs.pop('astroNN',False)
             ma,mai= _xmatch_cds(data,xmatch,matchFilePath,**kwargs)
-            return (data[mai],ma)
+            return (_drop_columns(data[mai],columns,required_columns),ma)
         else:
-            return data
+            return _drop_columns(data,columns,required_columns)
     else:
         kwargs['xmatch']= xmatch
         return apread.allStar(**kwargs)
 
+@memcache.memoize(lambda a: _apogee_sources(path.apogeercPath,a))
 def apogeerc(xmatch=None,**kwargs):
     """
     NAME:
@@ -121,6 +143,8 @@ def apogeerc(xmatch=None,**kwargs):
        IF the apogee package is not installed:
            dr= (14) SDSS data release
            use_astroNN= (False) if True, swap in astroNN (Leung & Bovy 2019a) parameters (get placed in, e.g., TEFF and TEFF_ERR) and add astroNN distances (Leung & Bovy 2019b) and ages (Mackereth, Bovy, Leung, et al. 2019); use 'use_astroNN_abundances', 'use_astroNN_distances', and 'use_astroNN_ages' to only add abundances, distances, or ages respectively
+           columns= (None) if set, only read these columns (any astroNN distances and ages are added to these)
+           as_columns= (False) if True and astroNN distances or ages are added, return a gaia_tools.load.colstore.ColumnCatalog to which the astroNN columns are attached, which shares the memory of the catalog read from disk, rather than a structured array into which the catalog is copied
 
        ELSE you can use the same keywords as apogee.tools.read.rcsample:
 
@@ -132,7 +156,7 @@ def apogeerc(xmatch=None,**kwargs):
        xmatch= (None) if set, cross-match against a Vizier catalog (e.g., vizier:I/345/gaia2 for Gaia DR2 or vizier:I/350/gaiaedr3 for Gaia EDR3) using gaia_tools.xmatch.cds and return the overlap
        +gaia_tools.xmatch.cds keywords
     OUTPUT:
-       APOGEE RC sample data[,xmatched table]
+       APOGEE RC sample data[,xmatched table] (a gaia_tools.load.colstore.ColumnCatalog with as_columns=True when astroNN distances or ages are added; use numpy.asarray to convert it to a structured array)
     HISTORY:
        2013-10-08 - Written - Bovy (IAS)
        2018-05-09 - Add xmatch - Bovy (UofT)
@@ -140,41 +164,52 @@ def apogeerc(xmatch=None,**kwargs):
     if not _APOGEE_LOADED:
         _warn_apogee_fallback()
         dr= kwargs.get('dr',14)
+        columns= kwargs.pop('columns',None)
+        as_columns= kwargs.pop('as_columns',False)
         filePath= path.apogeercPath(dr=dr)
         if not os.path.exists(filePath):
             download.apogeerc(dr=dr)
-        data= fitsread(filePath,1)
+        # Also read the columns that we need internally
+        required_columns= []
+        if not xmatch is None:
+            required_columns.extend([kwargs.get('colRA','RA'),
+                                     kwargs.get('colDec','DEC')])
+        data= fitsread(filePath,1,
+                       columns=_add_columns(columns,required_columns))
+        # Rows of the RC file that remain after matching to astroNN
+        rows= numpy.arange(len(data))
         # Swap in astroNN results?
         if kwargs.get('use_astroNN',False) or kwargs.get('astroNN',False) \
                 or kwargs.get('use_astroNN_abundances'):
             _warn_astroNN_abundances()
-            astroNNdata= astroNN()
+            astroNNdata= astroNN(columns=['astroNN','astroNN_error'])
             # Match on (ra,dec)
-            from gaia_tools.xmatch import xmatch as gxmatch
-            m1,m2,_= gxmatch(data,astroNNdata,maxdist=2.,
-                             colRA1='RA',colDec1='DEC',epoch1=2000.,
-                             colRA2='RA',colDec2='DEC',epoch2=2000.)
+            m1,m2= _xmatch_astroNN(filePath,path.astroNNPath(dr=dr),rows,
+                                   colRA2='RA',colDec2='DEC',maxdist=2.)
             data= data[m1]
+            rows= rows[m1]
             astroNNdata= astroNNdata[m2]
             data= _swap_in_astroNN(data,astroNNdata)
         if kwargs.get('use_astroNN',False) or kwargs.get('astroNN',False) \
                 or kwargs.get('use_astroNN_distances'):
             _warn_astroNN_distances()
-            astroNNdata= astroNNDistances()
+            astroNNdata= astroNNDistances(columns=_ASTRONN_DISTANCES_FIELDS)
             # Match on (ra,dec)
-            from gaia_tools.xmatch import xmatch as gxmatch
-            m1,m2,_= gxmatch(data,astroNNdata,maxdist=2.,
-                             colRA1='RA',colDec1='DEC',epoch1=2000.,
-                             colRA2='ra_apogee',colDec2='dec_apogee',
-                             epoch2=2000.)
+            m1,m2= _xmatch_astroNN(filePath,path.astroNNDistancesPath(dr=dr),
+                                   rows,colRA2='ra_apogee',
+                                   colDec2='dec_apogee',maxdist=2.)
             data= data[m1]
+            rows= rows[m1]
             astroNNdata= astroNNdata[m2]
-            data= _add_astroNN_distances(data,astroNNdata)
+            data= _add_astroNN_distances(data,astroNNdata,
+                                         as_columns=as_columns)
         if kwargs.get('use_astroNN',False) or kwargs.get('astroNN',False) \
                 or kwargs.get('use_astroNN_ages'):
             _warn_astroNN_ages()
-            astroNNAgesdata= astroNNAges()
-            data= _add_astroNN_ages(data,astroNNAgesdata)
+            astroNNAgesdata= astroNNAges(columns=_ASTRONN_AGES_FIELDS)
+            data= _add_astroNN_ages(data,astroNNAgesdata,
+                                    _astroNN_ages_index(filePath,dr=dr)[rows],
+                                    as_columns=as_columns)
         if not xmatch is None:
             if kwargs.get('use_astroNN',False) or kwargs.get('astroNN',False):
                 matchFilePath= filePath.replace('rc-','rc-astroNN-')
@@ -192,13 +227,14 @@ def apogeerc(xmatch=None,**kwargs):
             kwargs.pop('use_astroNN_ages',False)
             kwargs.pop('astroNN',False)           
             ma,mai= _xmatch_cds(data,xmatch,matchFilePath,**kwargs)
-            return (data[mai],ma)
+            return (_drop_columns(data[mai],columns,required_columns),ma)
         else:
-            return data
+            return _drop_columns(data,columns,required_columns)
     else:
         kwargs['xmatch']= xmatch
         return apread.rcsample(**kwargs)
   
+@memcache.memoize(lambda a: _apogee_sources(path.astroNNPath,a))
 def astroNN(**kwargs):
     """
     NAME:
@@ -207,6 +243,7 @@ def astroNN(**kwargs):
        read the astroNN file (Leung & Bovy 2019a)
     INPUT:
        dr= data reduction to load the catalog for (automatically set based on APOGEE_REDUX if not given explicitly)
+       columns= (None) if set, only read these columns (only when the apogee package is not installed)
     OUTPUT:
        astroNN data
     HISTORY:
@@ -218,11 +255,13 @@ def astroNN(**kwargs):
         filePath= path.astroNNPath(dr=dr)
         if not os.path.exists(filePath):
             download.astroNN(dr=dr)
-        data= fitsread(filePath,1)
+        data= fitsread(filePath,1,columns=kwargs.get('columns'))
         return data
     else:
         return apread.astroNN(**kwargs)
 
+@memcache.memoize(\
+    lambda a: _apogee_sources(path.astroNNDistancesPath,a))
 def astroNNDistances(**kwargs):
     """
     NAME:
@@ -231,6 +270,7 @@ def astroNNDistances(**kwargs):
        read the astroNNDistances file (Leung & Bovy 2019b)
     INPUT:
        dr= data reduction to load the catalog for (automatically set based on APOGEE_REDUX if not given explicitly)
+       columns= (None) if set, only read these columns (only when the apogee package is not installed)
     OUTPUT:
        astroNN data
     HISTORY:
@@ -242,11 +282,12 @@ def astroNNDistances(**kwargs):
         filePath= path.astroNNDistancesPath(dr=dr)
         if not os.path.exists(filePath):
             download.astroNNDistances(dr=dr)
-        data= fitsread(filePath,1)
+        data= fitsread(filePath,1,columns=kwargs.get('columns'))
         return data
     else:
         return apread.astroNNDistances(**kwargs)
 
+@memcache.memoize(lambda a: _apogee_sources(path.astroNNAgesPath,a))
 def astroNNAges(**kwargs):
     """
     NAME:
@@ -255,6 +296,7 @@ def astroNNAges(**kwargs):
        read the astroNNAges file (Mackereth, Bovy, Leung, et al. 2019)
     INPUT:
        dr= data reduction to load the catalog for (automatically set based on APOGEE_REDUX if not given explicitly)
+       columns= (None) if set, only read these columns (only when the apogee package is not installed)
     OUTPUT:
        astroNN data
     HISTORY:
@@ -266,12 +308,14 @@ def astroNNAges(**kwargs):
         filePath= path.astroNNAgesPath(dr=dr)
         if not os.path.exists(filePath):
             download.astroNNAges(dr=dr)
-        data= fitsread(filePath,1)
+        data= fitsread(filePath,1,columns=kwargs.get('columns'))
         return data
     else:
         return apread.astroNNAges(**kwargs)
 
-def gaiarv(dr=2):
+@memcache.memoize(lambda a: path.gaiarvPath(dr=a['dr'],format='fits'))
+def gaiarv(dr=2,columns=None,where=None,memmap=False,nthreads=None,
+           lazy=False):
     """
     NAME:
        gaiarv
@@ -279,21 +323,116 @@ def gaiarv(dr=2):
        Load the RV subset of the Gaia data
     INPUT:
        dr= (2) data release
+       columns= (None) if set, only load these columns
+       where= (None) if set, only load the rows for which this selection is True; either a function that takes the (structured-array-like) data and returns a boolean array or a string expression in terms of the column names, e.g., 'parallax_over_error > 10' (expressions are parsed, not run as Python code, and can only contain column names, numbers, comparisons, arithmetic, and/or/not or &/|/~, and calls of numpy ufuncs and a few other numpy functions as numpy.X; use a function for anything else); the selection is applied shard by shard, such that the full catalog is never in memory
+       memmap= (False) if True, return a ColumnCatalog of read-only, memory-mapped columns from the consolidated column store (fast and shared between processes, nothing is copied into memory), rather than a masked structured array (which copies the data into memory)
+       nthreads= (None) number of threads used to read the FITS shards in parallel when building the column store (default: number of CPUs)
+       lazy= (False) if True, return a LazyCatalog that only reads a column (from the column store if it exists, otherwise from the FITS shards) when it is first accessed
     OUTPUT:
-       data table
+       data table (a masked structured array, like the one returned by numpy.lib.recfunctions.stack_arrays, with nothing masked; a ColumnCatalog with memmap=True)
     HISTORY:
        2018-04-25 - Written for DR2 - Bovy (UofT)
+       2026-10-16 - Read from consolidated column store - Bovy (UofT)
     """
     filePaths= path.gaiarvPath(dr=dr,format='fits')
-    if not numpy.all([os.path.exists(filePath) for filePath in filePaths]):
+    if not manifest.has_files(filePaths):
         download.gaiarv(dr=dr)
-    return numpy.lib.recfunctions.stack_arrays(\
-        [fitsread(filePath,ext=1) for filePath in filePaths],
-        autoconvert=True)
+    return _load_shards(filePaths,path.gaiarvStorePath(dr=dr),
+                        columns=columns,where=where,memmap=memmap,
+                        nthreads=nthreads,lazy=lazy)
+
+def iter_gaia_source(dr=2,format=None,columns=None,where=None,
+                     chunk_rows=1000000,nprefetch=2,refresh=False):
+    """
+    NAME:
+       iter_gaia_source
+    PURPOSE:
+       iterate over the locally-available part of the full gaia_source catalog in chunks with a fixed number of rows, while the next files are read in the background (such that a pass over the full catalog uses a constant amount of memory)
+    INPUT:
+       dr= (2) data release
+       format= (None) format of the local files: 'fits' or 'csv' (default: 'fits' for DR1, 'csv' for DR2)
+       columns= (None) if set, only read these columns
+       where= (None) if set, only return the rows for which this selection is True (see tgas)
+       chunk_rows= (1000000) number of rows in each chunk (the last chunk may be smaller)
+       nprefetch= (2) number of files to read ahead in the background
+       refresh= (False) if True, rescan the data directory for the available files rather than trusting its manifest
+    OUTPUT:
+       generator of structured arrays
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    if format is None:
+        if dr == 1 or dr == '1': format= 'fits'
+        else: format= 'csv'
+    filePaths= path.gaiaSourcePath(dr=dr,format=format,refresh=refresh)
+    filePaths= sorted([filePath for filePath,present
+                       in zip(filePaths,manifest.present(filePaths))
+                       if present],key=_gaia_source_sort_key)
+    if len(filePaths) == 0:
+        raise IOError('No gaia_source files for DR{} in {} format found under {}; download these first'.format(dr,format,path._GAIA_TOOLS_DATA))
+    def _read_all():
+        dtype= None # All chunks get the dtype of the first file
+        for filePath in filePaths:
+            data= _read_gaia_source_file(filePath,format,columns=columns,
+                                         dtype=dtype)
+            dtype= data.dtype
+            if not where is None:
+                data= data[_where_mask(where,data)]
+            yield data
+    chunks= []
+    nchunk= 0
+    for data in prefetch(_read_all(),nprefetch=nprefetch):
+        while len(data) > 0:
+            ntake= min(chunk_rows-nchunk,len(data))
+            chunks.append(data[:ntake])
+            nchunk+= ntake
+            data= data[ntake:]
+            if nchunk == chunk_rows:
+                yield numpy.concatenate(chunks)
+                chunks= []
+                nchunk= 0
+    if nchunk > 0:
+        yield numpy.concatenate(chunks)
+
+def _gaia_source_sort_key(filePath):
+    # DR1: GaiaSource_000-XXX-YYY, DR2: GaiaSource_SOURCEIDMIN_SOURCEIDMAX
+    name= os.path.basename(filePath).split('.')[0]
+    try:
+        return (int(name.split('_')[1]),name)
+    except ValueError:
+        return (0,name)
+
+def _read_gaia_source_file(filePath,format,columns=None,dtype=None):
+    if format == 'csv':
+        data= astropy.io.ascii.read(filePath,format='csv',
+                                    include_names=columns)
+    else:
+        data= fitsread(filePath,1,columns=columns)
+    return _as_plain_array(data,dtype=dtype)
 
+def _as_plain_array(data,dtype=None):
+    """Convert a FITS_rec, (masked) astropy Table, or structured array to a plain structured array with the given dtype, filling masked entries"""
+    names= data.dtype.names if dtype is None else dtype.names
+    if dtype is None:
+        dtype= numpy.dtype([(name,data[name].dtype,data[name].shape[1:])
+                            for name in names])
+    out= numpy.empty(len(data),dtype=dtype)
+    for name in names:
+        col= data[name]
+        fieldtype= dtype.fields[name][0]
+        fill= _fill_value(fieldtype)
+        if numpy.ma.is_masked(col) and numpy.all(col.mask):
+            out[name]= fill
+        elif numpy.ma.isMaskedArray(col):
+            out[name]= numpy.ma.asarray(col).astype(fieldtype.base).filled(fill)
+        else:
+            out[name]= col
+    return out
+
+@memcache.memoize(lambda a: _galah_sources(a))
 def galah(dr=3,ages=False,ages_join_type='inner',
           dynamics=False,dynamics_join_type='inner',
-          xmatch=None,**kwargs):
+          columns=None,xmatch=None,**kwargs):
     """
     NAME:
        galah
@@ -302,18 +441,20 @@ def galah(dr=3,ages=False,ages_join_type='inner',
     INPUT:
        dr= (2) data release
        ages= (False; DR >= 3) if True, add ages and other info from VAC
-       ages_join_type= ('inner') type of table join to do between the main catalog and the ages VAC: 'inner' returns only the overlap, 'left' returns all main with masked ages VAC entries for those not in the overlap
+       ages_join_type= ('inner') type of table join to do between the main catalog and the ages VAC: 'inner' returns only the overlap, 'left' returns all main with ages VAC entries filled with NaN (or numpy.ma's default fill value for non-floating-point columns) for those not in the overlap
        dynamics= (False; DR >= 3) if True, add dynamics info from VAC
-       dynamics_join_type= ('inner') type of table join to do between the main catalog and the dynamics VAC: 'inner' returns only the overlap, 'left' returns all main with masked dynamics VAC entries for those not in the overlap. Note that in DR3 at least, all main catalog entries are in the dynamics VAC, so the type of merge doesn't matter
+       dynamics_join_type= ('inner') type of table join to do between the main catalog and the dynamics VAC: 'inner' returns only the overlap, 'left' returns all main with dynamics VAC entries filled with NaN (or numpy.ma's default fill value for non-floating-point columns) for those not in the overlap. Note that in DR3 at least, all main catalog entries are in the dynamics VAC, so the type of merge doesn't matter
+       columns= (None) if set, only load these columns (can include columns from the ages and dynamics VACs)
        xmatch= (None) if set, cross-match against a Vizier catalog (e.g., vizier:I/345/gaia2 for Gaia DR2 or vizier:I/350/gaiaedr3 for Gaia EDR3) using gaia_tools.xmatch.cds and return the overlap
        +gaia_tools.xmatch.cds keywords
     OUTPUT:
-       data table[,xmatched table]
+       data table[,xmatched table]; when joining VACs, this is a structured array in the order of the main catalog
     HISTORY:
        2016-09-12 - Written - Bovy (UofT)
        2018-04-19 - Updated for DR2 - Bovy (UofT)
        2018-05-08 - Add xmatch - Bovy (UofT)
        2020-11-11 - Updated for DR3 and added ages/dynamics VACs - Bovy (UofT)
+       2026-10-16 - Join VACs with a persistent key index instead of astropy.table.join - Bovy (UofT)
     """
     if dr == 1 or dr == '1':
         filePath, ReadMePath= path.galahPath(dr=dr)
@@ -321,28 +462,55 @@ def galah(dr=3,ages=False,ages_join_type='inner',
         filePath= path.galahPath(dr=dr)
     if not os.path.exists(filePath):
         download.galah(dr=dr)
+    # Also read the columns that we need internally
+    required_columns= []
+    if ages or dynamics:
+        required_columns.append('sobject_id')
+    if not xmatch is None:
+        if dr == 1  or dr == '1':
+            required_columns.extend([kwargs.get('colRA','RA'),
+                                     kwargs.get('colDec','dec')])
+        elif dr == 2  or dr == '2':
+            required_columns.extend([kwargs.get('colRA','raj2000'),
+                                     kwargs.get('colDec','dej2000')])
+        else:
+            required_columns.extend([kwargs.get('colRA','ra'),
+                                     kwargs.get('colDec','dec')])
+    read_columns= _add_columns(columns,required_columns)
     if dr == 1  or dr == '1':
-        data= astropy.io.ascii.read(filePath,readme=ReadMePath)
-        data['RA']._fill_value= numpy.array([-9999.99])
-        data['dec']._fill_value= numpy.array([-9999.99])
+        data= _read_text_catalog(\
+            filePath,[filePath,ReadMePath],
+            lambda: astropy.io.ascii.read(filePath,readme=ReadMePath),
+            columns=read_columns)
+        if 'RA' in data.colnames:
+            data['RA']._fill_value= numpy.array([-9999.99])
+        if 'dec' in data.colnames:
+            data['dec']._fill_value= numpy.array([-9999.99])
     else:
-        data= fitsread(filePath,1)
+        main_columns= _columns_in_file(filePath,read_columns)
+        data= fitsread(filePath,1,columns=main_columns)
     if ages:
         filePath= path.galahAgesPath(dr=dr)
         if not os.path.exists(filePath):
             download.galah(dr=dr,ages=True)
-        ages= fitsread(filePath,1)
-        data= table_join(data,ages,keys='sobject_id',
-                         metadata_conflicts='silent',
-                         join_type=ages_join_type)
+        ages= fitsread(filePath,1,
+                       columns=_vac_columns(filePath,read_columns,
+                                            data.dtype.names))
+        data= join.join(data,ages,'sobject_id',join_type=ages_join_type,
+                        index2=_key_index(filePath,ages,'sobject_id'))
     if dynamics:
         filePath= path.galahDynamicsPath(dr=dr)
         if not os.path.exists(filePath):
             download.galah(dr=dr,dynamics=True)
-        dynamics= fitsread(filePath,1)
-        data= table_join(data,dynamics,keys='sobject_id',
-                         metadata_conflicts='silent',
-                         join_type=dynamics_join_type)
+        dynamics= fitsread(filePath,1,
+                           columns=_vac_columns(filePath,read_columns,
+                                                data.dtype.names))
+        data= join.join(data,dynamics,'sobject_id',
+                        join_type=dynamics_join_type,
+                        index2=_key_index(filePath,dynamics,'sobject_id'))
+    if not dr == 1 and not dr == '1':
+        # Requested columns that are in none of the files that were read
+        _check_columns(data.dtype.names,read_columns)
     if not xmatch is None:
         if dr == 1  or dr == '1':
             kwargs['colRA']= kwargs.get('colRA','RA')
@@ -354,11 +522,12 @@ def galah(dr=3,ages=False,ages_join_type='inner',
             kwargs['colRA']= kwargs.pop('colRA','ra')
             kwargs['colDec']= kwargs.pop('colDec','dec')
         ma,mai= _xmatch_cds(data,xmatch,filePath,**kwargs)
-        return (data[mai],ma)
+        return (_drop_columns(data[mai],columns,required_columns),ma)
     else:
-        return data
+        return _drop_columns(data,columns,required_columns)
 
-def lamost(dr=2,cat='all'):
+@memcache.memoize(lambda a: [path.lamostPath(dr=a['dr'],cat=a['cat'])])
+def lamost(dr=2,cat='all',columns=None,lazy=False):
     """
     NAME:
        lamost
@@ -367,6 +536,8 @@ def lamost(dr=2,cat='all'):
     INPUT:
        dr= (2) data release
        cat= ('all') 'all', 'A', 'M', 'star' (see LAMOST docs)
+       columns= (None) if set, only read these columns
+       lazy= (False) if True, return a LazyCatalog that only reads a column when it is first accessed
     OUTPUT:
        data table
     HISTORY:
@@ -375,9 +546,12 @@ def lamost(dr=2,cat='all'):
     filePath= path.lamostPath(dr=dr,cat=cat)
     if not os.path.exists(filePath):
         download.lamost(dr=dr,cat=cat)
-    data= fitsread(filePath,1)
+    if lazy: return _lazy_fitsread(filePath,columns=columns)
+    data= fitsread(filePath,1,columns=columns)
     return data
 
+@memcache.memoize(lambda a: [p for p in path.ravePath(dr=a['dr'])
+                                 if not p is None])
 def rave(dr=5, usecols=None):
     """
     NAME:
@@ -391,20 +565,32 @@ def rave(dr=5, usecols=None):
        data table
     HISTORY:
        2016-09-12 - Written - Bovy (UofT)
+       2026-10-16 - Parse the text catalog only once and keep a binary copy - Bovy (UofT)
     """
     filePath, ReadMePath= path.ravePath(dr=dr)
     if not os.path.exists(filePath):
         download.rave(dr=dr)
     if dr == 4:
-        data= astropy.io.ascii.read(filePath,readme=ReadMePath)
+        data= _read_text_catalog(\
+            filePath,[filePath,ReadMePath],
+            lambda: astropy.io.ascii.read(filePath,readme=ReadMePath))
+    elif dr == 5 and usecols \
+            and not colstore.is_current(_store_path(filePath),[filePath]):
+        # Only parse the requested columns; the binary copy of the full
+        # catalog is written the next time that all columns are loaded
+        data= numpy.genfromtxt(filePath,delimiter=',', names=True, usecols=usecols)
     elif dr == 5:
+        data= _read_text_catalog(\
+            filePath,[filePath],
+            lambda: numpy.genfromtxt(filePath,delimiter=',', names=True))
         if usecols:
-            data= numpy.genfromtxt(filePath,delimiter=',', names=True, usecols=usecols)
-        else:
-            data= numpy.genfromtxt(filePath,delimiter=',', names=True)
+            data= numpy.lib.recfunctions.repack_fields(\
+                data[[c if isinstance(c,str) else data.dtype.names[c]
+                      for c in usecols]])
     return data
 
-def raveon(dr=5):
+@memcache.memoize(lambda a: [path.raveonPath(dr=a['dr'])])
+def raveon(dr=5,columns=None,lazy=False):
     """
     NAME:
        raveon
@@ -412,6 +598,8 @@ def raveon(dr=5):
        Load the RAVE-on data
     INPUT:
        dr= (5) RAVE data release
+       columns= (None) if set, only read these columns
+       lazy= (False) if True, return a LazyCatalog that only reads a column when it is first accessed
     OUTPUT:
        data table
     HISTORY:
@@ -420,10 +608,13 @@ def raveon(dr=5):
     filePath= path.raveonPath(dr=dr)
     if not os.path.exists(filePath):
         download.raveon(dr=dr)
-    data= fitsread(filePath,1)
+    if lazy: return _lazy_fitsread(filePath,columns=columns)
+    data= fitsread(filePath,1,columns=columns)
     return data
 
-def tgas(dr=1):
+@memcache.memoize(lambda a: path.tgasPath(dr=a['dr']))
+def tgas(dr=1,columns=None,where=None,memmap=False,nthreads=None,
+         lazy=False):
     """
     NAME:
        tgas
@@ -431,17 +622,300 @@ def tgas(dr=1):
        Load the TGAS data
     INPUT:
        dr= (1) data release
+       columns= (None) if set, only load these columns
+       where= (None) if set, only load the rows for which this selection is True; either a function that takes the (structured-array-like) data and returns a boolean array or a string expression in terms of the column names, e.g., 'parallax_over_error > 10' (expressions are parsed, not run as Python code, and can only contain column names, numbers, comparisons, arithmetic, and/or/not or &/|/~, and calls of numpy ufuncs and a few other numpy functions as numpy.X; use a function for anything else); the selection is applied shard by shard, such that the full catalog is never in memory
+       memmap= (False) if True, return a ColumnCatalog of read-only, memory-mapped columns from the consolidated column store (fast and shared between processes, nothing is copied into memory), rather than a masked structured array (which copies the data into memory)
+       nthreads= (None) number of threads used to read the FITS shards in parallel when building the column store (default: number of CPUs)
+       lazy= (False) if True, return a LazyCatalog that only reads a column (from the column store if it exists, otherwise from the FITS shards) when it is first accessed
     OUTPUT:
-       data table
+       data table (a masked structured array, like the one returned by numpy.lib.recfunctions.stack_arrays, with nothing masked; a ColumnCatalog with memmap=True)
     HISTORY:
        2016-09-14 - Written - Bovy (UofT)
+       2026-10-16 - Read from consolidated column store - Bovy (UofT)
     """
     filePaths= path.tgasPath(dr=dr)
-    if not numpy.all([os.path.exists(filePath) for filePath in filePaths]):
+    if not manifest.has_files(filePaths):
         download.tgas(dr=dr)
-    return numpy.lib.recfunctions.stack_arrays(\
-        [fitsread(filePath,ext=1) for filePath in filePaths],
-        autoconvert=True)
+    return _load_shards(filePaths,path.tgasStorePath(dr=dr),
+                        columns=columns,where=where,memmap=memmap,
+                        nthreads=nthreads,lazy=lazy)
+
+def _load_shards(filePaths,storePath,columns=None,where=None,memmap=False,
+                 nthreads=None,lazy=False):
+    """Load a catalog split over many FITS shards, through the consolidated column store that is built upon first use"""
+    if lazy:
+        return _lazy_shards(filePaths,storePath,columns=columns,where=where,
+                            nthreads=nthreads)
+    if not colstore.is_current(storePath,filePaths):
+        try:
+            # Only one process builds the store, the others wait for it
+            with _lock.file_lock(storePath):
+                if not colstore.is_current(storePath,filePaths):
+                    colstore.write_shards(storePath,filePaths,
+                                          nthreads=nthreads)
+        except OSError as e:
+            warnings.warn("Could not build the column store at {} ({}); reading the FITS shards directly".format(storePath,e))
+            data= _read_shards(filePaths,columns=columns,where=where,
+                               nthreads=nthreads)
+            if memmap: return colstore.ColumnCatalog.from_array(data)
+            else: return numpy.ma.MaskedArray(data,copy=False)
+    store= colstore.read(storePath,columns=columns,memmap=True)
+    if where is None:
+        indx= slice(None)
+    else:
+        # Evaluate the selection shard-by-shard on the memory-mapped
+        # columns, such that only the columns that it uses get read
+        indx= numpy.concatenate(\
+            [offset+numpy.flatnonzero(_where_mask(where,shard))
+             for offset,shard in colstore.iter_shards(storePath)])
+    if memmap: return store if where is None else store[indx]
+    # Copy the selected rows of each column straight into the output, which
+    # is a masked array like the one returned by stack_arrays before
+    data= numpy.empty(len(store) if where is None else len(indx),
+                      dtype=store.dtype)
+    for name in store.keys():
+        data[name]= store[name][indx]
+    return numpy.ma.MaskedArray(data,copy=False)
+
+def _lazy_shards(filePaths,storePath,columns=None,where=None,nthreads=None):
+    """LazyCatalog of a catalog split over many FITS shards, reading columns from the column store if it is current and from the shards otherwise"""
+    if colstore.is_current(storePath,filePaths):
+        store= colstore.read(storePath,memmap=True)
+        out= colstore.LazyCatalog(store.dtype,len(store),
+                                  lambda name: numpy.array(store[name]))
+    else:
+        out= colstore.LazyCatalog(\
+            _fits.common_dtype(filePaths,ext=1),
+            sum(manifest.nrows(filePaths)),
+            lambda name: _fits.read_shards(filePaths,ext=1,columns=[name],
+                                           nthreads=nthreads)[name])
+    # Only reads the columns that the selection uses
+    mask= None if where is None else _where_mask(where,out)
+    if not columns is None: out= out[list(columns)]
+    if mask is None: return out
+    else: return out[mask]
+
+def _lazy_fitsread(filePath,columns=None):
+    """LazyCatalog of a FITS table"""
+    dtype= _fits.dtype(filePath,ext=1)
+    if not columns is None:
+        dtype= numpy.dtype([(name,dtype.fields[name][0]) for name in columns])
+    return colstore.LazyCatalog(dtype,_fits.nrows(filePath,ext=1),
+                                lambda name: fitsread(filePath,1,
+                                                      columns=[name])[name])
+
+def _read_shards(filePaths,columns=None,where=None,nthreads=None):
+    """Read and stack FITS shards in parallel, applying the where selection to each shard as it is read"""
+    if where is None:
+        return _fits.read_shards(filePaths,ext=1,columns=columns,
+                                 nthreads=nthreads)
+    def _read_one(filePath):
+        shard= fitsread(filePath,ext=1)
+        mask= _where_mask(where,shard)
+        names= shard.dtype.names if columns is None else columns
+        out= numpy.empty(numpy.sum(mask),
+                         dtype=[(name,shard[name].dtype,shard[name].shape[1:])
+                                for name in names])
+        for name in names:
+            out[name]= shard[name][mask]
+        return out
+    if nthreads is None:
+        nthreads= os.cpu_count() or 1
+    with ThreadPoolExecutor(max(1,min(nthreads,len(filePaths)))) as executor:
+        out= list(executor.map(_read_one,filePaths))
+    return numpy.lib.recfunctions.stack_arrays(out,autoconvert=True,
+                                               usemask=False)
+
+def _where_mask(where,data):
+    """Evaluate a row selection, either a function of the data or a string expression in terms of the column names (e.g., 'parallax_over_error > 10'); string expressions are parsed rather than run, and can only contain column names, numbers, comparisons, arithmetic, boolean operators (and/or/not or &/|/~), and calls of numpy ufuncs or the numpy functions in _WHERE_FUNCTIONS as numpy.X"""
+    if callable(where):
+        mask= where(data)
+    else:
+        try:
+            tree= ast.parse(where.strip(),mode='eval')
+        except SyntaxError as e:
+            raise ValueError("Invalid where= selection {!r} ({})".format(where,e))
+        mask= _where_eval(tree.body,data,where)
+    mask= numpy.asarray(mask)
+    if mask.dtype != bool or mask.shape != (len(data),):
+        raise ValueError("where= selection must return a boolean array with one entry per row")
+    return mask
+
+_WHERE_FUNCTIONS= ['isin','where','clip','round','all','any','sum','mean',
+                   'nanmean','median','nanmedian','std','nanstd','min',
+                   'nanmin','max','nanmax','percentile','nanpercentile']
+_WHERE_OPERATORS= {ast.Add:numpy.add,ast.Sub:numpy.subtract,
+                   ast.Mult:numpy.multiply,ast.Div:numpy.true_divide,
+                   ast.FloorDiv:numpy.floor_divide,ast.Mod:numpy.mod,
+                   ast.Pow:numpy.power,ast.BitAnd:numpy.bitwise_and,
+                   ast.BitOr:numpy.bitwise_or,ast.BitXor:numpy.bitwise_xor,
+                   ast.USub:numpy.negative,ast.UAdd:numpy.positive,
+                   ast.Invert:numpy.invert,ast.Not:numpy.logical_not,
+                   ast.And:numpy.logical_and,ast.Or:numpy.logical_or,
+                   ast.Eq:numpy.equal,ast.NotEq:numpy.not_equal,
+                   ast.Lt:numpy.less,ast.LtE:numpy.less_equal,
+                   ast.Gt:numpy.greater,ast.GtE:numpy.greater_equal}
+def _where_eval(node,data,where):
+    """Evaluate a node of a parsed where= expression, allowing only the operations listed in _where_mask"""
+    if isinstance(node,ast.Name):
+        if not node.id in data.dtype.names:
+            raise ValueError("Unknown column {!r} in where= selection {!r}".format(node.id,where))
+        return data[node.id]
+    elif isinstance(node,ast.Constant) \
+            and isinstance(node.value,(bool,int,float,str,bytes)):
+        return node.value
+    elif isinstance(node,ast.BinOp) and type(node.op) in _WHERE_OPERATORS:
+        return _WHERE_OPERATORS[type(node.op)](\
+            _where_eval(node.left,data,where),
+            _where_eval(node.right,data,where))
+    elif isinstance(node,ast.UnaryOp) and type(node.op) in _WHERE_OPERATORS:
+        return _WHERE_OPERATORS[type(node.op)](\
+            _where_eval(node.operand,data,where))
+    elif isinstance(node,ast.BoolOp):
+        out= _where_eval(node.values[0],data,where)
+        for value in node.values[1:]:
+            out= _WHERE_OPERATORS[type(node.op)](\
+                out,_where_eval(value,data,where))
+        return out
+    elif isinstance(node,ast.Compare) \
+            and all([type(op) in _WHERE_OPERATORS for op in node.ops]):
+        # Chained comparisons (a < b < c) are combined with and
+        left= _where_eval(node.left,data,where)
+        out= True
+        for op,comparator in zip(node.ops,node.comparators):
+            right= _where_eval(comparator,data,where)
+            out= numpy.logical_and(out,_WHERE_OPERATORS[type(op)](left,right))
+            left= right
+        return out
+    elif isinstance(node,ast.Attribute) and _is_numpy_attribute(node) \
+            and isinstance(getattr(numpy,node.attr),float): # e.g., numpy.pi
+        return getattr(numpy,node.attr)
+    elif isinstance(node,ast.Call) and _is_numpy_attribute(node.func) \
+            and (isinstance(getattr(numpy,node.func.attr),numpy.ufunc)
+                 or node.func.attr in _WHERE_FUNCTIONS) \
+            and not any([isinstance(arg,ast.Starred) for arg in node.args]) \
+            and not any([keyword.arg is None for keyword in node.keywords]):
+        return getattr(numpy,node.func.attr)(\
+            *[_where_eval(arg,data,where) for arg in node.args],
+            **dict([(keyword.arg,_where_eval(keyword.value,data,where))
+                    for keyword in node.keywords]))
+    raise ValueError("{!r} is not allowed in where= selection {!r}; use a function of the data for more complex selections".format(ast.get_source_segment(where.strip(),node) or type(node).__name__,where))
+
+def _is_numpy_attribute(node):
+    return isinstance(node,ast.Attribute) and isinstance(node.value,ast.Name) \
+        and node.value.id == 'numpy' and not node.attr.startswith('_') \
+        and hasattr(numpy,node.attr)
+
+def _apogee_sources(pathFunc,arguments):
+    """Files read by the APOGEE loaders, for memcache"""
+    dr= arguments.get('dr',14)
+    out= [pathFunc(dr=dr)]
+    if dr == 14 and pathFunc in [path.apogeePath,path.apogeercPath]:
+        if arguments.get('use_astroNN',False) \
+                or arguments.get('astroNN',False):
+            out.extend([path.astroNNPath(dr=dr),
+                        path.astroNNDistancesPath(dr=dr),
+                        path.astroNNAgesPath(dr=dr)])
+        else:
+            if arguments.get('use_astroNN_abundances',False):
+                out.append(path.astroNNPath(dr=dr))
+            if arguments.get('use_astroNN_distances',False):
+                out.append(path.astroNNDistancesPath(dr=dr))
+            if arguments.get('use_astroNN_ages',False):
+                out.append(path.astroNNAgesPath(dr=dr))
+    return out
+
+def _galah_sources(arguments):
+    """Files read by galah, for memcache"""
+    dr= arguments['dr']
+    if dr == 1 or dr == '1':
+        out= list(path.galahPath(dr=dr))
+    else:
+        out= [path.galahPath(dr=dr)]
+    if arguments['ages']:
+        out.append(path.galahAgesPath(dr=dr))
+    if arguments['dynamics']:
+        out.append(path.galahDynamicsPath(dr=dr))
+    return out
+
+def _store_path(filePath,suffix=''):
+    """Path of a column store derived from a catalog file (e.g., the binary copy of a text catalog or a key index)"""
+    # Only strip the extension, such that, e.g., GALAH_DR2.1_catalog.fits and
+    # GALAH_DR2.2_catalog.fits do not share a store
+    return os.path.join(os.path.dirname(filePath),'npy',
+                        os.path.splitext(os.path.basename(filePath))[0]+suffix)
+
+def _key_index(filePath,data,key):
+    """Sort index of the key column of a catalog, stored next to the catalog file such that it only needs to be computed once"""
+    storePath= _store_path(filePath,'_{}_index'.format(key))
+    if colstore.is_current(storePath,[filePath]):
+        index= colstore.read(storePath,memmap=True)
+        return (index['sorter'],index['key'])
+    sorter,sorted_keys= join.sorted_index(data[key])
+    index= numpy.empty(len(sorter),dtype=[('sorter',sorter.dtype),
+                                          ('key',sorted_keys.dtype)])
+    index['sorter']= sorter
+    index['key']= sorted_keys
+    try:
+        colstore.write(storePath,index,[filePath])
+    except OSError as e:
+        warnings.warn("Could not store the {} index of {} in {} ({})".format(key,filePath,storePath,e))
+    return (sorter,sorted_keys)
+
+def _read_text_catalog(filePath,sources,read_func,columns=None):
+    """Read a text catalog through a binary copy that is written when the catalog is first parsed (with read_func) and re-written whenever the source files change"""
+    storePath= _store_path(filePath)
+    if colstore.is_current(storePath,sources):
+        return colstore.load(storePath,columns=columns)
+    data= read_func()
+    try:
+        colstore.write(storePath,data,sources)
+    except OSError as e:
+        warnings.warn("Could not write the binary copy of {} to {} ({})".format(filePath,storePath,e))
+    if columns is None:
+        return data
+    elif isinstance(data,numpy.ndarray):
+        return numpy.lib.recfunctions.repack_fields(data[columns])
+    else:
+        return data[columns]
+
+def _add_columns(columns,extra_columns):
+    """Columns to read: the requested columns plus any that we need internally"""
+    if columns is None: return None
+    return list(columns)+[col for col in extra_columns if not col in columns]
+
+def _drop_columns(data,columns,extra_columns):
+    """Remove the columns that were only read because we needed them internally"""
+    if columns is None: return data
+    drop= [col for col in set(extra_columns)
+           if not col in columns and col in data.dtype.names]
+    if len(drop) == 0: return data
+    if isinstance(data,numpy.ndarray):
+        return numpy.lib.recfunctions.drop_fields(data,drop,usemask=False)
+    elif isinstance(data,colstore.ColumnCatalog):
+        return data[[col for col in data.keys() if not col in drop]]
+    else: # astropy Table
+        data.remove_columns(drop)
+        return data
+
+def _columns_in_file(filePath,columns):
+    if columns is None: return None
+    names= _fits.dtype(filePath,ext=1).names
+    return [col for col in columns if col in names]
+
+def _check_columns(names,columns):
+    """Raise a KeyError for requested columns that are not in names"""
+    if columns is None: return None
+    missing= [col for col in columns if not col in names]
+    if len(missing) > 0:
+        raise KeyError("Columns {} not found".format(', '.join(missing)))
+    return None
+
+def _vac_columns(filePath,columns,main_names,key='sobject_id'):
+    """Columns to read from a VAC: the requested ones that are not already in the main catalog, plus the key to join on"""
+    if columns is None: return None
+    return [key]+[col for col in _columns_in_file(filePath,columns)
+                  if not col in main_names]
 
 def _xmatch_cds(data,xcat,filePath,**kwargs):
     if xcat.lower() == 'gaiadr2' or xcat.lower() == 'gaia2':
@@ -461,6 +935,40 @@ def _xmatch_cds(data,xcat,filePath,**kwargs):
         save_pickles(xmatch_filename,ma,mai)
     return (ma,mai)
 
+def _xmatch_astroNN(filePath,xcatPath,rows,colRA2='RA',colDec2='DEC',
+                    maxdist=2.):
+    """Sky cross-match of the rows (sorted indices) of filePath with xcatPath (an astroNN catalog); the match of the full files is cached on disk, keyed on the checksums of both files and maxdist; returns (index into rows, index into xcatPath)"""
+    checksums= (manifest.checksum(filePath),manifest.checksum(xcatPath))
+    cacheFilePath= astroNN_xmatch_cache_filename(filePath,xcatPath,maxdist)
+    m1= None
+    if os.path.exists(cacheFilePath):
+        with open(cacheFilePath,'rb') as savefile:
+            cached_checksums= pickle.load(savefile)
+            if cached_checksums == checksums:
+                m1= pickle.load(savefile)
+                m2= pickle.load(savefile)
+    if m1 is None:
+        from gaia_tools.xmatch import xmatch as gxmatch
+        m1,m2,_= gxmatch(fitsread(filePath,1,columns=['RA','DEC']),
+                         fitsread(xcatPath,1,columns=[colRA2,colDec2]),
+                         maxdist=maxdist,
+                         colRA1='RA',colDec1='DEC',epoch1=2000.,
+                         colRA2=colRA2,colDec2=colDec2,epoch2=2000.)
+        try:
+            save_pickles(cacheFilePath,checksums,m1,m2)
+        except OSError as e:
+            warnings.warn("Could not cache the astroNN cross-match in {} ({})".format(cacheFilePath,e))
+    # Matches are made for each row separately, so restricting the match of
+    # the full files to rows gives the match of rows
+    pos= numpy.minimum(numpy.searchsorted(rows,m1),max(len(rows)-1,0))
+    keep= rows[pos] == m1 if len(rows) > 0 else numpy.zeros(len(m1),bool)
+    return (pos[keep],m2[keep])
+
+def astroNN_xmatch_cache_filename(filePath,xcatPath,maxdist):
+    filename,fileExt= os.path.splitext(filePath)
+    return filename+'_xmatch_{}_maxdist_{:.2f}.pkl'.format(\
+        os.path.basename(xcatPath).split('.')[0],maxdist)
+
 def xmatch_cache_filename(filePath,xcat,maxdist):
     filename,fileExt= os.path.splitext(filePath)
     cachePath= filename+'_xmatch_{}_maxdist_{:.2f}'.format(xcat.replace('/','_').replace(':','_'),maxdist)+'.pkl'
@@ -481,95 +989,118 @@ def _elemIndx(elem,dr=14):
         raise KeyError("Element %s is not part of the APOGEE elements (can't do everything!) or something went wrong)" % elem)
 
 def _swap_in_astroNN(data,astroNNdata):
+    # Only swap in the columns that were loaded
+    names= data.dtype.names
     for tag,indx in zip(['TEFF','LOGG'],[0,1]):
-        data[tag]= astroNNdata['astroNN'][:,indx]
-        data[tag+'_ERR']= astroNNdata['astroNN_error'][:,indx]
+        if tag in names:
+            data[tag]= astroNNdata['astroNN'][:,indx]
+        if tag+'_ERR' in names:
+            data[tag+'_ERR']= astroNNdata['astroNN_error'][:,indx]
     for tag,indx in zip(['C','CI','N','O','Na','Mg','Al','Si','P','S','K',
                          'Ca','Ti','TiII','V','Cr','Mn','Fe','Co','Ni'],
                         range(2,22)):
-        data['X_H'][:,_elemIndx(tag.upper())]=\
-            astroNNdata['astroNN'][:,indx]
-        data['X_H_ERR'][:,_elemIndx(tag.upper())]=\
-            astroNNdata['astroNN_error'][:,indx]
+        if 'X_H' in names:
+            data['X_H'][:,_elemIndx(tag.upper())]=\
+                astroNNdata['astroNN'][:,indx]
+        if 'X_H_ERR' in names:
+            data['X_H_ERR'][:,_elemIndx(tag.upper())]=\
+                astroNNdata['astroNN_error'][:,indx]
         if tag.upper() != 'FE':
-            data['{}_FE'.format(tag.upper())]=\
-                astroNNdata['astroNN'][:,indx]-astroNNdata['astroNN'][:,19]
-            data['{}_FE_ERR'.format(tag.upper())]=\
-                numpy.sqrt(astroNNdata['astroNN_error'][:,indx]**2.
-                           +astroNNdata['astroNN_error'][:,19]**2.)
+            if '{}_FE'.format(tag.upper()) in names:
+                data['{}_FE'.format(tag.upper())]=\
+                    astroNNdata['astroNN'][:,indx]\
+                    -astroNNdata['astroNN'][:,19]
+            if '{}_FE_ERR'.format(tag.upper()) in names:
+                data['{}_FE_ERR'.format(tag.upper())]=\
+                    numpy.sqrt(astroNNdata['astroNN_error'][:,indx]**2.
+                               +astroNNdata['astroNN_error'][:,19]**2.)
         else:
-            data['FE_H'.format(tag.upper())]=\
-                        astroNNdata['astroNN'][:,indx]
-            data['FE_H_ERR'.format(tag.upper())]=\
-                astroNNdata['astroNN_error'][:,indx]
+            if 'FE_H' in names:
+                data['FE_H'.format(tag.upper())]=\
+                            astroNNdata['astroNN'][:,indx]
+            if 'FE_H_ERR' in names:
+                data['FE_H_ERR'.format(tag.upper())]=\
+                    astroNNdata['astroNN_error'][:,indx]
     return data
 
-def _add_astroNN_distances(data,astroNNDistancesdata):
-    fields_to_append= ['dist','dist_model_error','dist_error',
-                       'weighted_dist','weighted_dist_error']
-    if True:
-        # Faster way to join structured arrays (see https://stackoverflow.com/questions/5355744/numpy-joining-structured-arrays)
-        newdtype= data.dtype.descr+\
-            [(f,'<f8') for f in fields_to_append]
-        newdata= numpy.empty(len(data),dtype=newdtype)
-        for name in data.dtype.names:
-            newdata[name]= data[name]
-        for f in fields_to_append:
-            newdata[f]= astroNNDistancesdata[f]
-        return newdata
-    else:
-        return numpy.lib.recfunctions.append_fields(\
-            data,
-            fields_to_append,
-            [astroNNDistancesdata[f] for f in fields_to_append],
-            [astroNNDistancesdata[f].dtype for f in fields_to_append],
-            usemask=False)
-
-def _add_astroNN_ages(data,astroNNAgesdata,rowmatched=False):
-    fields_to_append= ['astroNN_age','astroNN_age_total_std',
-                       'astroNN_age_predictive_std','astroNN_age_model_std']
-    if True:
-        # Faster way to join structured arrays (see https://stackoverflow.com/questions/5355744/numpy-joining-structured-arrays)
-        newdtype= data.dtype.descr+\
-            [(f,'<f8') for f in fields_to_append]
-        newdata= numpy.empty(len(data),dtype=newdtype)
-        for name in data.dtype.names:
-            newdata[name]= data[name]
-        for f in fields_to_append:
-            if rowmatched:
-                newdata[f]= astroNNAgesdata[f]
-            else:
-                newdata[f]= numpy.zeros(len(data))-9999.
-        data= newdata
-    else:
-        # This, for some reason, is the slow part (see numpy/numpy#7811
-        if rowmatched:
-            data= numpy.lib.recfunctions.append_fields(\
-                data,
-                fields_to_append,
-                [astroNNAgesdata[f] for f in fields_to_append],
-                [astroNNAgesdata[f].dtype for f in fields_to_append],
-                usemask=False)
-        else:
-            data= numpy.lib.recfunctions.append_fields(\
-                data,
-                fields_to_append,
-                [numpy.zeros(len(data))-9999. for f in fields_to_append],
-                usemask=False)
-    if rowmatched: return data
-    # Only match primary targets
-    hash1= dict(zip(data['APOGEE_ID'][(data['EXTRATARG'] & 2**4) == 0],
-                    numpy.arange(len(data))[(data['EXTRATARG'] & 2**4) == 0]))
-    hash2= dict(zip(astroNNAgesdata['APOGEE_ID'],
-                    numpy.arange(len(astroNNAgesdata))))
-    common= numpy.intersect1d(\
-        data['APOGEE_ID'][(data['EXTRATARG'] & 2**4) == 0],
-        astroNNAgesdata['APOGEE_ID'])
-    indx1= list(itemgetter(*common)(hash1))
-    indx2= list(itemgetter(*common)(hash2))
-    for f in fields_to_append:
-        data[f][indx1]= astroNNAgesdata[f][indx2]
-    return data
+def _add_astroNN_distances(data,astroNNDistancesdata,as_columns=False):
+    return _append_fields(data,
+                          [(f,astroNNDistancesdata[f])
+                           for f in _ASTRONN_DISTANCES_FIELDS],
+                          as_columns=as_columns)
+
+def _add_astroNN_ages(data,astroNNAgesdata,indx,as_columns=False):
+    """Add the astroNN ages; indx is the row in astroNNAgesdata of each entry in data (-1 if none, see _astroNN_ages_index)"""
+    matched= indx >= 0
+    ages= []
+    for f in _ASTRONN_AGES_FIELDS:
+        age= numpy.full(len(data),-9999.,dtype='<f8')
+        age[matched]= astroNNAgesdata[f][indx[matched]]
+        ages.append((f,age))
+    return _append_fields(data,ages,as_columns=as_columns)
+
+def _append_fields(data,fields,as_columns=False):
+    """Append (name,values) float fields to a catalog: to a structured array with the extended dtype, or, with as_columns, as columns of a ColumnCatalog that shares the memory of data"""
+    if as_columns or isinstance(data,colstore.ColumnCatalog):
+        if not isinstance(data,colstore.ColumnCatalog):
+            data= colstore.ColumnCatalog.from_array(data)
+        for name,values in fields:
+            data[name]= numpy.array(values,dtype='<f8')
+        return data
+    # Faster way to join structured arrays (see https://stackoverflow.com/questions/5355744/numpy-joining-structured-arrays)
+    newdtype= data.dtype.descr+[(name,'<f8') for name,values in fields]
+    newdata= numpy.empty(len(data),dtype=newdtype)
+    for name in data.dtype.names:
+        newdata[name]= data[name]
+    for name,values in fields:
+        newdata[name]= values
+    return newdata
+
+def _astroNN_ages_index(filePath,dr=14):
+    """Row in the astroNN ages catalog of each row in the APOGEE file filePath (-1 if none), cached on disk next to filePath and keyed on the checksums of both files"""
+    agesFilePath= path.astroNNAgesPath(dr=dr)
+    checksums= (manifest.checksum(filePath),manifest.checksum(agesFilePath))
+    cacheFilePath= astroNN_ages_index_cache_filename(filePath)
+    if os.path.exists(cacheFilePath):
+        with open(cacheFilePath,'rb') as savefile:
+            cached_checksums= pickle.load(savefile)
+            if cached_checksums == checksums:
+                return pickle.load(savefile)
+    data= fitsread(filePath,1,columns=['APOGEE_ID','EXTRATARG'])
+    agesdata= fitsread(agesFilePath,1,columns=['APOGEE_ID'])
+    indx= _match_apogee_ids(data['APOGEE_ID'],agesdata['APOGEE_ID'],
+                            primary=(data['EXTRATARG'] & 2**4) == 0)
+    try:
+        save_pickles(cacheFilePath,checksums,indx)
+    except OSError as e:
+        warnings.warn("Could not cache the astroNN ages index in {} ({})".format(cacheFilePath,e))
+    return indx
+
+def astroNN_ages_index_cache_filename(filePath):
+    filename,fileExt= os.path.splitext(filePath)
+    return filename+'_astroNN_ages_index.pkl'
+
+def _match_apogee_ids(ids1,ids2,primary=None):
+    """Index into ids2 of each entry in ids1 with the same APOGEE_ID (-1 if none, or if not primary); for repeated IDs in ids2, the last entry is used"""
+    # Compare as fixed-width byte strings of a common width
+    ids1= numpy.asarray(ids1)
+    ids2= numpy.asarray(ids2)
+    if ids1.dtype.kind == 'U': ids1= numpy.char.encode(ids1)
+    if ids2.dtype.kind == 'U': ids2= numpy.char.encode(ids2)
+    width= max(ids1.dtype.itemsize,ids2.dtype.itemsize,1)
+    ids1= ids1.astype('S{}'.format(width))
+    ids2= ids2.astype('S{}'.format(width))
+    # Unique IDs in ids2, pointing to their last occurrence
+    uids2,rindx= numpy.unique(ids2[::-1],return_index=True)
+    uindx2= len(ids2)-1-rindx
+    indx= numpy.full(len(ids1),-1,dtype='int64')
+    if len(uids2) == 0: return indx
+    pos= numpy.minimum(numpy.searchsorted(uids2,ids1),len(uids2)-1)
+    matched= uids2[pos] == ids1
+    if not primary is None:
+        matched&= primary
+    indx[matched]= uindx2[pos[matched]]
+    return indx
 
 def _warn_apogee_fallback():
     warnings.warn("Falling back on simple APOGEE interface; for more functionality, install the jobovy/apogee package")
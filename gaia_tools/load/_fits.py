@@ -0,0 +1,189 @@
+###############################################################################
+#
+#   gaia_tools.load._fits: low-level FITS reading (fitsio if available,
+#                          astropy otherwise)
+#
+###############################################################################
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy
+try:
+    import fitsio
+    _FITSIO_LOADED= True
+except ImportError:
+    import astropy.io.fits as pyfits
+    _FITSIO_LOADED= False
+
+def fitsread(filePath,ext=1,columns=None):
+    """
+    NAME:
+       fitsread
+    PURPOSE:
+       read a FITS table, possibly only a subset of its columns
+    INPUT:
+       filePath - path of the FITS file
+       ext= (1) extension
+       columns= (None) if set, only read these columns
+    OUTPUT:
+       structured array
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    if _FITSIO_LOADED:
+        return fitsio.read(filePath,ext=ext,columns=columns)
+    elif columns is None:
+        return pyfits.getdata(filePath,ext)
+    with pyfits.open(filePath,memmap=True) as hdulist:
+        data= hdulist[ext].data
+        out= numpy.empty(len(data),
+                         dtype=[(col,data[col].dtype,data[col].shape[1:])
+                                for col in columns])
+        for col in columns:
+            out[col]= data[col]
+        del data
+    return out
+
+def read_into(filePath,out,start=0,ext=1):
+    """
+    NAME:
+       read_into
+    PURPOSE:
+       read a FITS table into rows start:start+nrows of an existing output (structured array or set of memory-mapped columns)
+    INPUT:
+       filePath - path of the FITS file
+       out - output to fill (structured array or ColumnCatalog); its columns are read
+       start= (0) first row of out to fill
+       ext= (1) extension
+    OUTPUT:
+       number of rows read
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    names= out.dtype.names
+    if _FITSIO_LOADED:
+        # fitsio decodes into a new array; decode all columns in a single
+        # pass over the rows (reading column by column takes a strided pass
+        # over the rows for every column, which is much slower)
+        with fitsio.FITS(filePath) as fitsfile:
+            hdu= fitsfile[ext]
+            if set(names) == set(hdu.get_colnames()):
+                data= hdu.read() # much faster than selecting all columns
+            else:
+                data= hdu.read(columns=list(names))
+        stop= start+len(data)
+        if isinstance(out,numpy.ndarray) and data.dtype.names == names:
+            # same columns in the same order: cast all in a single pass
+            out[start:stop]= data
+        else:
+            for name in names:
+                out[name][start:stop]= data[name]
+        return stop-start
+    with pyfits.open(filePath,memmap=True) as hdulist:
+        # columns of the memory-mapped table are (big-endian) views of the
+        # file, which are converted while they are copied into out
+        data= hdulist[ext].data
+        stop= start+len(data)
+        for name in names:
+            out[name][start:stop]= data[name]
+        del data
+    return stop-start
+
+def nrows(filePath,ext=1):
+    """
+    NAME:
+       nrows
+    PURPOSE:
+       return the number of rows in a FITS table from its header
+    INPUT:
+       filePath - path of the FITS file
+       ext= (1) extension
+    OUTPUT:
+       number of rows
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    if _FITSIO_LOADED:
+        with fitsio.FITS(filePath) as fitsfile:
+            return fitsfile[ext].get_nrows()
+    else:
+        return pyfits.getheader(filePath,ext)['NAXIS2']
+
+def dtype(filePath,ext=1):
+    """
+    NAME:
+       dtype
+    PURPOSE:
+       return the numpy dtype of a FITS table without reading the data
+    INPUT:
+       filePath - path of the FITS file
+       ext= (1) extension
+    OUTPUT:
+       numpy dtype
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    if _FITSIO_LOADED:
+        with fitsio.FITS(filePath) as fitsfile:
+            return fitsfile[ext].get_rec_dtype()[0]
+    else:
+        with pyfits.open(filePath,memmap=True) as hdulist:
+            return numpy.dtype(hdulist[ext].data.dtype)
+
+def common_dtype(filePaths,ext=1,columns=None):
+    """
+    NAME:
+       common_dtype
+    PURPOSE:
+       return the dtype that can hold the tables in a set of FITS files (like numpy.lib.recfunctions.stack_arrays with autoconvert=True), without reading the data
+    INPUT:
+       filePaths - list of FITS files
+       ext= (1) extension
+       columns= (None) if set, only include these columns
+    OUTPUT:
+       numpy dtype
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    dtypes= [dtype(filePath,ext=ext) for filePath in filePaths]
+    if columns is None:
+        columns= dtypes[0].names
+    out= []
+    for name in columns:
+        fielddtypes= [dt.fields[name][0] for dt in dtypes]
+        out.append((name,
+                    numpy.result_type(*[fdt.base for fdt in fielddtypes]),
+                    fielddtypes[0].shape))
+    return numpy.dtype(out)
+
+def read_shards(filePaths,ext=1,columns=None,out=None,nthreads=None):
+    """
+    NAME:
+       read_shards
+    PURPOSE:
+       read a catalog that is split over many FITS files in parallel, with each shard being copied directly into its part of a single, preallocated output
+    INPUT:
+       filePaths - list of FITS files, concatenated in this order
+       ext= (1) extension
+       columns= (None) if set, only read these columns
+       out= (None) if set, output to fill (structured array or ColumnCatalog with the right number of rows, e.g., a set of memory-mapped columns); otherwise a structured array is allocated
+       nthreads= (None) number of threads to use (default: the number of CPUs, up to the number of files)
+    OUTPUT:
+       output
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    if nthreads is None:
+        nthreads= os.cpu_count() or 1
+    nthreads= max(1,min(nthreads,len(filePaths)))
+    with ThreadPoolExecutor(nthreads) as executor:
+        shard_nrows= list(executor.map(lambda f: nrows(f,ext=ext),filePaths))
+        offsets= numpy.cumsum([0]+shard_nrows)
+        if out is None:
+            out= numpy.empty(offsets[-1],
+                             dtype=common_dtype(filePaths,ext=ext,
+                                                columns=columns))
+        def _read_one(ii):
+            read_into(filePaths[ii],out,start=offsets[ii],ext=ext)
+            return None
+        list(executor.map(_read_one,range(len(filePaths))))
+    return out
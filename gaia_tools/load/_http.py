@@ -0,0 +1,345 @@
+###############################################################################
+#
+#   gaia_tools.load._http: in-process, resumable HTTP(S) downloads
+#
+###############################################################################
+#
+# Files are downloaded to a partial file in the destination directory, which
+# is renamed to the final file once it is complete (an atomic operation,
+# because both are on the same filesystem). When a download is interrupted,
+# the partial file is kept and the download is resumed from where it stopped
+# with an HTTP Range request. The MD5 checksum of the file is computed while
+# it streams in, such that it does not have to be read again afterwards.
+# The ETag or Last-Modified header of the file is stored next to the partial
+# file and sent as If-Range when resuming, such that a partial file of an
+# older version of the file is never completed with newer data.
+# Gzip-compressed files can be decompressed while they stream in, such that
+# only the decompressed file is written to disk. The ETag and Last-Modified
+# headers of a download can be returned, such that whether the file changed
+# on the server can later be checked with a cheap conditional request.
+#
+###############################################################################
+import os, os.path
+import sys
+import hashlib
+import json
+import http.client
+import re
+import zlib
+import email.utils
+import urllib.request
+import urllib.error
+_NTRIES= 3
+_TIMEOUT= 30.
+_BUFFERSIZE= 1024**2
+_CONTENT_RANGE_RE= re.compile(r'bytes\s+(\d+|\*)-?(\d*)/(\d+|\*)')
+def fetch(url,filePath,spider=False,decompress=False,return_validators=False,
+          verbose=False,ntries=_NTRIES,timeout=_TIMEOUT):
+    """
+    NAME:
+       fetch
+    PURPOSE:
+       download a file over HTTP(S), resuming interrupted downloads
+    INPUT:
+       url - URL of the file
+       filePath - local path of the file
+       spider= (False) if True, only check that the file exists on the server
+       decompress= (False) if True, the file is gzip-compressed on the server and is decompressed while it is downloaded, such that only the decompressed file is written (such downloads are started over rather than resumed when they are interrupted)
+       return_validators= (False) if True, also return the validators of the file on the server (see validators)
+       verbose= (False) if True, write the progress of the download to stdout
+       ntries= (3) number of times to try (each try resumes the previous one)
+       timeout= (30) timeout of the connection in seconds
+    OUTPUT:
+       MD5 checksum of the downloaded (and decompressed) file (None if spider) [,validators]
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    partPath= part_path(filePath)
+    for trynum in range(ntries):
+        if decompress:
+            # The state of the decompressor cannot be recovered
+            _remove_part(partPath)
+        offset= os.path.getsize(partPath) if os.path.exists(partPath) else 0
+        headers= {}
+        if offset > 0 and not spider:
+            # Only resume if the file did not change on the server since the
+            # partial file was started; otherwise the server sends all of it
+            if_range= _part_validator(partPath)
+            if if_range is None:
+                _remove_part(partPath)
+                offset= 0
+            else:
+                headers['Range']= 'bytes={}-'.format(offset)
+                headers['If-Range']= if_range
+        try:
+            response= _urlopen(url,filePath,headers=headers,
+                               method='HEAD' if spider else 'GET',
+                               timeout=timeout)
+        except urllib.error.HTTPError as e: # 416: range not satisfiable
+            if offset > 0 and _total_size(e.headers) == offset:
+                # Partial file is in fact complete
+                md5= _finalize(partPath,filePath,_md5(partPath))
+                return (md5,validators(e.headers)) if return_validators \
+                    else md5
+            _remove_part(partPath)
+            continue
+        if response is None: continue
+        with response:
+            if spider: return (None,validators(response.headers)) \
+                    if return_validators else None
+            if offset > 0 and response.status == 206 \
+                    and _range_start(response.headers) == offset:
+                md5= _md5(partPath)
+                mode= 'ab'
+            elif response.status == 200: # whole file: start over
+                md5= hashlib.md5()
+                mode= 'wb'
+                _write_part_validators(partPath,validators(response.headers))
+            else: # unexpected range: start over without a Range request
+                _remove_part(partPath)
+                continue
+            start= offset if mode == 'ab' else 0
+            expected= response.headers.get('Content-Length')
+            gunzip= _Gunzip() if decompress else None
+            nread= 0
+            try:
+                with open(partPath,mode) as partfile:
+                    for chunk in _chunks(response,gunzip):
+                        nread+= chunk[0]
+                        partfile.write(chunk[1])
+                        md5.update(chunk[1])
+                        if verbose: _report(filePath,start+nread,expected,start)
+            except (http.client.HTTPException,OSError,zlib.error):
+                continue # resume in the next try
+        if not expected is None and nread != int(expected):
+            continue
+        md5= _finalize(partPath,filePath,md5)
+        return (md5,validators(response.headers)) if return_validators \
+            else md5
+    raise IOError('Downloading file %s failed after %i tries ...' % (os.path.basename(filePath),ntries))
+
+def read(url,decompress=False,return_validators=False,ntries=_NTRIES,
+         timeout=_TIMEOUT):
+    """
+    NAME:
+       read
+    PURPOSE:
+       download a file over HTTP(S) into memory (e.g., to parse it without writing it to disk)
+    INPUT:
+       url - URL of the file
+       decompress= (False) if True, the file is gzip-compressed on the server and is decompressed while it is downloaded
+       return_validators= (False) if True, also return the validators of the file on the server (see validators)
+       ntries= (3) number of times to try
+       timeout= (30) timeout of the connection in seconds
+    OUTPUT:
+       contents of the (decompressed) file as bytes [,validators]
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    for trynum in range(ntries):
+        try:
+            response= _urlopen(url,url.split('/')[-1],timeout=timeout)
+        except urllib.error.HTTPError:
+            continue
+        if response is None: continue
+        with response:
+            expected= response.headers.get('Content-Length')
+            gunzip= _Gunzip() if decompress else None
+            nread= 0
+            out= []
+            try:
+                for chunk in _chunks(response,gunzip):
+                    nread+= chunk[0]
+                    out.append(chunk[1])
+            except (http.client.HTTPException,OSError,zlib.error):
+                continue
+        if not expected is None and nread != int(expected):
+            continue
+        if return_validators:
+            return (b''.join(out),validators(response.headers))
+        return b''.join(out)
+    raise IOError('Downloading file %s failed after %i tries ...' % (url.split('/')[-1],ntries))
+
+def changed(url,old_validators,size=None,mtime=None,ntries=_NTRIES,
+            timeout=_TIMEOUT):
+    """
+    NAME:
+       changed
+    PURPOSE:
+       check with a conditional HEAD request whether a file changed on the server since it was downloaded
+    INPUT:
+       url - URL of the file
+       old_validators - validators of the file when it was downloaded (see validators; can be empty)
+       size= (None) size of the local file; when the server's validators cannot be compared, the file is considered to be unchanged if its size is the same as that on the server (None: considered to be changed)
+       mtime= (None) modification time of the local file (seconds since the epoch), used instead of size for files that are not stored as downloaded (e.g., converted); when no validators were recorded, the request is made conditional on the file being modified since and the file is considered to be unchanged if the server's Last-Modified date is not later
+       ntries= (3) number of times to try
+       timeout= (30) timeout of the connection in seconds
+    OUTPUT:
+       (True if the file changed, current validators of the file on the server)
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    headers= {}
+    if old_validators.get('etag'):
+        headers['If-None-Match']= old_validators['etag']
+    if old_validators.get('last_modified'):
+        headers['If-Modified-Since']= old_validators['last_modified']
+    elif len(headers) == 0 and size is None and not mtime is None:
+        headers['If-Modified-Since']= email.utils.formatdate(mtime,
+                                                             usegmt=True)
+    for trynum in range(ntries):
+        try:
+            response= _urlopen(url,url.split('/')[-1],headers=headers,
+                               method='HEAD',timeout=timeout)
+        except urllib.error.HTTPError as e:
+            if e.code == 304: # not modified
+                return (False,dict(old_validators,**validators(e.headers)))
+            continue
+        if response is None: continue
+        with response:
+            new_validators= validators(response.headers)
+            for key in ['etag','last_modified']:
+                if old_validators.get(key) and new_validators.get(key):
+                    return (old_validators[key] != new_validators[key],
+                            new_validators)
+            expected= response.headers.get('Content-Length')
+            modified= _http_date(new_validators.get('last_modified'))
+            if size is None and not mtime is None and not modified is None:
+                return (modified > mtime,new_validators)
+            return (size is None or expected is None
+                    or int(expected) != size,new_validators)
+    raise IOError('Checking file %s failed after %i tries ...' % (url.split('/')[-1],ntries))
+
+def validators(headers):
+    """
+    NAME:
+       validators
+    PURPOSE:
+       extract the validators (ETag and Last-Modified headers) from the headers of a response
+    INPUT:
+       headers - response headers
+    OUTPUT:
+       dictionary with (if present) 'etag' and 'last_modified'
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    out= {}
+    if headers.get('ETag'): out['etag']= headers['ETag']
+    if headers.get('Last-Modified'):
+        out['last_modified']= headers['Last-Modified']
+    return out
+
+def part_path(filePath):
+    """Path of the partial file of a download in progress"""
+    return os.path.join(os.path.dirname(filePath),
+                        '.'+os.path.basename(filePath)+'.part')
+
+def _urlopen(url,filename,headers={},method='GET',timeout=_TIMEOUT):
+    """Open a URL; returns None for errors that are worth trying again, raises IOError when the file does not exist and HTTPError when the requested range cannot be satisfied or the file was not modified"""
+    request= urllib.request.Request(url,headers=headers,method=method)
+    try:
+        return urllib.request.urlopen(request,timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code == 416 or e.code == 304:
+            raise
+        elif 400 <= e.code < 500:
+            raise IOError('File %s does not appear to exist on the server ...' % (os.path.basename(filename)))
+        return None # server errors
+    except (urllib.error.URLError,http.client.HTTPException,OSError):
+        return None
+
+def _chunks(response,gunzip=None):
+    """Generator of (number of bytes read, data) from a response, decompressing the data if gunzip is set"""
+    for chunk in iter(lambda: response.read(_BUFFERSIZE),b''):
+        if gunzip is None: yield (len(chunk),chunk)
+        else: yield (len(chunk),gunzip.decompress(chunk))
+    if not gunzip is None:
+        if not gunzip.eof:
+            raise zlib.error('Incomplete gzip stream')
+
+class _Gunzip(object):
+    """Incremental gzip decompressor that also handles files that consist of multiple gzip members"""
+    def __init__(self):
+        self._decompressor= zlib.decompressobj(16+zlib.MAX_WBITS)
+        return None
+
+    @property
+    def eof(self):
+        return self._decompressor.eof
+
+    def decompress(self,data):
+        out= []
+        while len(data) > 0:
+            out.append(self._decompressor.decompress(data))
+            if not self._decompressor.eof: break
+            # Next member, if any
+            data= self._decompressor.unused_data
+            if len(data) > 0:
+                self._decompressor= zlib.decompressobj(16+zlib.MAX_WBITS)
+        return b''.join(out)
+
+def _report(filePath,ndone,expected,offset):
+    """Write the progress of a download to stdout"""
+    if expected is None:
+        sys.stdout.write('\r'+"Downloading file %s: %.1f MB ...\r" \
+                             % (os.path.basename(filePath),ndone/1024.**2))
+    else:
+        sys.stdout.write('\r'+"Downloading file %s: %.1f/%.1f MB ...\r" \
+                             % (os.path.basename(filePath),ndone/1024.**2,
+                                (offset+int(expected))/1024.**2))
+    sys.stdout.flush()
+    return None
+
+def _finalize(partPath,filePath,md5):
+    os.replace(partPath,filePath)
+    if os.path.exists(partPath+'.json'): os.remove(partPath+'.json')
+    return md5.hexdigest()
+
+def _remove_part(partPath):
+    for filePath in [partPath,partPath+'.json']:
+        if os.path.exists(filePath): os.remove(filePath)
+    return None
+
+def _write_part_validators(partPath,part_validators):
+    """Store the validators of the file that a partial download is of, to check that it did not change when resuming"""
+    with open(partPath+'.json','w') as jsonfile:
+        json.dump(part_validators,jsonfile)
+    return None
+
+def _part_validator(partPath):
+    """If-Range value for resuming a partial download (strong ETag or Last-Modified of the file that it is of); None if unknown"""
+    try:
+        with open(partPath+'.json','r') as jsonfile:
+            part_validators= json.load(jsonfile)
+    except (OSError,ValueError):
+        return None
+    etag= part_validators.get('etag')
+    if etag and not etag.startswith('W/'): # weak ETags cannot be used
+        return etag
+    return part_validators.get('last_modified')
+
+def _md5(filePath):
+    md5= hashlib.md5()
+    if os.path.exists(filePath):
+        with open(filePath,'rb') as fileobj:
+            for chunk in iter(lambda: fileobj.read(_BUFFERSIZE),b''):
+                md5.update(chunk)
+    return md5
+
+def _range_start(headers):
+    match= _CONTENT_RANGE_RE.match(headers.get('Content-Range',''))
+    if match is None or match.group(1) == '*': return None
+    return int(match.group(1))
+
+def _total_size(headers):
+    match= _CONTENT_RANGE_RE.match(headers.get('Content-Range',''))
+    if match is None or match.group(3) == '*': return None
+    return int(match.group(3))
+
+def _http_date(date):
+    """Seconds since the epoch of an HTTP date (None if it cannot be parsed)"""
+    if date is None: return None
+    try:
+        return email.utils.parsedate_to_datetime(date).timestamp()
+    except (TypeError,ValueError,IndexError):
+        return None
@@ -0,0 +1,88 @@
+###############################################################################
+#
+#   gaia_tools.load._lock: cross-process locks on data files
+#
+###############################################################################
+#
+# Many processes (e.g., the workers of an array job) can share the same
+# GAIA_TOOLS_DATA directory and all try to download or convert the same file
+# at the same time. A file is therefore only created while holding an
+# exclusive lock on a small lock file next to it: the first process to get
+# the lock creates the file, while the others wait for the lock and then find
+# the finished file. The locks are advisory locks held by the operating
+# system (flock on POSIX systems, msvcrt.locking on Windows), so they are
+# released automatically when a process dies. The lock files themselves are
+# left in place, because removing them while another process waits on them
+# would break the lock.
+#
+###############################################################################
+import os, os.path
+import time
+import contextlib
+try:
+    import fcntl
+    _HAS_FCNTL= True
+except ImportError: # Windows
+    import msvcrt
+    _HAS_FCNTL= False
+_POLL= 0.1
+@contextlib.contextmanager
+def file_lock(filePath,timeout=None):
+    """
+    NAME:
+       file_lock
+    PURPOSE:
+       context manager that holds an exclusive cross-process lock on a data file while it is being created
+    INPUT:
+       filePath - path of the data file (the lock is taken on a hidden lock file next to it)
+       timeout= (None) maximum time to wait for the lock in seconds (None: wait indefinitely)
+    OUTPUT:
+       (none; raises IOError when the lock could not be obtained within timeout)
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    lockPath= lock_path(filePath)
+    try:
+        # make all intermediate directories
+        os.makedirs(os.path.dirname(lockPath))
+    except OSError: pass
+    fd= os.open(lockPath,os.O_RDWR|os.O_CREAT,0o644)
+    try:
+        _acquire(fd,lockPath,timeout)
+        try:
+            yield None
+        finally:
+            _release(fd)
+    finally:
+        os.close(fd)
+
+def lock_path(filePath):
+    """Path of the lock file of a data file"""
+    return os.path.join(os.path.dirname(filePath),
+                        '.'+os.path.basename(filePath)+'.lock')
+
+def _acquire(fd,lockPath,timeout):
+    if _HAS_FCNTL and timeout is None:
+        fcntl.flock(fd,fcntl.LOCK_EX)
+        return None
+    start= time.time()
+    while True:
+        try:
+            if _HAS_FCNTL:
+                fcntl.flock(fd,fcntl.LOCK_EX|fcntl.LOCK_NB)
+            else:
+                os.lseek(fd,0,os.SEEK_SET)
+                msvcrt.locking(fd,msvcrt.LK_NBLCK,1)
+            return None
+        except OSError:
+            if not timeout is None and time.time()-start > timeout:
+                raise IOError('Timed out waiting for the lock %s held by another process ...' % lockPath)
+            time.sleep(_POLL)
+
+def _release(fd):
+    if _HAS_FCNTL:
+        fcntl.flock(fd,fcntl.LOCK_UN)
+    else:
+        os.lseek(fd,0,os.SEEK_SET)
+        msvcrt.locking(fd,msvcrt.LK_UNLCK,1)
+    return None
@@ -0,0 +1,574 @@
+###############################################################################
+#
+#   gaia_tools.load.colstore: consolidated, memory-mapped columnar store for
+#                             catalogs that are distributed as many shards
+#
+###############################################################################
+#
+# A store is a directory that contains a manifest.json file that describes
+# the columns and the source files that the store was built from (their size
+# and modification time, so we can tell when the store is out of date), and
+# a hidden version directory with one .npy file per column, named in the
+# manifest. Columns are opened with numpy.load(mmap_mode='r'), such that
+# opening the store costs a few milliseconds and pages are shared between
+# all processes on a node.
+#
+# Stores are rebuilt in a new version directory and swapped in by atomically
+# replacing the manifest (os.replace), such that readers always see either
+# the old or the new store in full. The old version directory is removed
+# afterwards; readers that already opened it keep their memory maps (on
+# POSIX systems) and readers that read the old manifest just before the swap
+# re-read the manifest.
+#
+# LazyCatalog is a ColumnCatalog whose columns are only read (with a
+# user-supplied function, e.g., from the FITS shards) when they are first
+# accessed.
+#
+# Stores can also be written from a structured array or an astropy Table
+# (e.g., to avoid having to parse text catalogs more than once); for Tables,
+# the mask, fill value, unit, description, and format of each column are
+# stored as well, such that load() returns the same Table.
+#
+###############################################################################
+import os, os.path
+import json
+import shutil
+import tempfile
+import threading
+import numpy
+from numpy.lib.format import open_memmap
+from astropy.table import Table, Column, MaskedColumn
+from gaia_tools.load import _fits
+_MANIFEST_FILENAME= 'manifest.json'
+_STORE_VERSION= 2
+class ColumnCatalog(object):
+    """Catalog held as a dictionary of columns that can be indexed like a structured array"""
+    def __init__(self,columns):
+        """
+        NAME:
+           __init__
+        PURPOSE:
+           initialize a ColumnCatalog
+        INPUT:
+           columns - dictionary (or list of (name,array) pairs) of equal-length columns
+        OUTPUT:
+           instance
+        HISTORY:
+           2026-10-16 - Written - Bovy (UofT)
+        """
+        self._columns= dict(columns)
+        return None
+
+    @classmethod
+    def from_array(cls,data):
+        """
+        NAME:
+           from_array
+        PURPOSE:
+           wrap a structured array without copying it (the columns are views into the array)
+        INPUT:
+           data - structured array
+        OUTPUT:
+           ColumnCatalog
+        HISTORY:
+           2026-10-16 - Written - Bovy (UofT)
+        """
+        return cls([(name,data[name]) for name in data.dtype.names])
+
+    def keys(self):
+        return list(self._columns.keys())
+
+    @property
+    def dtype(self):
+        return numpy.dtype([(name,col.dtype,col.shape[1:])
+                            for name,col in self._columns.items()])
+
+    @property
+    def shape(self):
+        return (len(self),)
+
+    @property
+    def nbytes(self):
+        return sum([col.nbytes for col in self._columns.values()])
+
+    def __len__(self):
+        if len(self._columns) == 0: return 0
+        return len(next(iter(self._columns.values())))
+
+    def __contains__(self,key):
+        return key in self._columns
+
+    def __getitem__(self,key):
+        if isinstance(key,str):
+            return self._columns[key]
+        elif isinstance(key,list) and len(key) > 0 \
+                and all([isinstance(k,str) for k in key]):
+            return self.__class__([(k,self._columns[k]) for k in key])
+        elif isinstance(key,(int,numpy.integer)):
+            return self[[key]].as_array()[0]
+        else:
+            return self.__class__([(name,col[key])
+                                   for name,col in self._columns.items()])
+
+    def __setitem__(self,key,value):
+        # Columns are replaced rather than overwritten in place, such that
+        # memory-mapped or shared columns are never modified
+        if not isinstance(key,str):
+            raise TypeError('ColumnCatalog only supports setting entire columns')
+        if key in self._columns:
+            col= self._columns[key]
+            self._columns[key]= numpy.array(\
+                numpy.broadcast_to(value,col.shape),dtype=col.dtype)
+        else:
+            self._columns[key]= numpy.asarray(value)
+        return None
+
+    def as_array(self):
+        """
+        NAME:
+           as_array
+        PURPOSE:
+           return the catalog as a (newly allocated) structured array
+        INPUT:
+           (none)
+        OUTPUT:
+           structured array
+        HISTORY:
+           2026-10-16 - Written - Bovy (UofT)
+        """
+        out= numpy.empty(len(self),dtype=self.dtype)
+        for name,col in self._columns.items():
+            out[name]= col
+        return out
+
+    def __array__(self,dtype=None,copy=None):
+        out= self.as_array()
+        if dtype is None: return out
+        else: return out.astype(dtype)
+
+    def __repr__(self):
+        return '{}(nrows={}, columns={})'.format(self.__class__.__name__,
+                                                  len(self),self.keys())
+
+class LazyCatalog(ColumnCatalog):
+    """ColumnCatalog whose columns are only read when they are first accessed and then kept"""
+    def __init__(self,dtype,nrows,read_column,columns=None):
+        """
+        NAME:
+           __init__
+        PURPOSE:
+           initialize a LazyCatalog
+        INPUT:
+           dtype - dtype of the full catalog (names, types, and shapes of the columns)
+           nrows - number of rows
+           read_column - function that takes a column name and returns the full column
+           columns= (None) dictionary of columns that have already been read
+        OUTPUT:
+           instance
+        HISTORY:
+           2026-10-16 - Written - Bovy (UofT)
+        """
+        self._dtype= numpy.dtype(dtype)
+        self._names= list(self._dtype.names)
+        self._nrows= nrows
+        self._read_column= read_column
+        self._columns= {} if columns is None else dict(columns)
+        self._lock= threading.Lock()
+        return None
+
+    def keys(self):
+        return list(self._names)
+
+    def loaded(self):
+        """
+        NAME:
+           loaded
+        PURPOSE:
+           return the names of the columns that have been read so far
+        INPUT:
+           (none)
+        OUTPUT:
+           list of column names
+        HISTORY:
+           2026-10-16 - Written - Bovy (UofT)
+        """
+        return [name for name in self._names if name in self._columns]
+
+    @property
+    def dtype(self):
+        return numpy.dtype([(name,self._columns[name].dtype,
+                             self._columns[name].shape[1:])
+                            if name in self._columns
+                            else (name,self._dtype.fields[name][0])
+                            for name in self._names])
+
+    @property
+    def nbytes(self):
+        # Only counts the columns that have been read
+        return sum([col.nbytes for col in self._columns.values()])
+
+    def __len__(self):
+        return self._nrows
+
+    def __contains__(self,key):
+        return key in self._names
+
+    def __getitem__(self,key):
+        if isinstance(key,str):
+            if not key in self._names: raise KeyError(key)
+            with self._lock:
+                if not key in self._columns:
+                    self._columns[key]= self._read_column(key)
+            return self._columns[key]
+        elif isinstance(key,list) and len(key) > 0 \
+                and all([isinstance(k,str) for k in key]):
+            for k in key:
+                if not k in self._names: raise KeyError(k)
+            return self.__class__(\
+                [(k,self._dtype.fields[k][0]) if k in self._dtype.names
+                 else (k,self._columns[k].dtype,self._columns[k].shape[1:])
+                 for k in key],
+                self._nrows,self.__getitem__,
+                columns=[(k,self._columns[k]) for k in key
+                         if k in self._columns])
+        elif isinstance(key,(int,numpy.integer)):
+            return ColumnCatalog([(name,self[name][[key]])
+                                  for name in self._names]).as_array()[0]
+        else:
+            # Stays lazy: columns are indexed when they are first accessed
+            indx= numpy.arange(self._nrows)[key]
+            return self.__class__(self.dtype,len(indx),
+                                  lambda name: self[name][indx],
+                                  columns=[(name,col[indx]) for name,col
+                                           in self._columns.items()])
+
+    def __setitem__(self,key,value):
+        if not isinstance(key,str):
+            raise TypeError('LazyCatalog only supports setting entire columns')
+        if key in self._columns:
+            dtype= self._columns[key].dtype
+            shape= self._columns[key].shape
+        elif key in self._names: # not read yet, and no need to
+            dtype= self._dtype.fields[key][0].base
+            shape= (self._nrows,)+self._dtype.fields[key][0].shape
+        else:
+            self._columns[key]= numpy.asarray(value)
+            self._names.append(key)
+            return None
+        self._columns[key]= numpy.array(numpy.broadcast_to(value,shape),
+                                        dtype=dtype)
+        return None
+
+    def as_array(self):
+        out= numpy.empty(len(self),dtype=self.dtype)
+        for name in self._names:
+            out[name]= self[name]
+        return out
+
+    def __repr__(self):
+        return '{}(nrows={}, columns={}, loaded={})'.format(\
+            self.__class__.__name__,len(self),self.keys(),self.loaded())
+
+def _source_info(filePaths):
+    out= []
+    for filePath in filePaths:
+        stat= os.stat(filePath)
+        out.append({'path':os.path.abspath(filePath),
+                    'size':stat.st_size,
+                    'mtime_ns':stat.st_mtime_ns})
+    return out
+
+def read_manifest(storePath):
+    """
+    NAME:
+       read_manifest
+    PURPOSE:
+       read the manifest of a store
+    INPUT:
+       storePath - directory of the store
+    OUTPUT:
+       manifest dictionary or None if the store does not exist
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    manifestPath= os.path.join(storePath,_MANIFEST_FILENAME)
+    if not os.path.exists(manifestPath): return None
+    with open(manifestPath,'r') as manifestfile:
+        return json.load(manifestfile)
+
+def is_current(storePath,filePaths):
+    """
+    NAME:
+       is_current
+    PURPOSE:
+       check whether a store exists and is up-to-date with respect to the files it was built from
+    INPUT:
+       storePath - directory of the store
+       filePaths - list of source files
+    OUTPUT:
+       True if the store can be used
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    manifest= read_manifest(storePath)
+    if manifest is None or manifest.get('version') != _STORE_VERSION:
+        return False
+    try:
+        current= _source_info(filePaths)
+    except OSError:
+        return False
+    stored= [dict((k,s[k]) for k in ['path','size','mtime_ns'])
+             for s in manifest['sources']]
+    return stored == current
+
+def write_shards(storePath,filePaths,ext=1,nthreads=None):
+    """
+    NAME:
+       write_shards
+    PURPOSE:
+       build a store from a list of FITS shards that together make up a catalog
+    INPUT:
+       storePath - directory of the store (replaced if it exists)
+       filePaths - list of FITS files, concatenated in this order
+       ext= (1) FITS extension to read
+       nthreads= (None) number of threads to use to read the shards (see gaia_tools.load._fits.read_shards)
+    OUTPUT:
+       (none; writes the store)
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    sources= _source_info(filePaths)
+    shard_nrows= [_fits.nrows(filePath,ext=ext) for filePath in filePaths]
+    offsets= numpy.cumsum([0]+shard_nrows)
+    for source,nrow,offset in zip(sources,shard_nrows,offsets):
+        source['nrows']= int(nrow)
+        source['offset']= int(offset)
+    dtype= _fits.common_dtype(filePaths,ext=ext)
+    columns= [{'name':name,
+               'file':'col%03i.npy' % ii,
+               'dtype':dtype.fields[name][0].base.str,
+               'shape':list(dtype.fields[name][0].shape)}
+              for ii,name in enumerate(dtype.names)]
+    versionPath= _version_path(storePath)
+    try:
+        # Shards are read in parallel directly into the memory-mapped columns
+        cols= ColumnCatalog(\
+            [(col['name'],
+              open_memmap(os.path.join(versionPath,col['file']),mode='w+',
+                          dtype=numpy.dtype(col['dtype']),
+                          shape=(int(offsets[-1]),)+tuple(col['shape'])))
+             for col in columns])
+        _fits.read_shards(filePaths,ext=ext,out=cols,nthreads=nthreads)
+        for name in cols.keys(): cols[name].flush()
+        del cols
+        _finalize_store(versionPath,storePath,
+                        {'version':_STORE_VERSION,
+                         'nrows':int(offsets[-1]),
+                         'columns':columns,
+                         'sources':sources})
+    except:
+        shutil.rmtree(versionPath,ignore_errors=True)
+        raise
+    return None
+
+def write(storePath,data,filePaths):
+    """
+    NAME:
+       write
+    PURPOSE:
+       build a store from a structured array or astropy Table
+    INPUT:
+       storePath - directory of the store (replaced if it exists)
+       data - structured array or astropy Table
+       filePaths - list of source files that data was read from (used to determine whether the store is current)
+    OUTPUT:
+       (none; writes the store)
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    sources= _source_info(filePaths)
+    is_table= isinstance(data,Table)
+    names= data.colnames if is_table else data.dtype.names
+    versionPath= _version_path(storePath)
+    try:
+        columns= []
+        for ii,name in enumerate(names):
+            col= data[name]
+            column= {'name':name,'file':'col%03i.npy' % ii}
+            if is_table:
+                column['unit']= None if col.unit is None \
+                    else col.unit.to_string()
+                column['description']= col.description
+                column['format']= col.format if isinstance(col.format,str) \
+                    else None
+                if isinstance(col,MaskedColumn):
+                    column['mask']= 'mask%03i.npy' % ii
+                    column['fill_value']= 'fill%03i.npy' % ii
+                    numpy.save(os.path.join(versionPath,column['mask']),
+                               numpy.ma.getmaskarray(col))
+                    numpy.save(os.path.join(versionPath,
+                                            column['fill_value']),
+                               numpy.asarray(col.fill_value,dtype=col.dtype))
+                    col= col.filled()
+            col= numpy.asarray(col)
+            column['dtype']= col.dtype.str
+            column['shape']= list(col.shape[1:])
+            numpy.save(os.path.join(versionPath,column['file']),col)
+            columns.append(column)
+        _finalize_store(versionPath,storePath,
+                        {'version':_STORE_VERSION,
+                         'nrows':len(data),
+                         'table':is_table,
+                         'columns':columns,
+                         'sources':sources})
+    except:
+        shutil.rmtree(versionPath,ignore_errors=True)
+        raise
+    return None
+
+def load(storePath,columns=None):
+    """
+    NAME:
+       load
+    PURPOSE:
+       read a store into memory in the form that it was written in (structured array or astropy Table)
+    INPUT:
+       storePath - directory of the store
+       columns= (None) if set, only read these columns
+    OUTPUT:
+       structured array or astropy Table
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    return _retry_swapped(storePath,
+                          lambda manifest: _load(storePath,manifest,columns))
+
+def _load(storePath,manifest,columns):
+    if not manifest.get('table',False):
+        return _read(storePath,manifest,columns,True).as_array()
+    versionPath= _version_dir(storePath,manifest)
+    entries= dict([(col['name'],col) for col in manifest['columns']])
+    if columns is None:
+        columns= [col['name'] for col in manifest['columns']]
+    cols= []
+    for name in columns:
+        entry= entries[name]
+        values= numpy.load(os.path.join(versionPath,entry['file']))
+        kwargs= {'name':name,'unit':entry['unit'],
+                 'description':entry['description'],
+                 'format':entry['format']}
+        if 'mask' in entry:
+            cols.append(MaskedColumn(\
+                values,
+                mask=numpy.load(os.path.join(versionPath,entry['mask'])),
+                fill_value=numpy.load(os.path.join(versionPath,
+                                                   entry['fill_value']))[()],
+                **kwargs))
+        else:
+            cols.append(Column(values,**kwargs))
+    return Table(cols)
+
+def read(storePath,columns=None,memmap=True):
+    """
+    NAME:
+       read
+    PURPOSE:
+       open a store
+    INPUT:
+       storePath - directory of the store
+       columns= (None) if set, only open these columns
+       memmap= (True) if True, memory-map the columns (read-only), otherwise read them into memory
+    OUTPUT:
+       ColumnCatalog
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    return _retry_swapped(storePath,
+                          lambda manifest: _read(storePath,manifest,
+                                                 columns,memmap))
+
+def _read(storePath,manifest,columns,memmap):
+    versionPath= _version_dir(storePath,manifest)
+    files= dict([(col['name'],col['file']) for col in manifest['columns']])
+    if columns is None:
+        columns= [col['name'] for col in manifest['columns']]
+    return ColumnCatalog(\
+        [(name,numpy.load(os.path.join(versionPath,files[name]),
+                          mmap_mode='r' if memmap else None))
+         for name in columns])
+
+def iter_shards(storePath,columns=None):
+    """
+    NAME:
+       iter_shards
+    PURPOSE:
+       iterate over the parts of a store that correspond to the source files it was built from
+    INPUT:
+       storePath - directory of the store
+       columns= (None) if set, only include these columns
+    OUTPUT:
+       generator of (row offset, ColumnCatalog of memory-mapped columns)
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    manifest,data= _retry_swapped(\
+        storePath,lambda manifest: (manifest,_read(storePath,manifest,
+                                                   columns,True)))
+    for source in manifest['sources']:
+        yield (source['offset'],
+               data[source['offset']:source['offset']+source['nrows']])
+
+def _version_path(storePath):
+    # Build the new version of the store inside the store directory, such
+    # that it can be swapped in by replacing the manifest
+    try:
+        os.makedirs(storePath)
+    except OSError: pass
+    return tempfile.mkdtemp(dir=storePath,prefix='.version.')
+
+def _version_dir(storePath,manifest):
+    # Stores written before version directories were used have their
+    # columns in the store directory itself
+    return os.path.join(storePath,manifest.get('directory',''))
+
+def _retry_swapped(storePath,func,ntries=5):
+    """Call func(manifest) on the current manifest of a store, re-reading the manifest if the version directory that it names was removed by a concurrent swap"""
+    for ii in range(ntries):
+        manifest= read_manifest(storePath)
+        if manifest is None:
+            raise IOError('No column store found at %s' % storePath)
+        try:
+            return func(manifest)
+        except (IOError,OSError):
+            current= read_manifest(storePath)
+            if ii == ntries-1 or current is None \
+                    or current.get('directory') == manifest.get('directory'):
+                raise
+
+def _finalize_store(versionPath,storePath,manifest):
+    os.chmod(versionPath,0o755) # mkdtemp makes it private
+    manifest['directory']= os.path.basename(versionPath)
+    old= read_manifest(storePath)
+    fd,tmpPath= tempfile.mkstemp(dir=storePath,prefix='.'+_MANIFEST_FILENAME)
+    try:
+        with os.fdopen(fd,'w') as manifestfile:
+            json.dump(manifest,manifestfile)
+        os.chmod(tmpPath,0o644)
+        # The swap: readers see either the old or the new manifest
+        os.replace(tmpPath,os.path.join(storePath,_MANIFEST_FILENAME))
+    except:
+        if os.path.exists(tmpPath): os.remove(tmpPath)
+        raise
+    if old is None: return None
+    # Remove the version that was replaced (or the columns of a store
+    # written before version directories were used)
+    if 'directory' in old:
+        shutil.rmtree(os.path.join(storePath,old['directory']),
+                      ignore_errors=True)
+    else:
+        for col in old.get('columns',[]):
+            for key in ['file','mask','fill_value']:
+                try:
+                    os.remove(os.path.join(storePath,col[key]))
+                except (KeyError,OSError): pass
+    return None
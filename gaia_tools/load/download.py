@@ -5,80 +5,98 @@
 ###############################################################################
 import sys
 import os, os.path
-import errno
 import shutil
 import tempfile
+import re
 from ftplib import FTP
-import subprocess
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy
 from astropy.io import ascii
-from gaia_tools.load import path
+from gaia_tools.load import path, manifest, mirror, _http, _lock
+try:
+    import healpy
+    _HEALPY_LOADED= True
+except ImportError:
+    _HEALPY_LOADED= False
 _MAX_NTRIES= 2
+_NCONNECTIONS= 4
+_NPREFETCH= 2
+# Level of the HEALPix pixels that cones and polygons are covered with when
+# selecting gaia_source files (~0.05 sq. deg. pixels, smaller than the files)
+_REGION_LEVEL= 8
+# Names of the gaia_source files: DR2 names contain the range of source_id,
+# DR3 names contain the range of level-8 HEALPix pixels
+_GAIA_SOURCE_RE= {2: re.compile(r'GaiaSource_(\d+)_(\d+)\.'),
+                  3: re.compile(r'GaiaSource_(\d+)-(\d+)\.')}
 _ERASESTR= "                                                                                "
-def twomass(dr='tgas',verbose=True,spider=False):
+def twomass(dr='tgas',verbose=True,spider=False,refresh=False):
     filePath= path.twomassPath(dr=dr)
-    if os.path.exists(filePath): return None
+    if os.path.exists(filePath) and not refresh: return None
     if dr == 'tgas':
         _download_file(\
             'http://portal.nersc.gov/project/cosmo/temp/dstn/gaia/tgas-matched-2mass.fits.gz',
-            filePath,verbose=verbose,spider=spider)
+            filePath,verbose=verbose,spider=spider,refresh=refresh)
     return None    
     
-def apogee(dr=14,verbose=True,spider=False):
+def apogee(dr=14,verbose=True,spider=False,refresh=False):
     filePath= path.apogeePath(dr=dr)
-    if os.path.exists(filePath): return None
+    if os.path.exists(filePath) and not refresh: return None
     if dr == 12:
         _download_file(\
             'http://data.sdss3.org/sas/dr12/apogee/spectro/redux/r5/allStar-v603.fits',
-            filePath,verbose=verbose,spider=spider)
+            filePath,verbose=verbose,spider=spider,refresh=refresh)
     elif dr == 13:
         _download_file(\
             'https://data.sdss.org/sas/dr13/apogee/spectro/redux/r6/allStar-l30e.2.fits',
-            filePath,verbose=verbose,spider=spider)
+            filePath,verbose=verbose,spider=spider,refresh=refresh)
     elif dr == 14:
         _download_file(\
             'https://data.sdss.org/sas/dr14/apogee/spectro/redux/r8/stars/l31c/l31c.2/allStar-l31c.2.fits',
-            filePath,verbose=verbose,spider=spider)
+            filePath,verbose=verbose,spider=spider,refresh=refresh)
     return None    
     
-def apogeerc(dr=14,verbose=True,spider=False):
+def apogeerc(dr=14,verbose=True,spider=False,refresh=False):
     filePath= path.apogeercPath(dr=dr)
-    if os.path.exists(filePath): return None
+    if os.path.exists(filePath) and not refresh: return None
     _download_file(\
         'https://data.sdss.org/sas/dr%i/apogee/vac/apogee-rc/cat/apogee-rc-DR%i.fits' % (dr,dr),
-        filePath,verbose=verbose,spider=spider)
+        filePath,verbose=verbose,spider=spider,refresh=refresh)
     return None    
     
-def astroNN(dr=14,verbose=True,spider=False):
+def astroNN(dr=14,verbose=True,spider=False,refresh=False):
     filePath= path.astroNNPath(dr=dr)
-    if os.path.exists(filePath): return None
+    if os.path.exists(filePath) and not refresh: return None
     if dr == 14:
         _download_file(\
             'https://github.com/henrysky/astroNN_spectra_paper_figures/ra\
 w/master/astroNN_apogee_dr14_catalog.fits',
-            filePath,verbose=verbose,spider=spider)
+            filePath,verbose=verbose,spider=spider,refresh=refresh)
     return None    
     
-def astroNNDistances(dr=14,verbose=True,spider=False):
+def astroNNDistances(dr=14,verbose=True,spider=False,refresh=False):
     filePath= path.astroNNDistancesPath(dr=dr)
-    if os.path.exists(filePath): return None
+    if os.path.exists(filePath) and not refresh: return None
     if dr == 14:
         _download_file(\
             'https://github.com/henrysky/astroNN_gaia_dr2_paper/raw/master/'\
             'apogee_dr14_nn_dist.fits',
-            filePath,verbose=verbose,spider=spider)
+            filePath,verbose=verbose,spider=spider,refresh=refresh)
     return None    
     
-def astroNNAges(dr=14,verbose=True,spider=False):
+def astroNNAges(dr=14,verbose=True,spider=False,refresh=False):
     filePath= path.astroNNAgesPath(dr=dr)
-    if os.path.exists(filePath): return None
+    if os.path.exists(filePath) and not refresh: return None
     if dr == 14:
         _download_file(\
             'http://www.astro.ljmu.ac.uk/~astjmack/APOGEEGaiaAges/'\
             'astroNNBayes_ages_goodDR14.fits',
-            filePath,verbose=verbose,spider=spider)
+            filePath,verbose=verbose,spider=spider,refresh=refresh)
     return None    
     
-def galah(dr=3,ages=False,dynamics=False,verbose=True,spider=False):
+def galah(dr=3,ages=False,dynamics=False,verbose=True,spider=False,
+          refresh=False):
     if dr == 1 or dr == '1':
         filePath, ReadMePath= path.galahPath(dr=dr)
     elif ages:
@@ -87,14 +105,14 @@ def galah(dr=3,ages=False,dynamics=False,verbose=True,spider=False):
         filePath= path.galahDynamicsPath(dr=dr)
     else:
         filePath= path.galahPath(dr=dr)
-    if os.path.exists(filePath): return None
+    if os.path.exists(filePath) and not refresh: return None
     if dr == 1:
         _download_file(\
             'https://cloudstor.aarnet.edu.au/plus/index.php/s/OMc9QWGG1koAK2D/download?path=%2F&files=catalog.dat',
-            filePath,verbose=verbose,spider=spider)
+            filePath,verbose=verbose,spider=spider,refresh=refresh)
         _download_file(\
             'https://cloudstor.aarnet.edu.au/plus/index.php/s/OMc9QWGG1koAK2D/download?path=%2F&files=ReadMe',
-            ReadMePath,verbose=verbose,spider=spider)
+            ReadMePath,verbose=verbose,spider=spider,refresh=refresh)
     elif dr == 2 or dr == '2' or dr == 2.1 or dr == '2.1':
         # GALAH updated catalog May 10 2018; remove catalog downloaded before
         if os.path.exists(filePath.replace('DR2.1','DR2')):
@@ -102,92 +120,162 @@ def galah(dr=3,ages=False,dynamics=False,verbose=True,spider=False):
         _download_file(\
           os.path.join('https://datacentral.aao.gov.au/teamdata/GALAH/public/',
                        os.path.basename(filePath)),
-            filePath,verbose=verbose,spider=spider)
+            filePath,verbose=verbose,spider=spider,refresh=refresh)
     elif dr == 3 or dr == '3':
         _download_file(\
           os.path.join('https://cloud.datacentral.org.au/teamdata/GALAH/public/GALAH_DR3/',
                        os.path.basename(filePath)),
-            filePath,verbose=verbose,spider=spider)
+            filePath,verbose=verbose,spider=spider,refresh=refresh)
     return None    
     
-def lamost(dr=2,cat='all',verbose=True):
+def lamost(dr=2,cat='all',verbose=True,refresh=False):
     filePath= path.lamostPath(dr=dr,cat=cat)
-    if os.path.exists(filePath): return None
+    if os.path.exists(filePath) and not refresh: return None
     downloadPath= filePath.replace(
         filePath,
         'http://dr2.lamost.org/catdl?name=%s' % os.path.basename(filePath))
-    _download_file(downloadPath+'.gz',filePath+'.gz',verbose=verbose)
-    # gunzip the file
-    try:
-        subprocess.check_call(['gunzip',
-                               filePath+'.gz'])
-    except subprocess.CalledProcessError:
-        raise IOError('gunzipping the LAMOST catalog %s failed ...' % os.path.basename(filePath))
+    # gunzipped while downloading
+    _download_file(downloadPath+'.gz',filePath,verbose=verbose,
+                   decompress=True,refresh=refresh)
     return None    
 
-def rave(dr=5,verbose=True):
+def rave(dr=5,verbose=True,refresh=False):
     filePath, ReadMePath= path.ravePath(dr=dr)
-    if os.path.exists(filePath): return None
+    # refresh is only supported for the DR5 HTTP download
+    if os.path.exists(filePath) and (not refresh or dr == 4): return None
     if dr == 4:
         vizier('III/272',filePath,ReadMePath,
                catalogname='ravedr4.dat',readmename='ReadMe')
     elif dr == 5:
         # Have to figure out what will happen tonight!
+        # gunzipped while downloading
         _download_file(\
             'https://www.rave-survey.org/data/files/single?name=DR5/RAVE_DR5.csv.gz',
-            filePath+'.gz',verbose=verbose)
-        # gunzip the file
-        try:
-            subprocess.check_call(['gunzip',
-                                   filePath+'.gz'])
-        except subprocess.CalledProcessError:
-            raise IOError('gunzipping the RAVE-DR5 catalog failed ...')
+            filePath,verbose=verbose,decompress=True,refresh=refresh)
     return None    
 
-def raveon(dr=5,verbose=True,spider=False):
+def raveon(dr=5,verbose=True,spider=False,refresh=False):
     filePath= path.raveonPath(dr=dr)
-    if os.path.exists(filePath): return None
+    if os.path.exists(filePath) and not refresh: return None
     if dr == 5:
         _download_file(\
             'https://zenodo.org/record/154381/files/RAVE-on-v1.0.fits.gz',
-            filePath,verbose=verbose,spider=spider)
+            filePath,verbose=verbose,spider=spider,refresh=refresh)
     return None    
     
-def tgas(dr=1,verbose=True):
+def tgas(dr=1,verbose=True,nconnections=_NCONNECTIONS,refresh=False):
     filePaths= path.tgasPath(dr=dr)
     old_filePaths= path.tgasPath(dr=dr,old=True)
+    downloadPaths= []
+    toDownload= []
     for filePath, old_filePath in zip(filePaths,old_filePaths):
-        if os.path.exists(filePath): continue
+        if os.path.exists(filePath) and not refresh: continue
         # after DR1, Gaia archive changed URL to include 'gdr1', which we 
         # now mirror locally, so check whether the file exists in the old 
         # location and mv if necessary
-        if os.path.exists(old_filePath):
+        if os.path.exists(old_filePath) and not os.path.exists(filePath):
             try:
                 # make all intermediate directories
                 os.makedirs(os.path.dirname(filePath))
             except OSError: pass
             shutil.move(old_filePath,filePath)
-            continue
-        downloadPath= filePath.replace(path._GAIA_TOOLS_DATA.rstrip('/'),
-                                       'http://cdn.gea.esac.esa.int')
-        _download_file(downloadPath,filePath,verbose=verbose)
+            manifest.record([filePath])
+            if not refresh: continue
+        downloadPaths.append(\
+            filePath.replace(path._GAIA_TOOLS_DATA.rstrip('/'),
+                             'http://cdn.gea.esac.esa.int'))
+        toDownload.append(filePath)
+    _download_files(downloadPaths,toDownload,verbose=verbose,
+                    nconnections=nconnections,refresh=refresh)
     return None    
     
-def gaiarv(dr=2,verbose=True):
+def gaiarv(dr=2,verbose=True,nconnections=_NCONNECTIONS,nprocesses=None,
+           refresh=False):
     filePaths= path.gaiarvPath(dr=dr,format='fits')
     csvFilePaths= path.gaiarvPath(dr=dr,format='csv')
-    for filePath, csvFilePath in zip(filePaths,csvFilePaths):
-        if os.path.exists(filePath): continue
+    downloadPaths= dict([(filePath,csvFilePath.replace(\
+                    path._GAIA_TOOLS_DATA.rstrip('/'),
+                    'http://cdn.gea.esac.esa.int').replace(os.sep,'/'))
+                         for filePath,csvFilePath in zip(filePaths,
+                                                         csvFilePaths)])
+    csvFilePaths= dict(zip(filePaths,csvFilePaths))
+    # With refresh, files that changed on the server are converted again
+    present= [filePath for filePath in filePaths if os.path.exists(filePath)]
+    stale= _stale([downloadPaths[filePath] for filePath in present],present,
+                  compare_size=False,nconnections=nconnections) \
+                  if refresh else set()
+    toConvert= [filePath for filePath in filePaths
+                if not os.path.exists(filePath) or filePath in stale]
+    if len(toConvert) == 0: return None
+    try:
+        os.makedirs(os.path.dirname(filePaths[0])) 
+    except OSError: pass
+    if verbose:
+        sys.stdout.write('\r'+"Downloading %i files ...\r" % len(toConvert))
+        sys.stdout.flush()
+    # Each CSV file is decompressed while it is downloaded in a background
+    # thread to an (uncompressed) scratch CSV file next to the FITS file,
+    # which is then parsed and written to FITS in a separate process and
+    # removed, such that only the FITS file remains on disk. The CSV file is
+    # not parsed while it streams in, because the types of its columns are
+    # only known once all of it has been read
+    def _fetch_csv(filePath):
+        csvFilePath= csvFilePaths[filePath]
+        if os.path.exists(csvFilePath) and not filePath in stale:
+            # e.g., downloaded previously
+            return (csvFilePath,{},False)
+        scratchFilePath= _scratch_csv_path(filePath)
         try:
-            os.makedirs(os.path.dirname(filePath)) 
-        except OSError: pass
-        downloadPath= csvFilePath.replace(path._GAIA_TOOLS_DATA.rstrip('/'),
-                                       'http://cdn.gea.esac.esa.int')
-        _download_file(downloadPath,csvFilePath,verbose=verbose)
-        data= ascii.read(csvFilePath,format='csv')
-        data.write(filePath,format='fits')
+            md5,validators= _http.fetch(downloadPaths[filePath],
+                                        scratchFilePath,decompress=True,
+                                        return_validators=True)
+        except BaseException:
+            _remove_scratch_csv(filePath)
+            raise
+        return (scratchFilePath,validators,True)
+    try:
+        converted= _pipeline(toConvert,_fetch_csv,_csv_to_fits,
+                             nconnections=nconnections,nprocesses=nprocesses,
+                             overwrite=stale)
+    finally:
+        # Scratch files of conversions that did not run (e.g., because
+        # another one failed)
+        for filePath in toConvert:
+            if os.path.exists(_scratch_csv_path(filePath)):
+                with _lock.file_lock(filePath):
+                    _remove_scratch_csv(filePath)
+    if len(converted) > 0:
+        manifest.record(list(converted.keys()),validators=converted)
+    if verbose:
+        sys.stdout.write('\r'+_ERASESTR+'\r')
+        sys.stdout.flush()
     return None    
     
+def _csv_to_fits(filePath,fetched):
+    """Convert a CSV file (filename, validators of the download, whether to remove the CSV file afterwards) to a FITS file; returns the validators"""
+    csvFilePath,validators,remove= fetched
+    try:
+        data= ascii.read(csvFilePath,format='csv')
+        tmpFilePath= _http.part_path(filePath)
+        data.write(tmpFilePath,format='fits',overwrite=True)
+        os.replace(tmpFilePath,filePath)
+    finally:
+        if remove: _remove_scratch_csv(filePath)
+    return validators
+
+def _scratch_csv_path(filePath):
+    """Path of the decompressed CSV file that a FITS file is converted from"""
+    return os.path.join(os.path.dirname(filePath),
+                        '.'+os.path.splitext(os.path.basename(filePath))[0]
+                        +'.csv')
+
+def _remove_scratch_csv(filePath):
+    """Remove the scratch CSV file of a FITS file and its partial download"""
+    scratchFilePath= _scratch_csv_path(filePath)
+    _http._remove_part(_http.part_path(scratchFilePath))
+    if os.path.exists(scratchFilePath): os.remove(scratchFilePath)
+    return None
+
 def vizier(cat,filePath,ReadMePath,
            catalogname='catalog.dat',readmename='ReadMe'):
     """
@@ -210,8 +298,93 @@ def vizier(cat,filePath,ReadMePath,
     _download_file_vizier(cat,ReadMePath,catalogname=readmename)
     return None
 
-def _download_file(downloadPath,filePath,verbose=False,spider=False):
+def gaia_source(dr=2,region=None,**kwargs):
+    """
+    NAME:
+       gaia_source
+    PURPOSE:
+       download the gaia_source files, or only those that overlap with a region on the sky
+    INPUT:
+       dr= (2) data release (2 or 3; 1 only without region)
+       region= (None) if set, only download the files that overlap with this region, one of:
+               {'cone':(ra,dec,radius)} - cone (all in deg)
+               {'polygon':[(ra1,dec1),(ra2,dec2),...]} - convex polygon (in deg)
+               {'healpix':pixels,'level':level} - set of HEALPix pixels (nested ordering) at the given level (nside= 2**level)
+               (cones and polygons require healpy)
+       +gaia_tools.load.mirror.mirror keywords (nconnections, nthreads, base_url, verbose)
+    OUTPUT:
+       list of the local paths of the downloaded files
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    files= None
+    if not region is None:
+        if not int(dr) in _GAIA_SOURCE_RE:
+            raise ValueError("Downloading a region is only available for DR2 and DR3, whose file names contain the source_id range of each file")
+        mirror_kwargs= dict([(key,kwargs[key]) for key in ['base_url']
+                             if key in kwargs])
+        filenames= sorted(mirror.remote_checksums(dr=dr,table='gaia_source',
+                                                  **mirror_kwargs))
+        filenames= [filename for filename in filenames
+                    if not _GAIA_SOURCE_RE[int(dr)].match(filename) is None]
+        if len(filenames) == 0: return []
+        ranges= numpy.array([_source_id_range(filename,dr)
+                             for filename in filenames],dtype='int64')
+        files= list(numpy.array(filenames)[\
+                _overlaps_region(ranges,_region_healpix(region))])
+    return mirror.mirror(dr=dr,table='gaia_source',files=files,**kwargs)
+
+def _source_id_range(filename,dr):
+    """Range of source_id [min,max] in a gaia_source file, from its name"""
+    match= _GAIA_SOURCE_RE[int(dr)].match(filename)
+    low,high= int(match.group(1)),int(match.group(2))
+    if int(dr) == 3: # level-8 HEALPix range, source_id= 2**35 * level-12 pixel
+        return (low*2**43,(high+1)*2**43-1)
+    return (low,high)
+
+def _region_healpix(region):
+    """Sorted set of HEALPix pixels (nested) that cover a region, and their level"""
+    if 'healpix' in region:
+        if not 0 <= int(region['level']) <= 29:
+            raise ValueError("HEALPix level must be between 0 and 29")
+        return (numpy.unique(numpy.atleast_1d(region['healpix']).astype('int64')),
+                int(region['level']))
+    if not _HEALPY_LOADED:
+        raise ImportError("healpy is required to download the gaia_source files that overlap with a cone or polygon; install healpy or specify the region as a set of HEALPix pixels")
+    nside= 2**_REGION_LEVEL
+    if 'cone' in region:
+        ra,dec,radius= region['cone']
+        pixels= healpy.query_disc(nside,healpy.ang2vec(ra,dec,lonlat=True),
+                                  numpy.radians(radius),
+                                  nest=True,inclusive=True)
+    elif 'polygon' in region:
+        vertices= numpy.atleast_2d(region['polygon'])
+        pixels= healpy.query_polygon(nside,
+                                     healpy.ang2vec(vertices[:,0],
+                                                    vertices[:,1],
+                                                    lonlat=True),
+                                     nest=True,inclusive=True)
+    else:
+        raise ValueError("region must be a dictionary with a 'cone', 'polygon', or 'healpix' entry")
+    return (numpy.unique(pixels).astype('int64'),_REGION_LEVEL)
+
+def _overlaps_region(ranges,healpix):
+    """Whether each range of source_id overlaps with a sorted set of HEALPix pixels"""
+    pixels,level= healpix
+    # A level-L pixel contains the source_id range
+    # [pixel*2**(59-2L),(pixel+1)*2**(59-2L)), so compare at that level
+    shift= 59-2*level
+    counts= numpy.searchsorted(pixels,ranges[:,1] >> shift,side='right')\
+        -numpy.searchsorted(pixels,ranges[:,0] >> shift,side='left')
+    return counts > 0
+
+def _download_file(downloadPath,filePath,verbose=False,spider=False,
+                   decompress=False,refresh=False):
     downloadPath = downloadPath.replace(os.sep, '/')  # platform independent download path
+    if refresh and not spider and os.path.exists(filePath) \
+            and len(_stale([downloadPath],[filePath],
+                           compare_size=not decompress)) == 0:
+        return None
     sys.stdout.write('\r'+"Downloading file %s ...\r" \
                          % (os.path.basename(filePath)))
     sys.stdout.flush()
@@ -219,46 +392,144 @@ def _download_file(downloadPath,filePath,verbose=False,spider=False):
         # make all intermediate directories
         os.makedirs(os.path.dirname(filePath)) 
     except OSError: pass
-    # Safe way of downloading
-    downloading= True
-    interrupted= False
-    file, tmp_savefilename= tempfile.mkstemp()
-    os.close(file) #Easier this way
-    ntries= 1
-    while downloading:
-        try:
-            cmd= ['wget','%s' % downloadPath,
-                  '-O','%s' % tmp_savefilename,
-                  '--read-timeout=10',
-                  '--tries=3']
-            if not verbose: cmd.append('-q')
-            if spider: cmd.append('--spider')
-            subprocess.check_call(cmd)
-            if not spider: shutil.move(tmp_savefilename,filePath)
-            downloading= False
-            if interrupted:
-                raise KeyboardInterrupt
-        except subprocess.CalledProcessError as e:
-            if not downloading: #Assume KeyboardInterrupt
-                raise
-            elif ntries > _MAX_NTRIES:
-                raise IOError('File %s does not appear to exist on the server ...' % (os.path.basename(filePath)))
-            elif not 'exit status 4' in str(e):
-                interrupted= True
-            os.remove(tmp_savefilename)
-        except OSError as e:
-            if e.errno == errno.ENOENT:
-                raise OSError("Automagically downloading catalogs requires the wget program; please install wget and try again...")
-            else:
-                raise
-        finally:
-            if os.path.exists(tmp_savefilename):
-                os.remove(tmp_savefilename)
-        ntries+= 1
+    if spider:
+        _http.fetch(downloadPath,filePath,spider=True)
+    else:
+        # Downloads to a partial file next to filePath, which is resumed if
+        # the download is interrupted and renamed to filePath when complete
+        fetched= _pipeline([filePath],
+                           lambda filePath: _http.fetch(\
+                               downloadPath,filePath,decompress=decompress,
+                               return_validators=True,verbose=verbose),
+                           overwrite=[filePath] if refresh else [])
+        _record_downloads(fetched)
     sys.stdout.write('\r'+_ERASESTR+'\r')
     sys.stdout.flush()        
     return None
 
+def _download_files(downloadPaths,filePaths,verbose=False,
+                    nconnections=_NCONNECTIONS,refresh=False):
+    """Download many files concurrently, using up to nconnections connections at the same time; with refresh, files that are present are only downloaded again when they changed on the server"""
+    downloadPaths= dict(zip(filePaths,[downloadPath.replace(os.sep,'/')
+                                       for downloadPath in downloadPaths]))
+    stale= set()
+    if refresh:
+        present= [filePath for filePath in filePaths
+                  if os.path.exists(filePath)]
+        stale= _stale([downloadPaths[filePath] for filePath in present],
+                      present,nconnections=nconnections)
+        filePaths= [filePath for filePath in filePaths
+                    if not filePath in present or filePath in stale]
+    if len(filePaths) == 0: return None
+    if verbose:
+        sys.stdout.write('\r'+"Downloading %i files ...\r" % len(filePaths))
+        sys.stdout.flush()
+    for directory in set([os.path.dirname(filePath)
+                          for filePath in filePaths]):
+        try:
+            # make all intermediate directories
+            os.makedirs(directory)
+        except OSError: pass
+    fetched= _pipeline(filePaths,
+                       lambda filePath: _http.fetch(downloadPaths[filePath],
+                                                    filePath,
+                                                    return_validators=True),
+                       nconnections=nconnections,overwrite=stale)
+    _record_downloads(fetched)
+    if verbose:
+        sys.stdout.write('\r'+_ERASESTR+'\r')
+        sys.stdout.flush()
+    return None
+
+def _record_downloads(fetched):
+    """Record downloaded files in the manifest, from a dictionary filePath: (md5,validators)"""
+    if len(fetched) == 0: return None
+    manifest.record(list(fetched.keys()),
+                    checksums=dict([(filePath,md5) for filePath,(md5,v)
+                                    in fetched.items()]),
+                    validators=dict([(filePath,v) for filePath,(md5,v)
+                                     in fetched.items()]))
+    return None
+
+def _stale(downloadPaths,filePaths,compare_size=True,
+           nconnections=_NCONNECTIONS):
+    """Check with concurrent conditional requests which of a list of local files changed on the server since they were downloaded, using the ETag and Last-Modified headers recorded in the manifest (or, for files without these, the size of the file if compare_size and otherwise whether the server's copy was modified after the local file was written); returns the set of files that changed"""
+    if len(filePaths) == 0: return set()
+    def _check(args):
+        downloadPath,filePath,old_validators= args
+        stat= os.stat(filePath)
+        if compare_size:
+            return _http.changed(downloadPath,old_validators,
+                                 size=stat.st_size)
+        return _http.changed(downloadPath,old_validators,mtime=stat.st_mtime)
+    with ThreadPoolExecutor(max(1,min(nconnections,len(filePaths)))) \
+            as executor:
+        checked= list(executor.map(_check,
+                                   zip(downloadPaths,filePaths,
+                                       manifest.validators(filePaths))))
+    # Unchanged files get the current validators, e.g., when none were
+    # recorded yet
+    unchanged= dict([(filePath,validators)
+                     for filePath,(changed,validators) in zip(filePaths,
+                                                              checked)
+                     if not changed and len(validators) > 0])
+    if len(unchanged) > 0:
+        manifest.record(list(unchanged.keys()),checksum=False,
+                        validators=unchanged)
+    return set([filePath for filePath,(changed,validators)
+                in zip(filePaths,checked) if changed])
+
+def _pipeline(filePaths,fetch,convert=None,nconnections=_NCONNECTIONS,
+              nprocesses=None,nprefetch=_NPREFETCH,overwrite=()):
+    """
+    NAME:
+       _pipeline
+    PURPOSE:
+       create many files in two overlapping stages: fetch (e.g., download) in background threads and convert (e.g., parse and write FITS) in a pool of processes, such that the next files are downloaded while the previous ones are converted
+    INPUT:
+       filePaths - list of files to create
+       fetch - function fetch(filePath) that downloads the data for a file (and returns, e.g., the data or the MD5 checksum of the downloaded file)
+       convert= (None) function convert(filePath,fetched) that creates the file from the output of fetch, run in a separate process (must be picklable, i.e., a module-level function)
+       nconnections= (4) maximum number of concurrent fetches
+       nprocesses= (None) number of conversion processes (default: number of CPUs)
+       nprefetch= (2) maximum number of fetched files waiting to be converted in addition to those being fetched (bounds the memory and disk use)
+       overwrite= (()) files that are created again even if they exist (e.g., because they changed on the server)
+    OUTPUT:
+       dictionary filePath: output of convert (or fetch if convert is None) for the files that were created (files that exist, e.g., because they were created by another process while waiting for their lock, are skipped unless they are in overwrite)
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    if len(filePaths) == 0: return {}
+    # Each file is handled by one thread from fetch to convert, so the number
+    # of threads bounds the number of fetched files held at the same time
+    nthreads= nconnections if convert is None else nconnections+nprefetch
+    fetching= threading.Semaphore(max(1,nconnections))
+    skipped= object()
+    def _create(filePath,converters):
+        # Only one process creates each file, the others wait for it
+        with _lock.file_lock(filePath):
+            if os.path.exists(filePath) and not filePath in overwrite:
+                return skipped
+            with fetching:
+                fetched= fetch(filePath)
+            if convert is None: return fetched
+            return converters.submit(convert,filePath,fetched).result()
+    with contextlib.ExitStack() as stack:
+        converters= None if convert is None \
+            else stack.enter_context(ProcessPoolExecutor(\
+                min(nprocesses or os.cpu_count() or 1,len(filePaths))))
+        executor= stack.enter_context(\
+            ThreadPoolExecutor(max(1,min(nthreads,len(filePaths)))))
+        try:
+            out= list(executor.map(lambda filePath: _create(filePath,
+                                                            converters),
+                                   filePaths))
+        except BaseException:
+            executor.shutdown(wait=True,cancel_futures=True)
+            raise
+    return dict([(filePath,result) for filePath,result in zip(filePaths,out)
+                 if not result is skipped])
+
 def _download_file_vizier(cat,filePath,catalogname='catalog.dat'):
     sys.stdout.write('\r'+"Downloading file %s ...\r" \
                          % (os.path.basename(filePath)))
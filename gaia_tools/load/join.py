@@ -0,0 +1,113 @@
+###############################################################################
+#
+#   gaia_tools.load.join: vectorized joins of structured arrays on a key
+#
+###############################################################################
+#
+# Joins are done by sorting the keys of the second catalog once (the sort
+# index can be computed once and re-used, e.g., by storing it next to the
+# catalog) and looking up the keys of the first catalog with searchsorted.
+# Works for any key type that numpy can sort (integers, fixed-width strings).
+#
+###############################################################################
+import numpy
+def sorted_index(keys):
+    """
+    NAME:
+       sorted_index
+    PURPOSE:
+       compute the sort index of a set of keys, to be used in join_index and join
+    INPUT:
+       keys - array of keys
+    OUTPUT:
+       (sorter, sorted keys)
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    sorter= numpy.argsort(keys,kind='stable')
+    return (sorter,keys[sorter])
+
+def join_index(keys1,keys2,join_type='inner',index2=None):
+    """
+    NAME:
+       join_index
+    PURPOSE:
+       compute the indices of matching keys in two catalogs
+    INPUT:
+       keys1 - keys in the first catalog
+       keys2 - keys in the second catalog
+       join_type= ('inner') 'inner': only return matches, 'left': return all entries in the first catalog, with index -1 into the second catalog for those without a match
+       index2= (None) precomputed sorted_index(keys2)
+    OUTPUT:
+       (index into first catalog, index into second catalog), in the order of the first catalog (entries with multiple matches in the second catalog are repeated)
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    if not join_type in ['inner','left']:
+        raise ValueError("join_type must be 'inner' or 'left'")
+    if index2 is None:
+        index2= sorted_index(keys2)
+    sorter2,sorted_keys2= index2
+    keys1= numpy.asarray(keys1)
+    left= numpy.searchsorted(sorted_keys2,keys1,side='left')
+    counts= numpy.searchsorted(sorted_keys2,keys1,side='right')-left
+    if join_type == 'left':
+        nomatch= counts == 0
+        counts[nomatch]= 1
+    indx1= numpy.repeat(numpy.arange(len(keys1)),counts)
+    # Position within the block of matches of each entry in keys1
+    start= numpy.repeat(numpy.cumsum(counts)-counts,counts)
+    pos= numpy.repeat(left,counts)+numpy.arange(len(indx1))-start
+    indx2= numpy.asarray(sorter2)[numpy.minimum(pos,len(sorter2)-1)] \
+        if len(sorter2) > 0 else numpy.zeros(len(indx1),dtype='int')
+    if join_type == 'left':
+        indx2[nomatch[indx1]]= -1
+    return (indx1,indx2)
+
+def join(data1,data2,key,join_type='inner',index2=None,
+         table_names=['1','2']):
+    """
+    NAME:
+       join
+    PURPOSE:
+       join two structured arrays on a key
+    INPUT:
+       data1 - first catalog (structured array)
+       data2 - second catalog (structured array)
+       key - name of the key column, present in both catalogs
+       join_type= ('inner') 'inner': only return matches, 'left': return all entries in the first catalog, with the columns from the second catalog filled with NaN (floating-point columns) or numpy.ma's default fill value (others) for those without a match
+       index2= (None) precomputed sorted_index(data2[key])
+       table_names= (['1','2']) columns present in both catalogs are renamed to NAME_1 and NAME_2 (like astropy.table.join)
+    OUTPUT:
+       structured array, in the order of data1
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    indx1,indx2= join_index(data1[key],data2[key],join_type=join_type,
+                            index2=index2)
+    names1= data1.dtype.names
+    names2= [name for name in data2.dtype.names if name != key]
+    outnames1= [name+'_'+table_names[0] if name in names2 else name
+                for name in names1]
+    outnames2= [name+'_'+table_names[1] if name in names1 else name
+                for name in names2]
+    out= numpy.empty(len(indx1),
+                     dtype=[(outname,data1[name].dtype,data1[name].shape[1:])
+                            for name,outname in zip(names1,outnames1)]
+                     +[(outname,data2[name].dtype,data2[name].shape[1:])
+                       for name,outname in zip(names2,outnames2)])
+    for name,outname in zip(names1,outnames1):
+        out[outname]= data1[name][indx1]
+    matched= indx2 >= 0
+    for name,outname in zip(names2,outnames2):
+        if numpy.all(matched):
+            out[outname]= data2[name][indx2]
+        else:
+            out[outname]= _fill_value(out.dtype.fields[outname][0])
+            out[outname][matched]= data2[name][indx2[matched]]
+    return out
+
+def _fill_value(dtype):
+    """Value used for missing entries: NaN for floating-point columns, numpy.ma's default fill value otherwise"""
+    if dtype.base.kind == 'f': return numpy.nan
+    else: return numpy.ma.default_fill_value(dtype.base)
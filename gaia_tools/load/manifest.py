@@ -0,0 +1,386 @@
+###############################################################################
+#
+#   gaia_tools.load.manifest: manifest of the local data files
+#
+###############################################################################
+#
+# Each data directory under GAIA_TOOLS_DATA can contain a small manifest file
+# that records the files in the directory, with their size, modification
+# time, number of rows (for FITS files), MD5 checksum, and the ETag and
+# Last-Modified headers of the server that it was downloaded from (used to
+# check whether the file changed on the server). The manifest is
+# written when files are downloaded and trusted when loading, such that
+# checking whether a catalog that consists of many files is present is a
+# single small read, rather than a stat or glob of every file (which can be
+# slow on network filesystems). Files that are added, removed, or renamed
+# by other means change the modification time of the directory: every write
+# of a manifest that reflects the whole directory sets its own modification
+# time to that of the directory, and a manifest whose modification time
+# differs from that of its directory is rescanned before it is trusted (two
+# stats per directory, rather than one per file). Files that are rewritten
+# in place do not change the directory, so their size and modification
+# time are always checked on disk where this matters (checksums, validators,
+# and the column stores built from them). Updates hold
+# a cross-process lock on the manifest while they read, update, and write it,
+# such that processes that download into the same directory do not lose
+# each other's entries.
+#
+###############################################################################
+import os, os.path
+import json
+import contextlib
+import fnmatch
+import tempfile
+import threading
+import warnings
+from gaia_tools.util import file_checksum
+from gaia_tools.load import _lock
+_MANIFEST_FILENAME= '.gaia_tools_manifest.json'
+_MANIFEST_VERSION= 1
+_LOCK= threading.RLock()
+# Entries that remain valid as long as a file does not change
+_KEPT_KEYS= ['nrows','md5','etag','last_modified']
+def read(directory):
+    """
+    NAME:
+       read
+    PURPOSE:
+       read the manifest of a data directory
+    INPUT:
+       directory - data directory
+    OUTPUT:
+       dictionary with entries 'files' (dictionary of filename: {'size','mtime_ns', and possibly 'nrows', 'md5', 'etag', and 'last_modified'}) and 'scanned' (True if the whole directory was scanned, rather than only individual files recorded)
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    manifestPath= os.path.join(directory,_MANIFEST_FILENAME)
+    try:
+        with open(manifestPath,'r') as manifestfile:
+            manifest= json.load(manifestfile)
+    except (OSError,ValueError):
+        manifest= None
+    if manifest is None or manifest.get('version') != _MANIFEST_VERSION:
+        return {'files':{},'scanned':False}
+    return manifest
+
+def record(filePaths,checksum=True,checksums=None,nrows=None,
+           validators=None):
+    """
+    NAME:
+       record
+    PURPOSE:
+       record files in the manifests of their directories (e.g., after they were downloaded)
+    INPUT:
+       filePaths - list of files
+       checksum= (True) if True, also compute and record the MD5 checksum and, for FITS files, the number of rows of each file
+       checksums= (None) dictionary of already-known checksums (filePath: MD5), e.g., computed while downloading
+       nrows= (None) dictionary of already-known numbers of rows (filePath: nrows)
+       validators= (None) dictionary of the validators of the files on the server (filePath: {'etag','last_modified'}; see gaia_tools.load._http.validators)
+    OUTPUT:
+       (none)
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    if checksums is None: checksums= {}
+    if nrows is None: nrows= {}
+    if validators is None: validators= {}
+    for directory,dirFilePaths in _by_directory(filePaths).items():
+        with _locked(directory):
+            # Re-read under the lock, such that entries written by other
+            # processes are kept
+            manifest= read(directory)
+            dir_mtime_ns= os.stat(directory).st_mtime_ns \
+                if _unchanged(directory) else None
+            for filePath in dirFilePaths:
+                entry= _entry(filePath)
+                old= manifest['files'].get(os.path.basename(filePath),{})
+                if _same_file(old,entry):
+                    for key in _KEPT_KEYS:
+                        if key in old: entry[key]= old[key]
+                if filePath in validators:
+                    for key in ['etag','last_modified']:
+                        entry.pop(key,None)
+                    entry.update(validators[filePath])
+                if filePath in checksums:
+                    entry['md5']= checksums[filePath]
+                elif checksum and not 'md5' in entry:
+                    entry['md5']= file_checksum(filePath)
+                if filePath in nrows:
+                    entry['nrows']= nrows[filePath]
+                elif checksum and not 'nrows' in entry:
+                    entry_nrows= _nrows(filePath)
+                    if not entry_nrows is None: entry['nrows']= entry_nrows
+                manifest['files'][os.path.basename(filePath)]= entry
+            # If the directory changed since the manifest was last written
+            # (e.g., because the files were just downloaded into it), the
+            # manifest is not known to reflect it anymore and the directory
+            # is rescanned when it is next used
+            _write(directory,manifest,dir_mtime_ns=dir_mtime_ns)
+    return None
+
+def refresh(directory):
+    """
+    NAME:
+       refresh
+    PURPOSE:
+       rescan a data directory and update its manifest (keeping the checksums and row counts of files that did not change)
+    INPUT:
+       directory - data directory
+    OUTPUT:
+       (none)
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    _rescan(directory)
+    return None
+
+def _rescan(directory):
+    with _locked(directory):
+        manifest= read(directory)
+        files= {}
+        try:
+            # Stat before scanning, such that changes during the scan cause
+            # another rescan
+            dir_mtime_ns= os.stat(directory).st_mtime_ns
+            direntries= list(os.scandir(directory))
+        except OSError:
+            direntries= []
+        for direntry in direntries:
+            if not direntry.is_file() \
+                    or direntry.name == _MANIFEST_FILENAME \
+                    or direntry.name.startswith('.'):
+                continue
+            stat= direntry.stat()
+            entry= {'size':stat.st_size,'mtime_ns':stat.st_mtime_ns}
+            old= manifest['files'].get(direntry.name,{})
+            if _same_file(old,entry):
+                for key in _KEPT_KEYS:
+                    if key in old: entry[key]= old[key]
+            files[direntry.name]= entry
+        manifest['files']= files
+        manifest['scanned']= True
+        if len(direntries) > 0:
+            _write(directory,manifest,dir_mtime_ns=dir_mtime_ns)
+    return None
+
+def present(filePaths,refresh=False):
+    """
+    NAME:
+       present
+    PURPOSE:
+       check which of a list of files are present locally, trusting the manifest unless the directory changed since it was written (files that are not in the manifest are checked on disk and added to it when they exist)
+    INPUT:
+       filePaths - list of files
+       refresh= (False) if True, first rescan the directories of the files (even if they did not change)
+    OUTPUT:
+       list of booleans
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    out= {}
+    for directory,dirFilePaths in _by_directory(filePaths).items():
+        if refresh: _rescan(directory)
+        manifest= _read_current(directory)
+        missing= []
+        for filePath in dirFilePaths:
+            out[filePath]= os.path.basename(filePath) in manifest['files']
+            if not out[filePath] and not manifest['scanned']:
+                missing.append(filePath)
+        found= [filePath for filePath in missing if os.path.exists(filePath)]
+        for filePath in found: out[filePath]= True
+        if len(found) > 0:
+            _record_quietly(found)
+    return [out[filePath] for filePath in filePaths]
+
+def has_files(filePaths,refresh=False):
+    """
+    NAME:
+       has_files
+    PURPOSE:
+       check whether all of a list of files are present locally, trusting the manifest unless the directory changed since it was written
+    INPUT:
+       filePaths - list of files
+       refresh= (False) if True, first rescan the directories of the files
+    OUTPUT:
+       True if all files are present
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    return all(present(filePaths,refresh=refresh))
+
+def files(directory,pattern='*',refresh=False):
+    """
+    NAME:
+       files
+    PURPOSE:
+       list the files in a data directory from its manifest (the directory is scanned if this has not been done before or if it changed since the manifest was written)
+    INPUT:
+       directory - data directory
+       pattern= ('*') only return files whose name matches this shell-style pattern
+       refresh= (False) if True, rescan the directory (even if it did not change)
+    OUTPUT:
+       sorted list of files
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    manifest= read(directory) if refresh else _read_current(directory)
+    if refresh or not manifest['scanned']:
+        _rescan(directory)
+        manifest= read(directory)
+    return [os.path.join(directory,filename)
+            for filename in sorted(fnmatch.filter(manifest['files'].keys(),
+                                                  pattern))]
+
+def checksum(filePath):
+    """
+    NAME:
+       checksum
+    PURPOSE:
+       return the MD5 checksum of a file, from the manifest if the file did not change since it was recorded
+    INPUT:
+       filePath - file
+    OUTPUT:
+       hexadecimal checksum
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    entry= read(os.path.dirname(filePath))['files'].get(\
+        os.path.basename(filePath),{})
+    if 'md5' in entry and _same_file(entry,_entry(filePath)):
+        return entry['md5']
+    out= file_checksum(filePath)
+    _record_quietly([filePath],checksums={filePath:out})
+    return out
+
+def nrows(filePaths):
+    """
+    NAME:
+       nrows
+    PURPOSE:
+       return the number of rows in a list of FITS files, from the manifest when available
+    INPUT:
+       filePaths - list of files
+    OUTPUT:
+       list of number of rows
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    out= {}
+    for directory,dirFilePaths in _by_directory(filePaths).items():
+        manifest= read(directory)
+        for filePath in dirFilePaths:
+            out[filePath]= manifest['files'].get(os.path.basename(filePath),
+                                                 {}).get('nrows')
+    unknown= [filePath for filePath in filePaths if out[filePath] is None]
+    for filePath in unknown:
+        out[filePath]= _nrows(filePath)
+    if len(unknown) > 0:
+        _record_quietly(unknown,nrows=dict([(filePath,out[filePath])
+                                            for filePath in unknown]))
+    return [out[filePath] for filePath in filePaths]
+
+def validators(filePaths):
+    """
+    NAME:
+       validators
+    PURPOSE:
+       return the validators (ETag and Last-Modified headers) of the server that a list of files were downloaded from, for the files that did not change since
+    INPUT:
+       filePaths - list of files
+    OUTPUT:
+       list of dictionaries with (if known) 'etag' and 'last_modified'
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    out= {}
+    for directory,dirFilePaths in _by_directory(filePaths).items():
+        manifest= read(directory)
+        for filePath in dirFilePaths:
+            entry= manifest['files'].get(os.path.basename(filePath),{})
+            try:
+                current= _same_file(entry,_entry(filePath))
+            except OSError:
+                current= False
+            out[filePath]= dict([(key,entry[key])
+                                 for key in ['etag','last_modified']
+                                 if current and key in entry])
+    return [out[filePath] for filePath in filePaths]
+
+@contextlib.contextmanager
+def _locked(directory):
+    """Hold the in-process and cross-process locks on the manifest of a directory"""
+    with _LOCK:
+        if not os.path.isdir(directory): # nothing to write
+            yield None
+            return
+        with _lock.file_lock(os.path.join(directory,_MANIFEST_FILENAME)):
+            yield None
+
+def _by_directory(filePaths):
+    out= {}
+    for filePath in filePaths:
+        out.setdefault(os.path.dirname(filePath),[]).append(filePath)
+    return out
+
+def _read_current(directory):
+    """Read the manifest of a directory, rescanning the directory first if it changed since the manifest was written"""
+    manifest= read(directory)
+    if len(manifest['files']) > 0 and not _unchanged(directory):
+        _rescan(directory)
+        manifest= read(directory)
+    return manifest
+
+def _unchanged(directory):
+    """True if the directory did not change since its manifest was last written (see _write)"""
+    try:
+        return os.stat(os.path.join(directory,_MANIFEST_FILENAME)).st_mtime_ns \
+            == os.stat(directory).st_mtime_ns
+    except OSError:
+        return False
+
+def _entry(filePath):
+    stat= os.stat(filePath)
+    return {'size':stat.st_size,'mtime_ns':stat.st_mtime_ns}
+
+def _same_file(entry1,entry2):
+    return entry1.get('size') == entry2.get('size') \
+        and entry1.get('mtime_ns') == entry2.get('mtime_ns')
+
+def _nrows(filePath):
+    if not '.fits' in os.path.basename(filePath): return None
+    from gaia_tools.load import _fits
+    try:
+        return int(_fits.nrows(filePath,ext=1))
+    except (OSError,KeyError,IndexError,ValueError):
+        return None
+
+def _record_quietly(filePaths,checksums=None,nrows=None):
+    # Recording is only an optimization, so failing (e.g., in a read-only
+    # data directory) is not an error
+    try:
+        record(filePaths,checksum=False,checksums=checksums,nrows=nrows)
+    except OSError as e:
+        warnings.warn("Could not update the manifest of the data directory {} ({})".format(os.path.dirname(filePaths[0]),e))
+    return None
+
+def _write(directory,manifest,dir_mtime_ns=None):
+    """Write the manifest of a directory; dir_mtime_ns is the modification time of the directory at which the manifest reflected it, or None if it is not known to reflect the directory (see _unchanged)"""
+    manifest['version']= _MANIFEST_VERSION
+    # Only mark the manifest as reflecting the directory if nothing changed
+    # the directory since (writing the manifest itself changes it)
+    current= not dir_mtime_ns is None \
+        and os.stat(directory).st_mtime_ns == dir_mtime_ns
+    manifestPath= os.path.join(directory,_MANIFEST_FILENAME)
+    fd,tmpPath= tempfile.mkstemp(dir=directory,prefix=_MANIFEST_FILENAME)
+    try:
+        with os.fdopen(fd,'w') as manifestfile:
+            json.dump(manifest,manifestfile)
+        os.chmod(tmpPath,0o644)
+        os.replace(tmpPath,manifestPath)
+        if current:
+            stat= os.stat(directory)
+            os.utime(manifestPath,ns=(stat.st_atime_ns,stat.st_mtime_ns))
+    except:
+        if os.path.exists(tmpPath): os.remove(tmpPath)
+        raise
+    return None
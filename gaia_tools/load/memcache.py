@@ -0,0 +1,220 @@
+###############################################################################
+#
+#   gaia_tools.load.memcache: opt-in, in-process cache of loaded catalogs
+#
+###############################################################################
+#
+# When enabled, calls to the loaders in gaia_tools.load are memoized based on
+# the loader, its arguments, and the size and modification time of the files
+# that it reads. Entries are evicted in least-recently-used order once the
+# total size of the cached catalogs exceeds a budget. Cached arrays are made
+# read-only and every call returns a new read-only view, such that the cached
+# copy cannot be modified.
+#
+###############################################################################
+import os, os.path
+import copy
+import functools
+import inspect
+import threading
+from collections import OrderedDict
+import numpy
+from astropy.table import Table
+from gaia_tools.load import colstore
+_ENABLED= False
+_MAX_BYTES= 4*1024**3
+_CACHE= OrderedDict()
+_NBYTES= 0
+_LOCK= threading.RLock()
+def enable(max_bytes=4*1024**3):
+    """
+    NAME:
+       enable
+    PURPOSE:
+       turn on the in-process cache of loaded catalogs
+    INPUT:
+       max_bytes= (4 GB) total size of the cached catalogs above which the least-recently used ones are evicted
+    OUTPUT:
+       (none)
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    global _ENABLED, _MAX_BYTES
+    with _LOCK:
+        _ENABLED= True
+        _MAX_BYTES= max_bytes
+        _evict()
+    return None
+
+def disable():
+    """
+    NAME:
+       disable
+    PURPOSE:
+       turn off the in-process cache of loaded catalogs and release its memory
+    INPUT:
+       (none)
+    OUTPUT:
+       (none)
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    global _ENABLED
+    with _LOCK:
+        _ENABLED= False
+        clear()
+    return None
+
+def clear():
+    """
+    NAME:
+       clear
+    PURPOSE:
+       remove all entries from the in-process cache of loaded catalogs
+    INPUT:
+       (none)
+    OUTPUT:
+       (none)
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    global _NBYTES
+    with _LOCK:
+        _CACHE.clear()
+        _NBYTES= 0
+    return None
+
+def nbytes():
+    """
+    NAME:
+       nbytes
+    PURPOSE:
+       return the total size of the cached catalogs
+    INPUT:
+       (none)
+    OUTPUT:
+       size in bytes
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    return _NBYTES
+
+def memoize(sources):
+    """
+    NAME:
+       memoize
+    PURPOSE:
+       decorator that memoizes a loader in the in-process cache (when enabled)
+    INPUT:
+       sources - function that is called with a dictionary of the loader's arguments (including defaults and the contents of **kwargs) and returns the list of files that the loader reads
+    OUTPUT:
+       decorator
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    def decorator(loader):
+        signature= inspect.signature(loader)
+        @functools.wraps(loader)
+        def memoized_loader(*args,**kwargs):
+            if not _ENABLED:
+                return loader(*args,**kwargs)
+            key= _key(loader,signature,sources,args,kwargs)
+            if key is None: # unhashable arguments
+                return loader(*args,**kwargs)
+            with _LOCK:
+                if key in _CACHE:
+                    _CACHE.move_to_end(key)
+                    return _readonly_view(_CACHE[key][0])
+            out= loader(*args,**kwargs)
+            if isinstance(out,colstore.LazyCatalog):
+                # Columns are read on demand, so there is nothing to cache
+                return out
+            _store(key,out)
+            return _readonly_view(out)
+        return memoized_loader
+    return decorator
+
+def _key(loader,signature,sources,args,kwargs):
+    bound= signature.bind(*args,**kwargs)
+    bound.apply_defaults()
+    arguments= {}
+    for name,value in bound.arguments.items():
+        if signature.parameters[name].kind == inspect.Parameter.VAR_KEYWORD:
+            arguments.update(value)
+        else:
+            arguments[name]= value
+    files= []
+    for filePath in sources(arguments):
+        try:
+            stat= os.stat(filePath)
+        except OSError:
+            files.append((filePath,None))
+        else:
+            files.append((filePath,stat.st_size,stat.st_mtime_ns))
+    key= (loader.__module__,loader.__qualname__,_hashable(arguments),
+          tuple(files))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+def _hashable(value):
+    if isinstance(value,(list,tuple)):
+        return tuple([_hashable(v) for v in value])
+    elif isinstance(value,dict):
+        return tuple(sorted([(k,_hashable(v)) for k,v in value.items()]))
+    elif isinstance(value,numpy.ndarray):
+        return (value.dtype.str,value.shape,value.tobytes())
+    return value
+
+def _store(key,value):
+    global _NBYTES
+    size= _nbytes(value)
+    if size > _MAX_BYTES: return None
+    _readonly(value)
+    with _LOCK:
+        if key in _CACHE:
+            _NBYTES-= _CACHE.pop(key)[1]
+        _CACHE[key]= (value,size)
+        _NBYTES+= size
+        _evict()
+    return None
+
+def _evict():
+    global _NBYTES
+    while _NBYTES > _MAX_BYTES and len(_CACHE) > 0:
+        _NBYTES-= _CACHE.popitem(last=False)[1][1]
+    return None
+
+def _nbytes(value):
+    if isinstance(value,tuple):
+        return sum([_nbytes(v) for v in value])
+    elif isinstance(value,Table):
+        return sum([value[name].nbytes for name in value.colnames])
+    elif hasattr(value,'nbytes'):
+        return value.nbytes
+    return 0
+
+def _readonly(value):
+    if isinstance(value,tuple):
+        for v in value: _readonly(v)
+    elif isinstance(value,numpy.ndarray):
+        value.flags.writeable= False
+    elif hasattr(value,'keys') and not isinstance(value,Table): # ColumnCatalog
+        for name in value.keys():
+            _readonly(value[name])
+    return None
+
+def _readonly_view(value):
+    if isinstance(value,tuple):
+        return tuple([_readonly_view(v) for v in value])
+    elif isinstance(value,numpy.ndarray):
+        return value.view()
+    elif isinstance(value,Table):
+        # astropy Tables cannot be made read-only, so return a copy
+        return value.copy()
+    elif hasattr(value,'keys'): # ColumnCatalog
+        return value.__class__([(name,value[name].view())
+                                for name in value.keys()])
+    return copy.copy(value)
@@ -0,0 +1,387 @@
+###############################################################################
+#
+#   gaia_tools.load.mirror: checksum-verified mirroring of Gaia archive
+#                           directories
+#
+###############################################################################
+#
+# A directory of the Gaia archive (e.g., gdr2/gaia_source/csv) is mirrored to
+# the same location under $GAIA_TOOLS_DATA, using the MD5SUM file that the
+# archive provides in each directory: only files that are missing locally or
+# whose checksum does not match are downloaded (concurrently, computing the
+# checksum while the data streams in), and files that are present but not yet
+# verified are hashed in parallel. Every verified file is appended to a
+# journal in the directory, such that mirroring again (e.g., after a crash)
+# does not hash files that were already verified.
+#
+# Besides the named tables (see tables(dr)), any directory of a data release
+# can be mirrored by giving its path relative to gdr<dr>/ as the table
+# (e.g., 'gaia_source/csv'); directories(dr) lists all directories of a
+# data release by crawling the archive's directory listings. Files in
+# directories without an MD5SUM file are only downloaded when they are
+# missing.
+#
+# Can also be run as a script: python -m gaia_tools.load.mirror 2 gaia_source
+#
+###############################################################################
+import sys
+import os, os.path
+import json
+import re
+import urllib.parse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from gaia_tools.load import path, manifest, _http, _lock
+from gaia_tools.util import file_checksum
+_BASE_URL= 'http://cdn.gea.esac.esa.int/Gaia/'
+_JOURNAL_FILENAME= '.gaia_tools_mirror_journal'
+# Directories of the different tables in each data release and the name of
+# the file with the MD5 checksums
+_LAYOUTS= {1: {'md5sum':'MD5SUM.txt',
+               'tables':{'gaia_source':'gaia_source/fits',
+                         'gaia_source_csv':'gaia_source/csv',
+                         'tgas_source':'tgas_source/fits',
+                         'tgas_source_csv':'tgas_source/csv'}},
+           2: {'md5sum':'MD5SUM.txt',
+               'tables':{'gaia_source':'gaia_source/csv',
+                         'gaia_source_with_rv':'gaia_source_with_rv/csv'}},
+           3: {'md5sum':'_MD5SUM.txt',
+               'tables':{'gaia_source':'gaia_source',
+                         'astrophysical_parameters':\
+                             'Astrophysical_parameters/astrophysical_parameters',
+                         'xp_continuous_mean_spectrum':\
+                             'Spectroscopy/xp_continuous_mean_spectrum',
+                         'xp_sampled_mean_spectrum':\
+                             'Spectroscopy/xp_sampled_mean_spectrum',
+                         'rvs_mean_spectrum':\
+                             'Spectroscopy/rvs_mean_spectrum'}}}
+def mirror(dr=2,table='gaia_source',files=None,nconnections=4,nthreads=None,
+           base_url=_BASE_URL,verbose=True):
+    """
+    NAME:
+       mirror
+    PURPOSE:
+       mirror a directory of the Gaia archive to $GAIA_TOOLS_DATA, verifying all files against the archive's MD5 checksums
+    INPUT:
+       dr= (2) data release (1, 2, or 3)
+       table= ('gaia_source') table to mirror (see tables(dr) for the available tables) or path of a directory relative to gdr<dr>/ in the archive (see directories(dr))
+       files= (None) if set, only mirror these files (names in the directory)
+       nconnections= (4) maximum number of concurrent downloads
+       nthreads= (None) number of threads used to hash files that are present but not yet verified (default: number of CPUs)
+       base_url= ('http://cdn.gea.esac.esa.int/Gaia/') URL of the archive
+       verbose= (True) if True, print progress
+    OUTPUT:
+       list of the local paths of the mirrored files
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    layout= _layout(dr)
+    url= _table_url(dr,table,base_url)
+    directory= table_path(dr=dr,table=table)
+    expected= remote_checksums(dr=dr,table=table,base_url=base_url)
+    if not files is None:
+        unknown= [f for f in files if not f in expected]
+        if len(unknown) > 0:
+            raise ValueError("Files {} are not part of {}".format(', '.join(unknown),url))
+        expected= dict([(f,expected[f]) for f in files])
+    journal= _Journal(directory)
+    verified= journal.read()
+    # Files that are present, but not verified yet, are hashed in parallel
+    # (files without a checksum cannot be verified)
+    tohash= [filename for filename in sorted(expected)
+             if not expected[filename] is None
+             and not _is_verified(verified.get(filename),expected[filename],
+                                  os.path.join(directory,filename))
+             and os.path.exists(os.path.join(directory,filename))]
+    if verbose and len(tohash) > 0:
+        print("Verifying {} files in {} ...".format(len(tohash),directory))
+    if nthreads is None:
+        nthreads= os.cpu_count() or 1
+    def _hash_one(filename):
+        filePath= os.path.join(directory,filename)
+        md5= file_checksum(filePath)
+        if md5 == expected[filename]:
+            journal.append(filename,filePath,md5)
+        return md5 == expected[filename]
+    with ThreadPoolExecutor(max(1,min(nthreads,max(1,len(tohash))))) \
+            as executor:
+        list(executor.map(_hash_one,tohash))
+    verified= journal.read()
+    # Download the missing and mismatched files
+    todownload= [filename for filename in sorted(expected)
+                 if not _is_verified(verified.get(filename),
+                                     expected[filename],
+                                     os.path.join(directory,filename))]
+    if verbose and len(todownload) > 0:
+        print("Downloading {} files to {} ...".format(len(todownload),
+                                                      directory))
+    failed= []
+    failed_lock= threading.Lock()
+    def _download_one(filename):
+        filePath= os.path.join(directory,filename)
+        # Other processes mirroring the same table download each file only
+        # once: wait for them and check whether they verified the file
+        with _lock.file_lock(filePath):
+            if _is_verified(journal.get(filename),expected[filename],
+                            filePath):
+                return None
+            if expected[filename] is None: # no checksum to verify against
+                _http.fetch(url+filename,filePath)
+                return None
+            for trynum in range(2):
+                md5= _http.fetch(url+filename,filePath)
+                if md5 == expected[filename]:
+                    journal.append(filename,filePath,md5)
+                    return None
+                # Corrupted partial download: remove and start over
+                os.remove(filePath)
+        with failed_lock:
+            failed.append(filename)
+        return None
+    with ThreadPoolExecutor(max(1,min(nconnections,max(1,len(todownload))))) \
+            as executor:
+        list(executor.map(_download_one,todownload))
+    if len(failed) > 0:
+        raise IOError("Checksums of the downloaded files {} do not match those in {}".format(', '.join(failed),url+layout['md5sum']))
+    filePaths= [os.path.join(directory,filename) for filename in sorted(expected)]
+    verified= journal.read()
+    manifest.record(filePaths,checksum=False,
+                    checksums=dict([(os.path.join(directory,filename),
+                                     verified[filename]['md5'])
+                                    for filename in expected
+                                    if filename in verified]))
+    return filePaths
+
+def remote_checksums(dr=2,table='gaia_source',base_url=_BASE_URL):
+    """
+    NAME:
+       remote_checksums
+    PURPOSE:
+       return the files in a directory of the Gaia archive and their MD5 checksums (the archive's MD5SUM file is downloaded again every time, because it is small)
+    INPUT:
+       dr= (2) data release (1, 2, or 3)
+       table= ('gaia_source') table (see tables(dr) for the available tables) or path of a directory relative to gdr<dr>/
+       base_url= ('http://cdn.gea.esac.esa.int/Gaia/') URL of the archive
+    OUTPUT:
+       dictionary filename: checksum (None for all files listed in directories without an MD5SUM file)
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    layout= _layout(dr)
+    url= _table_url(dr,table,base_url)
+    directory= table_path(dr=dr,table=table)
+    try:
+        # make all intermediate directories
+        os.makedirs(directory)
+    except OSError: pass
+    md5sumPath= os.path.join(directory,layout['md5sum'])
+    # Processes mirroring the same table share the partial download
+    with _lock.file_lock(md5sumPath):
+        try:
+            _http.fetch(url+layout['md5sum'],md5sumPath)
+        except IOError:
+            subdirectories,filenames= _listing(url)
+            if layout['md5sum'] in filenames or len(filenames) == 0: raise
+            return dict([(filename,None) for filename in filenames])
+        return read_md5sum(md5sumPath)
+
+def directories(dr=2,base_url=_BASE_URL):
+    """
+    NAME:
+       directories
+    PURPOSE:
+       return all directories of a data release in the Gaia archive that contain files, by crawling the archive's directory listings (each can be mirrored with mirror(dr=dr,table=directory))
+    INPUT:
+       dr= (2) data release (1, 2, or 3)
+       base_url= ('http://cdn.gea.esac.esa.int/Gaia/') URL of the archive
+    OUTPUT:
+       list of directories relative to gdr<dr>/ ('' for gdr<dr>/ itself)
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    _layout(dr)
+    out= []
+    todo= ['']
+    while len(todo) > 0:
+        directory= todo.pop(0)
+        subdirectories,filenames= _listing(_table_url(dr,directory,base_url))
+        if len(filenames) > 0: out.append(directory)
+        todo.extend([directory+subdirectory
+                     for subdirectory in subdirectories])
+    return sorted([d.rstrip('/') for d in out])
+
+def tables(dr=2):
+    """
+    NAME:
+       tables
+    PURPOSE:
+       return the tables that can be mirrored for a data release
+    INPUT:
+       dr= (2) data release (1, 2, or 3)
+    OUTPUT:
+       list of table names
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    return sorted(_layout(dr)['tables'].keys())
+
+def table_path(dr=2,table='gaia_source'):
+    """
+    NAME:
+       table_path
+    PURPOSE:
+       return the local directory that a table is mirrored to
+    INPUT:
+       dr= (2) data release (1, 2, or 3)
+       table= ('gaia_source') table
+    OUTPUT:
+       directory
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    return os.path.join(path._GAIA_TOOLS_DATA,'Gaia','gdr{}'.format(dr),
+                        *_table_directory(dr,table).split('/'))
+
+def read_md5sum(filePath):
+    """
+    NAME:
+       read_md5sum
+    PURPOSE:
+       parse an MD5SUM file (lines of 'checksum  filename')
+    INPUT:
+       filePath - path of the MD5SUM file
+    OUTPUT:
+       dictionary filename: checksum
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    out= {}
+    with open(filePath,'r') as md5file:
+        for line in md5file:
+            line= line.strip()
+            if len(line) == 0 or line.startswith('#'): continue
+            md5,filename= line.split(None,1)
+            # md5sum marks files read in binary mode with a leading *
+            out[os.path.basename(filename.lstrip('*').strip())]= md5.lower()
+    return out
+
+class _Journal(object):
+    """Append-only journal of the verified files in a directory"""
+    def __init__(self,directory):
+        self._journalPath= os.path.join(directory,_JOURNAL_FILENAME)
+        self._lock= threading.Lock()
+        # Entries read so far and where to continue reading, such that
+        # reading again only parses the lines appended since (e.g., by
+        # other processes)
+        self._entries= {}
+        self._offset= 0
+        return None
+
+    def read(self):
+        with self._lock:
+            self._update()
+            return dict(self._entries)
+
+    def get(self,filename):
+        with self._lock:
+            self._update()
+            return self._entries.get(filename)
+
+    def _update(self):
+        """Parse the lines appended since the last read"""
+        if not os.path.exists(self._journalPath): return None
+        with open(self._journalPath,'rb') as journalfile:
+            if os.fstat(journalfile.fileno()).st_size < self._offset:
+                # Journal was replaced: start over
+                self._entries= {}
+                self._offset= 0
+            journalfile.seek(self._offset)
+            for line in journalfile:
+                if not line.endswith(b'\n'): # being written
+                    break
+                self._offset+= len(line)
+                try:
+                    entry= json.loads(line)
+                except ValueError: # incomplete line after a crash
+                    continue
+                self._entries[entry['file']]= entry
+        return None
+
+    def append(self,filename,filePath,md5):
+        stat= os.stat(filePath)
+        line= json.dumps({'file':filename,'md5':md5,'size':stat.st_size,
+                          'mtime_ns':stat.st_mtime_ns})
+        with self._lock:
+            with open(self._journalPath,'a') as journalfile:
+                journalfile.write(line+'\n')
+                journalfile.flush()
+                os.fsync(journalfile.fileno())
+        return None
+
+def _is_verified(entry,md5,filePath):
+    if md5 is None: # no checksum to verify against: present is good enough
+        return os.path.exists(filePath)
+    if entry is None or entry['md5'] != md5: return False
+    try:
+        stat= os.stat(filePath)
+    except OSError:
+        return False
+    return entry['size'] == stat.st_size \
+        and entry['mtime_ns'] == stat.st_mtime_ns
+
+def _table_url(dr,table,base_url):
+    directory= _table_directory(dr,table)
+    return base_url.rstrip('/')+'/gdr{}/'.format(dr) \
+        +(directory+'/' if directory else '')
+
+def _table_directory(dr,table):
+    """Directory of a table relative to gdr<dr>/: that of a named table or the table itself if it is a directory"""
+    layout= _layout(dr)
+    if table in layout['tables']:
+        return layout['tables'][table]
+    directory= table.strip('/')
+    if directory == '' \
+            or not any([part in ['','.','..']
+                        for part in directory.split('/')]):
+        return directory
+    raise ValueError("Table {} is neither one of the tables of DR{} ({}) nor a directory in gdr{}/".format(table,dr,', '.join(tables(dr)),dr))
+
+_HREF_RE= re.compile(r'href="([^"?#]+)"',re.IGNORECASE)
+def _listing(url):
+    """Subdirectories and files in the HTML listing of a directory in the archive"""
+    html= _http.read(url).decode('utf-8',errors='replace')
+    subdirectories= []
+    filenames= []
+    for href in _HREF_RE.findall(html):
+        href= urllib.parse.unquote(href)
+        # only entries in this directory
+        if href.startswith('/') or href.startswith('.') or ':' in href \
+                or '/' in href.rstrip('/'):
+            continue
+        if href.endswith('/'):
+            if not href in subdirectories: subdirectories.append(href)
+        elif not href.startswith('index.html') and not href in filenames:
+            filenames.append(href)
+    return (subdirectories,filenames)
+
+def _layout(dr):
+    try:
+        return _LAYOUTS[int(dr)]
+    except (KeyError,ValueError):
+        raise ValueError("Mirroring is only available for DR1, DR2, and DR3")
+
+if __name__ == '__main__':
+    import argparse
+    parser= argparse.ArgumentParser(\
+        description='Mirror a table of the Gaia archive to $GAIA_TOOLS_DATA, verifying all files against the archive\'s MD5 checksums')
+    parser.add_argument('dr',type=int,help='data release (1, 2, or 3)')
+    parser.add_argument('table',nargs='?',default='gaia_source',
+                        help='table to mirror (default: gaia_source)')
+    parser.add_argument('--nconnections',type=int,default=4,
+                        help='maximum number of concurrent downloads')
+    parser.add_argument('--nthreads',type=int,default=None,
+                        help='number of threads used to hash files')
+    args= parser.parse_args()
+    mirror(dr=args.dr,table=args.table,nconnections=args.nconnections,
+           nthreads=args.nthreads)
+    sys.exit(0)
@@ -1,5 +1,5 @@
 import os, os.path
-import glob
+from gaia_tools.load import manifest
 
 _GAIA_TOOLS_DATA= os.getenv('GAIA_TOOLS_DATA')
 if _GAIA_TOOLS_DATA is None:
@@ -66,7 +66,14 @@ def gaiarvPath(dr=2,format='fits'):
                              'gaia_source_with_rv',format,
                              f+'.%s' % extension) for f in filenames]
 
-def gaiaSourcePath(dr=1,format='fits'):
+def gaiarvStorePath(dr=2):
+    if dr == 2 or dr == '2':
+        return os.path.join(_GAIA_TOOLS_DATA,'Gaia','gdr2',
+                            'gaia_source_with_rv','npy')
+
+def gaiaSourcePath(dr=1,format='fits',refresh=False):
+    # DR2 files are listed from the manifest of the data directory; use
+    # refresh=True to rescan the directory
     if format == 'csv': extension= 'csv.gz'
     else: extension= format
     if dr == 1 or dr == '1':
@@ -82,9 +89,9 @@ def gaiaSourcePath(dr=1,format='fits'):
                             'GaiaSource_000-020-%03i.%s' % (ii,extension))
                     for ii in range(111)])
     elif dr == 2 or dr == '2':
-        return glob.glob(os.path.join(_GAIA_TOOLS_DATA,'Gaia','gdr2',
-                                      'gaia_source',format,
-                                      'GaiaSource_*.%s' % extension))
+        return manifest.files(os.path.join(_GAIA_TOOLS_DATA,'Gaia','gdr2',
+                                           'gaia_source',format),
+                              'GaiaSource_*.%s' % extension,refresh=refresh)
     return out
 
 def galahPath(dr=3):
@@ -143,3 +150,6 @@ def tgasPath(dr=1,old=False):
         return [os.path.join(_GAIA_TOOLS_DATA,'Gaia','gdr1','tgas_source','fits',
                              'TgasSource_000-000-%03i.fits' % ii)
                 for ii in range(16)]
+
+def tgasStorePath(dr=1):
+    return os.path.join(_GAIA_TOOLS_DATA,'Gaia','gdr1','tgas_source','npy')
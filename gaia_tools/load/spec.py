@@ -1,96 +1,318 @@
 import os
 import glob
+import shutil
+import tempfile
 import tqdm
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
+from numpy.lib.format import open_memmap
 from astropy.io import ascii
-from itertools import compress
 import warnings
 
 from .path import _GAIA_TOOLS_DATA
+from . import _lock, colstore
+from ..util import prefetch
 
 
-def read_spec_internal(source_ids, assume_unique, base_path, wavelength_grid):
+def read_spec_internal(source_ids, assume_unique, base_path, wavelength_grid, ncpu=1):
     """
-    internal function to read spectra based on a list of source id
+    internal function to read spectra based on a list of source id; with
+    ncpu > 1, the files are read in parallel by ncpu processes
     """
-    file_paths = glob.glob(os.path.join(base_path, "*.csv.gz"))
-    if len(file_paths) == 0:
-        raise FileNotFoundError(f"Gaia data does not exist at {base_path}")
-    file_names = [os.path.basename(x) for x in file_paths]
+    file_names = _list_files(base_path)
 
     source_ids = np.atleast_1d(source_ids)
+    # deal with duplicated source_id: read each unique source once and expand
+    # to the requested order at the end
+    if not assume_unique:
+        requested_source_ids = source_ids
+        source_ids, inverse = np.unique(source_ids, return_inverse=True)
     # HEALpix level 8: 8796093022208
     reduced_source_ids = source_ids // 8796093022208
     num_source = len(reduced_source_ids)
 
-    all_spec = np.zeros([num_source, len(wavelength_grid)], dtype=np.float32)
-    all_spec_error = np.zeros([num_source, len(wavelength_grid)], dtype=np.float32)
-    not_found = np.ones(num_source, dtype=bool)
-    
-    # Extract HEALPix level-8 from file name
-    healpix_8_min = [
-        int(file[file.find("_") + 1 : file.rfind("-")]) for file in file_names
-    ]
-    healpix_8_max = [
-        int(file[file.rfind("-") + 1 : file.rfind(".csv")]) for file in file_names
-    ]
-    reference_file = {
-        "file": file_names,
-        "healpix8_min": healpix_8_min,
-        "healpix8_max": healpix_8_max,
-    }
-
-    combo_comparisons = np.asarray(
-        [
-            (reference_file["healpix8_min"] <= i)
-            & (i <= reference_file["healpix8_max"])
-            for i in reduced_source_ids
-        ]
-    )
-    files_required = np.unique(
-        [list(compress(file_names, i)) for i in combo_comparisons]
-    )
-
-    if not np.all(np.any(combo_comparisons, axis=1)):
+    # Map each source to the file that covers its HEALPix level-8 pixel and
+    # group the sources by file
+    file_names, healpix8_min, healpix8_max = _file_index(file_names)
+    file_idx = _assign_files(reduced_source_ids, healpix8_min, healpix8_max)
+    if np.any(file_idx < 0):
         raise ValueError("Contain invalid Gaia source id")
+    sorter = np.argsort(file_idx, kind="stable")
+    files_required, start, count = np.unique(
+        file_idx[sorter], return_index=True, return_counts=True
+    )
 
-    for idx, i in enumerate(tqdm.tqdm(file_names, desc="Working on data file:")):
-        if not i in files_required:
-            continue
-        else:
-            spec_f = ascii.read(os.path.join(base_path, i))
-            current_source_ids = source_ids[combo_comparisons[:, idx]]
-            matches, idx1, idx2 = np.intersect1d(
-                current_source_ids,
-                spec_f["source_id"].data,
-                assume_unique=False,
-                return_indices=True,
+    tasks = [
+        (file_names[i], sorter[first : first + n])
+        for i, first, n in zip(files_required, start, count)
+    ]
+    if ncpu > 1 and len(tasks) > 1:
+        all_spec, all_spec_error, not_found = _read_files_parallel(
+            tasks, source_ids, base_path, len(wavelength_grid), ncpu
+        )
+    else:
+        all_spec = np.zeros([num_source, len(wavelength_grid)], dtype=np.float32)
+        all_spec_error = np.zeros([num_source, len(wavelength_grid)], dtype=np.float32)
+        not_found = np.ones(num_source, dtype=bool)
+        for file_name, current_idx in tqdm.tqdm(tasks, desc="Working on data file:"):
+            _fill_from_file(
+                base_path,
+                file_name,
+                current_idx,
+                source_ids[current_idx],
+                all_spec,
+                all_spec_error,
+                not_found,
             )
-            if len(matches) > 0:
-                current_idx = np.where(combo_comparisons[:, idx])[0][idx1]
-                all_spec[current_idx] = np.vstack(spec_f["flux"][idx2])
-                all_spec_error[current_idx] = np.vstack(spec_f["flux_error"][idx2])
-                not_found[current_idx] = False
 
-    # deal with duplicated source_id
     if not assume_unique:
-        uniques = np.unique(source_ids, return_index=True)[1]
-        result = np.ones_like(source_ids, dtype=bool)
-        result[uniques] = False
-        duplicated_idx = np.where(result)[0]
-        for i in duplicated_idx:
-            first_occurence_idx = np.argmax(source_ids == source_ids[i])
-            all_spec[i] = all_spec[first_occurence_idx]
-            all_spec_error[i] = all_spec_error[first_occurence_idx]
-            not_found[i] = not_found[first_occurence_idx]
-            
+        source_ids = requested_source_ids
+        all_spec = all_spec[inverse]
+        all_spec_error = all_spec_error[inverse]
+        not_found = not_found[inverse]
+
     if np.any(not_found):
         warnings.warn(f"These source id have no corresponding spectra found: {source_ids[not_found]}")
 
     return wavelength_grid, all_spec, all_spec_error
 
 
-def load_rvs_spec(source_ids, assume_unique=False):
+def iter_spec_internal(source_ids, base_path, num_pix, batch_size, nprefetch=1):
+    """
+    internal function to iterate over the spectra of a list of source id in
+    batches, in file order, while the next batches are read in the background
+    """
+    file_names, healpix8_min, healpix8_max = _file_index(_list_files(base_path))
+    source_ids = np.atleast_1d(source_ids)
+    file_idx = _assign_files(source_ids // 8796093022208, healpix8_min, healpix8_max)
+    if np.any(file_idx < 0):
+        raise ValueError("Contain invalid Gaia source id")
+    # files are sorted by HEALPix range, so sorting by source_id puts the
+    # sources in file order and in row order within each file
+    order = np.argsort(source_ids, kind="stable")
+
+    def _batches():
+        for first in range(0, len(order), batch_size):
+            indices = order[first : first + batch_size]
+            batch_file_idx = file_idx[indices]
+            flux = np.zeros([len(indices), num_pix], dtype=np.float32)
+            flux_error = np.zeros([len(indices), num_pix], dtype=np.float32)
+            not_found = np.ones(len(indices), dtype=bool)
+            bounds = np.concatenate(
+                [[0], np.flatnonzero(np.diff(batch_file_idx)) + 1, [len(indices)]]
+            )
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                _fill_from_file(
+                    base_path,
+                    file_names[batch_file_idx[start]],
+                    np.arange(start, end),
+                    source_ids[indices[start:end]],
+                    flux,
+                    flux_error,
+                    not_found,
+                )
+            if np.any(not_found):
+                warnings.warn(
+                    f"These source id have no corresponding spectra found: {source_ids[indices[not_found]]}"
+                )
+            yield indices, flux, flux_error
+
+    return prefetch(_batches(), nprefetch=nprefetch)
+
+
+def _list_files(base_path):
+    """
+    Names of the spectra files in a directory
+    """
+    file_paths = glob.glob(os.path.join(base_path, "*.csv.gz"))
+    if len(file_paths) == 0:
+        raise FileNotFoundError(f"Gaia data does not exist at {base_path}")
+    return [os.path.basename(x) for x in file_paths]
+
+
+def _fill_from_file(
+    base_path, file_name, current_idx, current_source_ids, all_spec, all_spec_error, not_found
+):
+    """
+    Fill the rows current_idx of the output arrays with the spectra of
+    current_source_ids from one spectra file
+    """
+    spec_f = _read_spec_file(base_path, file_name)
+    # binary search in the sorted source_id of the file, such that only
+    # the rows that are needed are read from the memory-mapped spectra
+    rows = _find_rows(spec_f["source_id"], current_source_ids)
+    found = rows >= 0
+    if np.any(found):
+        current_idx = current_idx[found]
+        all_spec[current_idx] = spec_f["flux"][rows[found]]
+        all_spec_error[current_idx] = spec_f["flux_error"][rows[found]]
+        not_found[current_idx] = False
+
+
+def _fill_from_file_shared(base_path, file_name, current_idx, current_source_ids, out_paths):
+    """
+    _fill_from_file for a worker process, writing into the output arrays
+    shared between all workers as memory-mapped files
+    """
+    outs = [np.load(out_path, mmap_mode="r+") for out_path in out_paths]
+    _fill_from_file(base_path, file_name, current_idx, current_source_ids, *outs)
+    for out in outs:
+        out.flush()
+
+
+def _read_files_parallel(tasks, source_ids, base_path, num_pix, ncpu):
+    """
+    Read the spectra files in parallel with a pool of ncpu processes that
+    write directly into memory-mapped output arrays (each source is in only
+    one file, so the processes write disjoint rows); the output arrays are
+    read back into memory, such that they are the same plain arrays as for a
+    serial read, and the scratch files are removed
+    """
+    num_source = len(source_ids)
+    tmp_dir = _scratch_dir(base_path)
+    try:
+        out_paths = [
+            os.path.join(tmp_dir, f"{name}.npy")
+            for name in ["flux", "flux_error", "not_found"]
+        ]
+        for out_path, dtype, shape in zip(
+            out_paths,
+            [np.float32, np.float32, bool],
+            [(num_source, num_pix), (num_source, num_pix), (num_source,)],
+        ):
+            out = open_memmap(out_path, mode="w+", dtype=dtype, shape=shape)
+            out[:] = dtype == bool
+            out.flush()
+            del out
+        with ProcessPoolExecutor(min(ncpu, len(tasks))) as executor:
+            futures = [
+                executor.submit(
+                    _fill_from_file_shared,
+                    base_path,
+                    file_name,
+                    current_idx,
+                    source_ids[current_idx],
+                    out_paths,
+                )
+                for file_name, current_idx in tasks
+            ]
+            for future in tqdm.tqdm(
+                as_completed(futures), total=len(futures), desc="Working on data file:"
+            ):
+                future.result()
+        # no memory maps of the scratch files are kept open, such that they
+        # can be removed below on every platform
+        return tuple(np.load(out_path) for out_path in out_paths)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _scratch_dir(base_path):
+    """
+    Scratch directory for the output arrays of a parallel read, next to the
+    binary versions of the spectra files (on the same, large filesystem), or
+    in the default temporary directory (set by TMPDIR) if the data directory
+    is not writable
+    """
+    try:
+        store_dir = os.path.join(base_path, "npy")
+        os.makedirs(store_dir, exist_ok=True)
+        return tempfile.mkdtemp(prefix=".scratch_", dir=store_dir)
+    except OSError:
+        return tempfile.mkdtemp()
+
+
+def _file_index(file_names):
+    """
+    Sort a list of spectra files (named ..._<healpix8 min>-<healpix8 max>.csv.gz)
+    by the range of HEALPix level-8 pixels that they cover; returns the sorted
+    file names and the minimum and maximum pixel of each file
+    """
+    healpix_8_min = np.array(
+        [int(file[file.find("_") + 1 : file.rfind("-")]) for file in file_names],
+        dtype=np.int64,
+    )
+    healpix_8_max = np.array(
+        [int(file[file.rfind("-") + 1 : file.rfind(".csv")]) for file in file_names],
+        dtype=np.int64,
+    )
+    sorter = np.argsort(healpix_8_min)
+    return (
+        [file_names[i] for i in sorter],
+        healpix_8_min[sorter],
+        healpix_8_max[sorter],
+    )
+
+
+def _assign_files(healpix8, healpix8_min, healpix8_max):
+    """
+    Index of the file that covers each HEALPix level-8 pixel, from the sorted
+    pixel ranges of the files (binary search); -1 for pixels not in any file
+    """
+    file_idx = np.searchsorted(healpix8_min, healpix8, side="right") - 1
+    valid = file_idx >= 0
+    valid[valid] = healpix8[valid] <= healpix8_max[file_idx[valid]]
+    file_idx[~valid] = -1
+    return file_idx
+
+
+def _read_spec_file(base_path, file_name):
+    """
+    Open the binary, memory-mapped version of a spectra file (source_id in
+    sorted order and float32 flux and flux_error matrices), converting the
+    csv.gz file the first time that it is read (or when it changed)
+    """
+    file_path = os.path.join(base_path, file_name)
+    store_path = _store_path(base_path, file_name)
+    if colstore.is_current(store_path, [file_path]):
+        return colstore.read(store_path, memmap=True)
+    try:
+        # only one process converts the file, the others wait for it
+        with _lock.file_lock(store_path):
+            if not colstore.is_current(store_path, [file_path]):
+                colstore.write(store_path, _parse_spec_file(file_path), [file_path])
+    except OSError as e:  # e.g., read-only data directory
+        warnings.warn(f"Could not write the binary version of {file_name} ({e})")
+        return _parse_spec_file(file_path)
+    return colstore.read(store_path, memmap=True)
+
+
+def _parse_spec_file(file_path):
+    """
+    Read a csv.gz spectra file into columns sorted by source_id
+    """
+    spec_f = ascii.read(file_path)
+    sorter = np.argsort(spec_f["source_id"].data, kind="stable")
+    return colstore.ColumnCatalog(
+        [
+            ("source_id", np.asarray(spec_f["source_id"], dtype=np.int64)[sorter]),
+            # the spectra can be object columns of variable-length arrays
+            ("flux", np.vstack(spec_f["flux"]).astype(np.float32)[sorter]),
+            ("flux_error", np.vstack(spec_f["flux_error"]).astype(np.float32)[sorter]),
+        ]
+    )
+
+
+def _store_path(base_path, file_name):
+    """
+    Directory of the binary version of a spectra file
+    """
+    return os.path.join(base_path, "npy", file_name.replace(".csv.gz", ""))
+
+
+def _find_rows(sorted_source_ids, source_ids):
+    """
+    Row of each source_id in a sorted array of source_id; -1 if not present
+    """
+    if len(sorted_source_ids) == 0:
+        return np.full(len(source_ids), -1)
+    rows = np.searchsorted(sorted_source_ids, source_ids)
+    rows[rows == len(sorted_source_ids)] = 0
+    rows[sorted_source_ids[rows] != source_ids] = -1
+    return rows
+
+
+def load_rvs_spec(source_ids, assume_unique=False, ncpu=1):
     """
     NAME:
         load_rvs_spec
@@ -99,10 +321,12 @@ def load_rvs_spec(source_ids, assume_unique=False):
     INPUT:
         source_ids (int, list, ndarray): source id
         assume_unique (bool): whether to assume the list of source id is unique
+        ncpu (int): number of processes used to read the spectra files in parallel
     OUTPUT:
         wavelength grid, RVS spectra flux row matched to source_id, RVS spectra corresponding flux uncertainty
     HISTORY:
         2022-06-16 - Written - Henry Leung (UofT)
+        2026-10-16 - Added ncpu - Bovy (UofT)
     """
     base_path = os.path.join(
         _GAIA_TOOLS_DATA, "Gaia","gdr3","Spectroscopy","rvs_mean_spectrum"
@@ -113,10 +337,11 @@ def load_rvs_spec(source_ids, assume_unique=False):
         assume_unique=assume_unique,
         base_path=base_path,
         wavelength_grid=wavelength_grid,
+        ncpu=ncpu,
     )
 
 
-def load_xp_sampled_spec(source_ids, assume_unique=False):
+def load_xp_sampled_spec(source_ids, assume_unique=False, ncpu=1):
     """
     NAME:
         load_xp_sampled_spec
@@ -125,10 +350,12 @@ def load_xp_sampled_spec(source_ids, assume_unique=False):
     INPUT:
         source_ids (int, list, ndarray): source id
         assume_unique (bool): whether to assume the list of source id is unique
+        ncpu (int): number of processes used to read the spectra files in parallel
     OUTPUT:
         wavelength grid, XP spectra flux row matched to source_id, XP spectra corresponding flux uncertainty
     HISTORY:
         2022-06-16 - Written - Henry Leung (UofT)
+        2026-10-16 - Added ncpu - Bovy (UofT)
     """
     base_path = os.path.join(
         _GAIA_TOOLS_DATA, "Gaia","gdr3","Spectroscopy","xp_sampled_mean_spectrum"
@@ -139,4 +366,59 @@ def load_xp_sampled_spec(source_ids, assume_unique=False):
         assume_unique=assume_unique,
         base_path=base_path,
         wavelength_grid=wavelength_grid,
+        ncpu=ncpu,
+    )
+
+
+def iter_rvs_spec(source_ids, batch_size=10000, nprefetch=1):
+    """
+    NAME:
+        iter_rvs_spec
+    PURPOSE:
+        Iterate over the RVS spectra of a list of source id in batches, in constant memory
+    INPUT:
+        source_ids (int, list, ndarray): source id
+        batch_size (int): number of spectra in each batch
+        nprefetch (int): number of batches that are read ahead in the background
+    OUTPUT:
+        generator of (indices into source_ids, RVS spectra flux, RVS spectra corresponding flux uncertainty) batches, in the order of the data files (wavelength grid as returned by load_rvs_spec)
+    HISTORY:
+        2026-10-16 - Written - Bovy (UofT)
+    """
+    base_path = os.path.join(
+        _GAIA_TOOLS_DATA, "Gaia","gdr3","Spectroscopy","rvs_mean_spectrum"
+    )
+    return iter_spec_internal(
+        source_ids=source_ids,
+        base_path=base_path,
+        num_pix=len(np.arange(846, 870.01, 0.01)),
+        batch_size=batch_size,
+        nprefetch=nprefetch,
+    )
+
+
+def iter_xp_sampled_spec(source_ids, batch_size=10000, nprefetch=1):
+    """
+    NAME:
+        iter_xp_sampled_spec
+    PURPOSE:
+        Iterate over the XP spectra of a list of source id in batches, in constant memory
+    INPUT:
+        source_ids (int, list, ndarray): source id
+        batch_size (int): number of spectra in each batch
+        nprefetch (int): number of batches that are read ahead in the background
+    OUTPUT:
+        generator of (indices into source_ids, XP spectra flux, XP spectra corresponding flux uncertainty) batches, in the order of the data files (wavelength grid as returned by load_xp_sampled_spec)
+    HISTORY:
+        2026-10-16 - Written - Bovy (UofT)
+    """
+    base_path = os.path.join(
+        _GAIA_TOOLS_DATA, "Gaia","gdr3","Spectroscopy","xp_sampled_mean_spectrum"
+    )
+    return iter_spec_internal(
+        source_ids=source_ids,
+        base_path=base_path,
+        num_pix=len(np.arange(336.0, 1022.0, 2.0)),
+        batch_size=batch_size,
+        nprefetch=nprefetch,
     )
@@ -1,7 +1,10 @@
 import os, os.path
+import hashlib
 import tempfile
 import shutil
 import pickle
+import queue
+import threading
 
 def save_pickles(savefilename,*args,**kwargs):
     """
@@ -43,3 +46,80 @@ def save_pickles(savefilename,*args,**kwargs):
         finally:
             if file_open:
                 savefile.close()
+
+def prefetch(iterable,nprefetch=1):
+    """
+    NAME:
+       prefetch
+    PURPOSE:
+       iterate over an iterable while a background thread already computes the next items
+    INPUT:
+       iterable - iterable to go through (e.g., a generator that reads files)
+       nprefetch= (1) maximum number of items that are computed ahead of the consumer (bounds the memory use)
+    OUTPUT:
+       generator over the items of iterable
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    buffer= queue.Queue(maxsize=max(1,nprefetch))
+    stop= threading.Event()
+    end= object()
+    def _put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item,timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    def _produce():
+        try:
+            for item in iterable:
+                if not _put((True,item)): return
+        except BaseException as e:
+            _put((False,e))
+            return
+        _put((True,end))
+    thread= threading.Thread(target=_produce,daemon=True)
+    thread.start()
+    try:
+        while True:
+            ok,item= buffer.get()
+            if not ok:
+                raise item
+            elif item is end:
+                return
+            yield item
+    finally:
+        # Also stops the producer when the consumer stops early
+        stop.set()
+        thread.join()
+
+_CHECKSUMS= {}
+_CHECKSUMS_LOCK= threading.Lock()
+def file_checksum(filePath,buffersize=16*1024**2):
+    """
+    NAME:
+       file_checksum
+    PURPOSE:
+       compute the MD5 checksum of a file (memoized in-process on the file's path, size, and modification time, such that large files are only hashed once)
+    INPUT:
+       filePath - path of the file
+       buffersize= (16 MB) size of the chunks in which the file is read
+    OUTPUT:
+       hexadecimal checksum
+    HISTORY:
+       2026-10-16 - Written - Bovy (UofT)
+    """
+    stat= os.stat(filePath)
+    key= (os.path.abspath(filePath),stat.st_size,stat.st_mtime_ns)
+    with _CHECKSUMS_LOCK:
+        if key in _CHECKSUMS: return _CHECKSUMS[key]
+    md5= hashlib.md5()
+    with open(filePath,'rb') as fileobj:
+        for chunk in iter(lambda: fileobj.read(buffersize),b''):
+            md5.update(chunk)
+    out= md5.hexdigest()
+    with _CHECKSUMS_LOCK:
+        _CHECKSUMS[key]= out
+    return out
@@ -185,9 +185,11 @@ def cds(cat,xcat='vizier:I/350/gaiaedr3',maxdist=2,colRA='RA',colDec='DEC',
     with open(posfilename,'w') as csvfile:
         wr= csv.writer(csvfile,delimiter=',',quoting=csv.QUOTE_MINIMAL)
         wr.writerow(['RA','DEC'])
+        ra= cat[colRA]
+        dec= cat[colDec]
         for ii in range(len(cat)):
-            wr.writerow([(cat[ii][colRA]-dra[ii]+360.) % 360.,
-                          cat[ii][colDec]]-ddec[ii])
+            wr.writerow([(ra[ii]-dra[ii]+360.) % 360.,
+                          dec[ii]]-ddec[ii])
     _cds_match_batched(resultfilename,posfilename,maxdist,selection,xcat)
     # Directly match on input RA
     ma= cds_load(resultfilename)
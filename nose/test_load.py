@@ -0,0 +1,1108 @@
+# Tests of gaia_tools.load, using small fake catalogs
+import os, os.path
+import tempfile
+import gzip
+import contextlib
+import numpy
+import numpy.lib.recfunctions
+os.environ.setdefault('GAIA_TOOLS_DATA',tempfile.mkdtemp())
+import astropy.io.fits as pyfits
+import gaia_tools.load
+from gaia_tools.load import path, colstore, manifest
+
+def test_tgas_columnstore():
+    # Test that the consolidated column store returns the same as stacking
+    # the shards
+    data_dir= _setup_data_dir()
+    shards= _write_fake_tgas(data_dir)
+    tgas= gaia_tools.load.tgas()
+    full= numpy.concatenate(shards)
+    assert len(tgas) == len(full), 'Column store does not have the right number of rows'
+    for name in full.dtype.names:
+        assert numpy.all(tgas[name] == full[name]), 'Column store does not return the same data as the shards for column {}'.format(name)
+    assert colstore.is_current(path.tgasStorePath(),path.tgasPath()), 'Column store not built upon first use'
+    stacked= numpy.lib.recfunctions.stack_arrays(shards)
+    assert type(tgas) == type(stacked) and not numpy.any(tgas.mask['ra']) \
+        and numpy.all(tgas.filled()['ra'] == stacked.filled()['ra']), 'tgas() does not return a masked array like stack_arrays'
+    # Memory-mapped version
+    tgas_mm= gaia_tools.load.tgas(memmap=True)
+    assert isinstance(tgas_mm['ra'],numpy.memmap), 'tgas(memmap=True) does not return memory-mapped columns'
+    assert numpy.all(tgas_mm[tgas_mm['parallax'] > 1.]['source_id'] \
+                         == full[full['parallax'] > 1.]['source_id']), 'Indexing a ColumnCatalog does not work as expected'
+    assert numpy.all(tgas_mm['pos'] == full['pos']), 'Multi-dimensional columns not stored correctly'
+    # Store is rebuilt when a shard changes
+    shard= shards[3].copy()
+    shard['ra']+= 1.
+    pyfits.writeto(path.tgasPath()[3],shard,overwrite=True)
+    os.utime(path.tgasPath()[3],ns=(0,0))
+    assert not colstore.is_current(path.tgasStorePath(),path.tgasPath()), 'Column store not marked as out-of-date when a shard changes'
+    tgas= gaia_tools.load.tgas()
+    assert numpy.all(tgas['ra'][30:40] == shard['ra']), 'Column store not rebuilt when a shard changes'
+    # Processes that start at the same time wait for the one that builds
+    # the store, rather than failing and reading the shards
+    import shutil, subprocess, sys
+    shutil.rmtree(path.tgasStorePath())
+    procs= [subprocess.Popen([sys.executable,'-W','error','-c',
+                              'import gaia_tools.load; '
+                              'gaia_tools.load.tgas()'],
+                             env=dict(os.environ,GAIA_TOOLS_DATA=data_dir))
+            for ii in range(4)]
+    assert all([proc.wait() == 0 for proc in procs]), 'Concurrent builds of the column store fail'
+    assert colstore.is_current(path.tgasStorePath(),path.tgasPath()), 'Column store not built by concurrent processes'
+    return None
+
+def test_columns():
+    # Test that only the requested columns are loaded
+    data_dir= _setup_data_dir()
+    shards= _write_fake_tgas(data_dir)
+    full= numpy.concatenate(shards)
+    for memmap in [False,True]:
+        tgas= gaia_tools.load.tgas(columns=['ra','pos'],memmap=memmap)
+        assert tgas.dtype.names == ('ra','pos'), 'tgas(columns=) does not return the requested columns'
+        assert numpy.all(tgas['pos'] == full['pos']), 'tgas(columns=) does not return the correct data'
+    # Main catalog + VAC
+    galah= _fake_catalog(20)
+    galah= numpy.lib.recfunctions.rename_fields(galah,
+                                                {'source_id':'sobject_id'})
+    ages= numpy.empty(10,dtype=[('sobject_id','>i8'),('age','>f8'),
+                                ('ra','>f8')])
+    ages['sobject_id']= numpy.arange(10)[::-1]*2
+    ages['age']= numpy.arange(10)
+    ages['ra']= -1.
+    os.makedirs(os.path.dirname(path.galahPath()))
+    pyfits.writeto(path.galahPath(),galah)
+    pyfits.writeto(path.galahAgesPath(),ages)
+    data= gaia_tools.load.galah(ages=True,columns=['ra','age'])
+    assert data.dtype.names == ('ra','age'), 'galah(columns=) does not return the requested columns'
+    assert len(data) == 10, 'galah(ages=True,columns=) does not return the overlap'
+    assert numpy.all(data['ra'] == galah['ra'][::2]), 'galah(columns=) does not return the main-catalog column'
+    assert numpy.all(data['age'] == numpy.arange(10)[::-1]), 'galah(columns=) does not return the VAC column'
+    try:
+        gaia_tools.load.galah(ages=True,columns=['ra','not_a_column'])
+    except KeyError: pass
+    else:
+        raise AssertionError('galah(columns=) does not raise KeyError for unknown columns')
+    return None
+
+def test_where():
+    # Test that the where= selection gives the same as selecting afterwards
+    data_dir= _setup_data_dir()
+    shards= _write_fake_tgas(data_dir)
+    full= numpy.concatenate(shards)
+    indx= (full['parallax'] > 1.)*(numpy.fabs(full['dec']) < 30.)
+    for where in [lambda x: (x['parallax'] > 1.)*(numpy.fabs(x['dec']) < 30.),
+                  '(parallax > 1.) & (numpy.fabs(dec) < 30.)']:
+        tgas= gaia_tools.load.tgas(where=where,columns=['source_id','ra'])
+        assert numpy.all(tgas['source_id'] == full['source_id'][indx]), 'tgas(where=) does not return the selected rows'
+        assert tgas.dtype.names == ('source_id','ra'), 'tgas(where=,columns=) does not return the requested columns'
+        # Also when reading the FITS shards directly
+        tgas= gaia_tools.load._read_shards(path.tgasPath(),where=where,
+                                           columns=['source_id','ra'])
+        assert numpy.all(tgas['source_id'] == full['source_id'][indx]), 'Reading FITS shards with where= does not return the selected rows'
+    tgas= gaia_tools.load.tgas(where='parallax > 1. and -30. < dec < 30.')
+    assert numpy.all(tgas['source_id'] == full['source_id'][indx]), 'tgas(where=) does not support and and chained comparisons'
+    # Malformed expressions and expressions that do anything else than
+    # computing with the columns are rejected
+    for where in ['parallax >','parallax > 1.; import os','foo > 1.',
+                  "__import__('os').getcwd()","numpy.load('x.npy')",
+                  'ra.__class__','(lambda: ra)()','[ra][0] > 1.',
+                  'numpy.sqrt(*ra)']:
+        try:
+            gaia_tools.load.tgas(where=where)
+        except ValueError: pass
+        else:
+            raise AssertionError('tgas(where={!r}) does not raise ValueError'.format(where))
+    return None
+
+def test_read_shards_speed():
+    # Test that reading FITS shards into a preallocated output is not slower
+    # than reading each shard whole and copying it (the sequential baseline)
+    import time
+    from gaia_tools.load import _fits
+    data_dir= _setup_data_dir()
+    dtype= [('c{}'.format(ii),'>f8' if ii % 3 else '>i8') for ii in range(40)]
+    filePaths= [os.path.join(data_dir,'shard{}.fits'.format(ii))
+                for ii in range(4)]
+    for ii,filePath in enumerate(filePaths):
+        shard= numpy.zeros(50000,dtype=dtype)
+        for name in shard.dtype.names: shard[name]= numpy.arange(50000)+ii
+        pyfits.writeto(filePath,shard)
+    def _baseline():
+        out= numpy.empty(200000,dtype=_fits.common_dtype(filePaths))
+        for ii,filePath in enumerate(filePaths):
+            out[50000*ii:50000*(ii+1)]= _fits.fitsread(filePath)
+        return out
+    def _best(func):
+        times= []
+        for ii in range(3):
+            start= time.perf_counter()
+            out= func()
+            times.append(time.perf_counter()-start)
+        return (min(times),out)
+    tbaseline,baseline= _best(_baseline)
+    tshards,out= _best(lambda: _fits.read_shards(filePaths,nthreads=1))
+    assert numpy.all(out == baseline), 'read_shards does not return the same data as reading the shards whole'
+    assert tshards < 3.*tbaseline+0.05, 'read_shards is much slower than reading the shards whole ({:.3f} s vs. {:.3f} s)'.format(tshards,tbaseline)
+    # Also for a subset of the columns, into separate columns
+    cols= colstore.ColumnCatalog([(name,numpy.empty(200000,dtype='f8'))
+                                  for name in ['c1','c5','c3']])
+    tcols,out= _best(lambda: _fits.read_shards(filePaths,out=cols,nthreads=1))
+    assert numpy.all(out['c5'] == baseline['c5']), 'read_shards does not fill separate columns correctly'
+    assert tcols < 3.*tbaseline+0.05, 'read_shards into separate columns is much slower than reading the shards whole ({:.3f} s vs. {:.3f} s)'.format(tcols,tbaseline)
+    return None
+
+def test_lazy():
+    # Test that lazy catalogs only read the columns that are accessed
+    data_dir= _setup_data_dir()
+    shards= _write_fake_tgas(data_dir)
+    full= numpy.concatenate(shards)
+    for store in [False,True]:
+        if store: gaia_tools.load.tgas() # builds the column store
+        tgas= gaia_tools.load.tgas(lazy=True)
+        assert isinstance(tgas,colstore.LazyCatalog), 'tgas(lazy=True) does not return a LazyCatalog'
+        assert len(tgas) == len(full), 'tgas(lazy=True) does not have the right number of rows'
+        assert tgas.dtype.names == full.dtype.names, 'tgas(lazy=True) does not have the right columns'
+        assert tgas.loaded() == [], 'tgas(lazy=True) reads columns before they are accessed'
+        assert numpy.all(tgas['pos'] == full['pos']), 'tgas(lazy=True) does not return the correct data'
+        assert tgas.loaded() == ['pos'], 'tgas(lazy=True) reads columns that are not accessed'
+        sub= tgas[tgas['parallax'] > 1.]
+        assert numpy.all(sub['ra'] == full['ra'][full['parallax'] > 1.]), 'Indexing a LazyCatalog does not work as expected'
+        assert tgas.loaded() == ['ra','parallax','pos'], 'Indexing a LazyCatalog does not keep it lazy'
+        tgas= gaia_tools.load.tgas(lazy=True,where='parallax > 1.',
+                                   columns=['source_id','dec'])
+        assert numpy.all(tgas['source_id'] == full['source_id'][full['parallax'] > 1.]), 'tgas(lazy=True,where=) does not return the selected rows'
+        assert numpy.all(numpy.asarray(tgas)['dec'] == full['dec'][full['parallax'] > 1.]), 'LazyCatalog cannot be converted to a structured array'
+    # Single FITS file
+    os.makedirs(os.path.dirname(path.raveonPath()))
+    pyfits.writeto(path.raveonPath(),shards[0])
+    raveon= gaia_tools.load.raveon(lazy=True,columns=['ra','name'])
+    assert raveon.dtype.names == ('ra','name'), 'raveon(lazy=True,columns=) does not have the requested columns'
+    assert numpy.all(raveon['name'] == gaia_tools.load.raveon()['name']), 'raveon(lazy=True) does not return the correct data'
+    assert raveon.loaded() == ['name'], 'raveon(lazy=True) reads columns that are not accessed'
+    return None
+
+def test_iter_gaia_source():
+    # Test that iterating over the gaia_source files returns all rows
+    data_dir= _setup_data_dir()
+    # DR1 FITS files
+    filePaths= path.gaiaSourcePath(dr=1)[:5]
+    shards= [_fake_catalog(7+ii,offset=100*ii,seed=ii) for ii in range(5)]
+    for filePath,shard in zip(filePaths,shards):
+        os.makedirs(os.path.dirname(filePath),exist_ok=True)
+        pyfits.writeto(filePath,shard)
+    full= numpy.concatenate(shards)
+    chunks= list(gaia_tools.load.iter_gaia_source(dr=1,chunk_rows=10,
+                                                  columns=['source_id','pos']))
+    assert [len(c) for c in chunks] == [10,10,10,10,5], 'iter_gaia_source does not return chunks of the requested size'
+    assert numpy.all(numpy.concatenate(chunks)['pos'] == full['pos']), 'iter_gaia_source does not return the data in the files'
+    # DR2 csv.gz files, with a missing value
+    os.makedirs(os.path.join(data_dir,'Gaia','gdr2','gaia_source','csv'))
+    for ii,(smin,smax) in enumerate([(30,39),(2,11)]):
+        with gzip.open(os.path.join(data_dir,'Gaia','gdr2','gaia_source',
+                                    'csv','GaiaSource_%i_%i.csv.gz' \
+                                        % (smin,smax)),'wt') as csvfile:
+            csvfile.write('source_id,parallax,phot_g_mean_mag\n')
+            for sid in range(smin,smax+1):
+                csvfile.write('{},{},{}\n'.format(sid,'' if sid == 5 else 1.,
+                                                   15.))
+    data= numpy.concatenate(list(\
+        gaia_tools.load.iter_gaia_source(dr=2,chunk_rows=3,
+                                         where='parallax > 0.')))
+    assert numpy.all(data['source_id'] == [2,3,4,6,7,8,9,10,11]+list(range(30,40))), 'iter_gaia_source does not return the data in the csv files in the correct order'
+    return None
+
+def test_memcache():
+    # Test that loaded catalogs are memoized when the cache is enabled
+    from gaia_tools.load import memcache
+    data_dir= _setup_data_dir()
+    shards= _write_fake_tgas(data_dir)
+    memcache.enable(max_bytes=10**6)
+    try:
+        tgas= gaia_tools.load.tgas()
+        tgas2= gaia_tools.load.tgas()
+        assert tgas.base is tgas2.base, 'Repeated calls with the cache enabled do not return the cached catalog'
+        assert not tgas2.flags.writeable, 'Cached catalog is not returned read-only'
+        assert gaia_tools.load.tgas(columns=['ra']).dtype.names == ('ra',), 'Different arguments return the same cached catalog'
+        # Changing a file invalidates the entry
+        os.utime(path.tgasPath()[0],ns=(0,0))
+        assert not gaia_tools.load.tgas().base is tgas.base, 'Changing a file does not invalidate the cache'
+        # Budget is respected
+        memcache.enable(max_bytes=tgas.nbytes)
+        assert memcache.nbytes() <= tgas.nbytes, 'Cache is not evicted down to the budget'
+    finally:
+        memcache.disable()
+    assert memcache.nbytes() == 0, 'Disabling the cache does not clear it'
+    return None
+
+def test_text_catalog_binary_copy():
+    # Test that text catalogs are parsed once and then read from their
+    # binary copy, also for masked astropy Tables
+    from astropy.table import Table, MaskedColumn
+    data_dir= _setup_data_dir()
+    filePath,_= path.ravePath(dr=5)
+    os.makedirs(os.path.dirname(filePath))
+    with open(filePath,'w') as csvfile:
+        csvfile.write('RAVE_OBSID,RAdeg,DEdeg,Teff\n')
+        for ii in range(100):
+            csvfile.write('{},{},{},{}\n'.format(ii,ii/10.,-ii/100.,
+                                                 '' if ii % 7 == 0 else 5000+ii))
+    # Without a binary copy, usecols only parses the requested columns
+    rave= gaia_tools.load.rave(dr=5,usecols=[3,1])
+    assert rave.dtype.names == ('Teff','RAdeg') and len(rave) == 100, 'rave(usecols=) does not return the requested columns'
+    assert colstore.read_manifest(os.path.join(os.path.dirname(filePath),
+                                               'npy','RAVE_DR5')) is None, 'Binary copy of the RAVE DR5 catalog written with only some of its columns'
+    rave= gaia_tools.load.rave(dr=5)
+    assert colstore.read_manifest(os.path.join(os.path.dirname(filePath),
+                                               'npy','RAVE_DR5')) is not None, 'Binary copy of the RAVE DR5 catalog not written'
+    rave2= gaia_tools.load.rave(dr=5)
+    assert rave2.dtype == rave.dtype, 'Binary copy of the RAVE DR5 catalog does not have the same dtype'
+    for name in rave.dtype.names:
+        assert numpy.array_equal(rave[name],rave2[name],equal_nan=True), 'Binary copy of the RAVE DR5 catalog does not have the same data'
+    assert gaia_tools.load.rave(dr=5,usecols=[3,1]).dtype.names == ('Teff','RAdeg'), 'rave(usecols=) does not return the requested columns'
+    assert gaia_tools.load._store_path(os.path.join(data_dir,'GALAH_DR2.1_catalog.fits')) \
+        != gaia_tools.load._store_path(os.path.join(data_dir,'GALAH_DR2.2_catalog.fits')), 'Binary copies of different GALAH data releases share a store'
+    # Masked Table
+    table= Table([MaskedColumn([1.,2.,3.],name='a',unit='deg',
+                               mask=[False,True,False],fill_value=-9999.,
+                               description='A column'),
+                  MaskedColumn(['x','y','z'],name='b',mask=[True,False,False])])
+    storePath= os.path.join(data_dir,'table')
+    colstore.write(storePath,table,[filePath])
+    table2= colstore.load(storePath)
+    for name in table.colnames:
+        assert numpy.all(table[name].mask == table2[name].mask), 'Table column mask not stored correctly'
+        assert numpy.all(table[name].filled() == table2[name].filled()), 'Table column data or fill value not stored correctly'
+        assert table[name].unit == table2[name].unit, 'Table column unit not stored correctly'
+        assert table[name].description == table2[name].description, 'Table column description not stored correctly'
+    # Rewriting a store swaps in the new version, while columns that were
+    # opened before keep the old data
+    data= numpy.zeros(10,dtype=[('x','f8')])
+    data['x']= numpy.arange(10.)
+    colstore.write(storePath,data,[filePath])
+    old= colstore.read(storePath,memmap=True)
+    data['x']+= 1.
+    colstore.write(storePath,data,[filePath])
+    assert numpy.all(colstore.read(storePath)['x'] == data['x']), 'Rewritten store not swapped in'
+    assert numpy.all(old['x'] == data['x']-1.), 'Columns opened before a store is rewritten change'
+    assert sorted(os.listdir(storePath))[1:] == ['manifest.json'] \
+        and sorted(os.listdir(storePath))[0].startswith('.version.'), 'Old versions of a rewritten store not removed'
+    return None
+
+def test_manifest():
+    # Test the manifest of the data directories
+    import hashlib
+    data_dir= _setup_data_dir()
+    shards= _write_fake_tgas(data_dir)
+    filePaths= path.tgasPath()
+    directory= os.path.dirname(filePaths[0])
+    manifest.record(filePaths[:4])
+    entries= manifest.read(directory)['files']
+    assert sorted(entries.keys()) == [os.path.basename(f) for f in filePaths[:4]], 'manifest.record does not record the files'
+    with open(filePaths[0],'rb') as fitsfile:
+        md5= hashlib.md5(fitsfile.read()).hexdigest()
+    assert entries[os.path.basename(filePaths[0])]['md5'] == md5, 'manifest.record does not record the correct checksum'
+    assert entries[os.path.basename(filePaths[0])]['nrows'] == 10, 'manifest.record does not record the number of rows'
+    assert manifest.checksum(filePaths[0]) == md5, 'manifest.checksum does not return the correct checksum'
+    assert manifest.nrows(filePaths) == [10]*len(filePaths), 'manifest.nrows does not return the number of rows'
+    # Files not in the manifest are checked on disk, until it is scanned
+    assert manifest.has_files(filePaths), 'manifest.has_files does not find files that are not yet in the manifest'
+    assert manifest.files(directory,'*.fits') == sorted(filePaths), 'manifest.files does not list the files in the directory'
+    # The manifest is trusted as long as the directory does not change
+    rescan= manifest._rescan
+    def fail(directory):
+        raise AssertionError('manifest rescans a directory that did not change')
+    manifest._rescan= fail
+    try:
+        assert manifest.has_files(filePaths), 'manifest not trusted'
+        assert manifest.files(directory,'*.fits') == sorted(filePaths), 'manifest not trusted'
+    finally:
+        manifest._rescan= rescan
+    # Files that are removed or added by other means are picked up
+    os.remove(filePaths[5])
+    assert not manifest.has_files(filePaths), 'manifest.has_files does not notice removed files'
+    assert not filePaths[5] in manifest.files(directory), 'manifest.files does not notice removed files'
+    pyfits.writeto(filePaths[5],shards[5])
+    assert filePaths[5] in manifest.files(directory), 'manifest.files does not notice added files'
+    os.remove(filePaths[5])
+    assert not manifest.has_files(filePaths,refresh=True), 'manifest.has_files(refresh=True) does not rescan the directory'
+    assert manifest.read(directory)['files'][os.path.basename(filePaths[0])]['md5'] == md5, 'manifest.refresh does not keep the checksums of unchanged files'
+    # DR2 gaia_source files are listed from the manifest
+    dr2dir= os.path.join(data_dir,'Gaia','gdr2','gaia_source','fits')
+    os.makedirs(dr2dir)
+    pyfits.writeto(os.path.join(dr2dir,'GaiaSource_1_2.fits'),shards[0])
+    assert path.gaiaSourcePath(dr=2) == [os.path.join(dr2dir,'GaiaSource_1_2.fits')], 'gaiaSourcePath(dr=2) does not list the files'
+    pyfits.writeto(os.path.join(dr2dir,'GaiaSource_3_4.fits'),shards[1])
+    assert len(path.gaiaSourcePath(dr=2)) == 2, 'gaiaSourcePath(dr=2) does not notice added files'
+    assert len(path.gaiaSourcePath(dr=2,refresh=True)) == 2, 'gaiaSourcePath(dr=2,refresh=True) does not rescan the directory'
+    # Processes that record files in the same directory at the same time
+    # keep each other's entries
+    import subprocess, sys
+    rvdir= os.path.join(data_dir,'concurrent')
+    os.makedirs(rvdir)
+    names= ['file{}.bin'.format(ii) for ii in range(40)]
+    for name in names:
+        with open(os.path.join(rvdir,name),'wb') as f:
+            f.write(name.encode())
+    procs= [subprocess.Popen([sys.executable,'-c',
+                              'from gaia_tools.load import manifest\n'
+                              'for name in {!r}:\n'
+                              '    manifest.record([{!r}+"/"+name],checksum=False)'\
+                                  .format(names[ii::4],rvdir)],
+                             env=dict(os.environ,GAIA_TOOLS_DATA=data_dir))
+             for ii in range(4)]
+    assert all([proc.wait() == 0 for proc in procs]), 'Concurrent manifest updates fail'
+    assert sorted(manifest.read(rvdir)['files'].keys()) == sorted(names), 'Concurrent manifest updates lose entries'
+    return None
+
+def test_download():
+    # Test the HTTP downloader against a local server that supports Range
+    # requests and that drops the first connection for each file halfway
+    from gaia_tools.load import download, _http
+    data_dir= _setup_data_dir()
+    serve_dir= tempfile.mkdtemp()
+    rng= numpy.random.default_rng(4)
+    contents= [rng.bytes(3*1024**2+ii) for ii in range(5)]
+    for ii,content in enumerate(contents):
+        with open(os.path.join(serve_dir,'file%i.bin' % ii),'wb') as f:
+            f.write(content)
+    with _http_server(serve_dir) as (url,requests):
+        filePaths= [os.path.join(data_dir,'dl','file%i.bin' % ii)
+                    for ii in range(5)]
+        download._download_files(['{}/file{}.bin'.format(url,ii)
+                                  for ii in range(5)],filePaths,
+                                 nconnections=3)
+        for filePath,content in zip(filePaths,contents):
+            with open(filePath,'rb') as f:
+                assert f.read() == content, 'Downloaded file does not have the right contents'
+            assert not os.path.exists(_http.part_path(filePath)), 'Partial download file not removed'
+        assert any(['Range' in headers for headers in requests]), 'Interrupted downloads not resumed with a Range request'
+        import hashlib
+        assert manifest.checksum(filePaths[0]) \
+            == hashlib.md5(contents[0]).hexdigest(), 'Checksum computed while downloading is incorrect'
+        # Resume from an existing partial file
+        filePath= os.path.join(data_dir,'dl','resumed.bin')
+        etag= '"{}"'.format(hashlib.md5(contents[1]).hexdigest())
+        with open(_http.part_path(filePath),'wb') as f:
+            f.write(contents[1][:12345])
+        _http._write_part_validators(_http.part_path(filePath),{'etag':etag})
+        nrequests= len(requests)
+        download._download_file(url+'/file1.bin',filePath)
+        with open(filePath,'rb') as f:
+            assert f.read() == contents[1], 'Resumed download does not have the right contents'
+        assert requests[nrequests].get('Range') == 'bytes=12345-', 'Download not resumed from the existing partial file'
+        assert requests[nrequests].get('If-Range') == etag, 'Download resumed without If-Range'
+        assert not os.path.exists(_http.part_path(filePath)+'.json'), 'Validators of the partial file not removed'
+        # A partial file of an older version of the file is started over
+        filePath= os.path.join(data_dir,'dl','changed.bin')
+        with open(_http.part_path(filePath),'wb') as f:
+            f.write(contents[2][:12345])
+        _http._write_part_validators(_http.part_path(filePath),
+                                     {'etag':'"old"'})
+        download._download_file(url+'/file1.bin',filePath)
+        with open(filePath,'rb') as f:
+            assert f.read() == contents[1], 'Partial file of a file that changed on the server is resumed'
+        # as is a partial file without validators
+        filePath= os.path.join(data_dir,'dl','novalidators.bin')
+        with open(_http.part_path(filePath),'wb') as f:
+            f.write(contents[2][:12345])
+        nrequests= len(requests)
+        download._download_file(url+'/file1.bin',filePath)
+        with open(filePath,'rb') as f:
+            assert f.read() == contents[1], 'Partial file without validators is resumed'
+        assert not 'Range' in requests[nrequests], 'Partial file without validators is resumed'
+        # Missing files
+        try:
+            download._download_file(url+'/missing.bin',
+                                    os.path.join(data_dir,'dl','missing.bin'))
+        except IOError: pass
+        else:
+            raise AssertionError('Downloading a missing file does not raise IOError')
+        # Decompress while downloading (file consisting of two gzip members)
+        with open(os.path.join(serve_dir,'file.csv.gz'),'wb') as f:
+            f.write(gzip.compress(contents[3][:1000000]))
+            f.write(gzip.compress(contents[3][1000000:]))
+        filePath= os.path.join(data_dir,'dl','file.csv')
+        download._download_file(url+'/file.csv.gz',filePath,decompress=True)
+        with open(filePath,'rb') as f:
+            assert f.read() == contents[3], 'File decompressed while downloading does not have the right contents'
+        assert not os.path.exists(filePath+'.gz'), 'Compressed file written to disk'
+        assert _http.read(url+'/file.csv.gz',decompress=True) == contents[3], '_http.read does not return the decompressed file'
+        download._download_file(url+'/file2.bin',
+                                os.path.join(data_dir,'dl','spider.bin'),
+                                spider=True)
+        assert not os.path.exists(os.path.join(data_dir,'dl','spider.bin')), 'spider=True downloads the file'
+        # Refreshing only downloads the files that changed on the server,
+        # using conditional requests
+        with open(os.path.join(serve_dir,'file2.bin'),'wb') as f:
+            f.write(contents[0])
+        nrequests= len(requests)
+        download._download_files(['{}/file{}.bin'.format(url,ii)
+                                  for ii in range(5)],filePaths,
+                                 nconnections=3,refresh=True)
+        with open(filePaths[2],'rb') as f:
+            assert f.read() == contents[0], 'Refreshing does not download the files that changed on the server'
+        assert len([r for r in requests[nrequests:] if r['method'] == 'GET']) == 1, 'Refreshing downloads files that did not change on the server'
+        assert all(['If-None-Match' in r for r in requests[nrequests:]
+                    if r['method'] == 'HEAD']), 'Refreshing does not use conditional requests'
+        # Files downloaded without recording the validators are compared by
+        # size
+        manifest.record([filePaths[1]],checksum=False,
+                        validators={filePaths[1]:{}})
+        nrequests= len(requests)
+        download._download_file(url+'/file1.bin',filePaths[1],refresh=True)
+        assert [r['method'] for r in requests[nrequests:]] == ['HEAD'], 'Refreshing a file without validators downloads it again even though its size did not change'
+        assert 'etag' in manifest.validators([filePaths[1]])[0], 'Refreshing does not record the validators of unchanged files'
+        # Converted files without validators are compared by date, with
+        # a conditional request
+        convertedPath= os.path.join(data_dir,'dl','converted.fits')
+        with open(convertedPath,'wb') as f:
+            f.write(b'converted')
+        manifest.record([convertedPath],checksum=False)
+        nrequests= len(requests)
+        assert download._stale([url+'/file3.bin'],[convertedPath],
+                               compare_size=False) == set(), 'Refreshing a converted file without validators considers it changed even though it is newer than the file on the server'
+        assert [r['method'] for r in requests[nrequests:]] == ['HEAD'] \
+            and 'If-Modified-Since' in requests[nrequests], 'Refreshing a converted file without validators does not use a conditional request'
+        assert 'etag' in manifest.validators([convertedPath])[0], 'Refreshing does not record the validators of unchanged converted files'
+        manifest.record([convertedPath],checksum=False,
+                        validators={convertedPath:{}})
+        os.utime(convertedPath,(0,0))
+        assert download._stale([url+'/file3.bin'],[convertedPath],
+                               compare_size=False) == set([convertedPath]), 'Refreshing a converted file without validators does not consider it changed when the file on the server is newer'
+        # Processes that download the same file at the same time wait for
+        # each other, such that the file is only downloaded once
+        import subprocess, sys
+        filePath= os.path.join(data_dir,'dl','shared.bin')
+        nrequests= len(requests)
+        procs= [subprocess.Popen([sys.executable,'-c',
+                                  'from gaia_tools.load import download; '
+                                  'download._download_file({!r},{!r})'\
+                                      .format(url+'/file4.bin',filePath)])
+                for ii in range(4)]
+        assert all([proc.wait() == 0 for proc in procs]), 'Concurrent downloads of the same file fail'
+        with open(filePath,'rb') as f:
+            assert f.read() == contents[4], 'Concurrently downloaded file does not have the right contents'
+        assert len(requests)-nrequests == 1, 'Concurrent processes download the same file more than once'
+    return None
+
+def test_download_gaiarv():
+    # Test the download/convert pipeline of the gaiarv CSV files, with the
+    # downloads replaced by writing small CSV files
+    from gaia_tools.load import download, _http
+    data_dir= _setup_data_dir()
+    csvFilePaths= path.gaiarvPath(format='csv')
+    def _fetch(url,filePath,decompress=False,return_validators=False,
+               **kwargs):
+        assert decompress, 'gaiarv CSV files not decompressed while downloading'
+        ii= [os.path.basename(f) for f in csvFilePaths]\
+            .index(url.split('/')[-1])
+        with open(filePath,'w') as csvfile:
+            csvfile.write('source_id,ra,radial_velocity\n{},{},\n{},{},-3.5\n'\
+                              .format(2*ii,10.*ii,2*ii+1,10.*ii+5.))
+        return (None,{'etag':'"{}"'.format(ii)})
+    fetch= _http.fetch
+    _http.fetch= _fetch
+    try:
+        download.gaiarv(verbose=False,nconnections=2,nprocesses=2)
+    finally:
+        _http.fetch= fetch
+    for ii,filePath in enumerate(path.gaiarvPath(format='fits')):
+        data= pyfits.getdata(filePath,1)
+        assert numpy.all(data['source_id'] == [2*ii,2*ii+1]), 'gaiarv CSV files not converted to FITS correctly'
+        assert numpy.isnan(data['radial_velocity'][0]) \
+            and data['radial_velocity'][1] == -3.5, 'gaiarv CSV files not converted to FITS correctly'
+        assert not os.path.exists(csvFilePaths[ii]), 'gaiarv CSV file written to disk'
+        assert not os.path.exists(_http.part_path(filePath)), 'Partial FITS file not removed'
+    fits_dir= os.path.dirname(filePath)
+    def _scratch_files():
+        return [f for f in os.listdir(fits_dir)
+                if '.csv' in f or f.endswith('.part') or f.endswith('.part.json')]
+    assert _scratch_files() == [], 'Downloaded gaiarv CSV files not removed after the conversion'
+    assert all([download._scratch_csv_path(f).endswith('.csv')
+                for f in path.gaiarvPath(format='fits')]), 'Scratch file of the decompressed CSV file not named .csv'
+    assert manifest.has_files(path.gaiarvPath(format='fits')), 'Converted files not recorded in the manifest'
+    assert manifest.validators(path.gaiarvPath(format='fits')[:1]) \
+        == [{'etag':'"0"'}], 'ETag of the downloaded CSV file not recorded in the manifest'
+    # Errors in the conversion are raised
+    os.remove(path.gaiarvPath(format='fits')[0])
+    def _fetch_malformed(url,filePath,**kwargs):
+        with open(filePath,'w') as csvfile:
+            csvfile.write('a,b\n1,2,3\n')
+        return (None,{})
+    _http.fetch= _fetch_malformed
+    try:
+        download.gaiarv(verbose=False)
+    except Exception: pass
+    else:
+        raise AssertionError('gaiarv does not raise errors in the conversion')
+    finally:
+        _http.fetch= fetch
+    assert _scratch_files() == [], 'Scratch CSV file not removed when the conversion fails'
+    # Interrupted downloads do not leave scratch files behind
+    def _fetch_interrupted(url,filePath,**kwargs):
+        with open(_http.part_path(filePath),'w') as csvfile:
+            csvfile.write('source_id,ra,radial_velocity\n1,')
+        raise IOError('Connection lost')
+    _http.fetch= _fetch_interrupted
+    try:
+        download.gaiarv(verbose=False)
+    except IOError: pass
+    else:
+        raise AssertionError('gaiarv does not raise errors in the download')
+    finally:
+        _http.fetch= fetch
+    assert _scratch_files() == [], 'Scratch CSV file not removed when the download fails'
+    return None
+
+def test_mirror():
+    # Test mirroring an archive directory against a local server
+    import hashlib
+    from gaia_tools.load import mirror
+    data_dir= _setup_data_dir()
+    serve_dir= tempfile.mkdtemp()
+    remote_dir= os.path.join(serve_dir,'gdr2','gaia_source','csv')
+    os.makedirs(remote_dir)
+    rng= numpy.random.default_rng(5)
+    contents= dict([('GaiaSource_{}_{}.csv.gz'.format(ii,ii+1),
+                     rng.bytes(100000+ii)) for ii in range(6)])
+    with open(os.path.join(remote_dir,'MD5SUM.txt'),'w') as md5file:
+        for filename,content in contents.items():
+            with open(os.path.join(remote_dir,filename),'wb') as f:
+                f.write(content)
+            md5file.write('{}  {}\n'.format(hashlib.md5(content).hexdigest(),
+                                            filename))
+    local_dir= mirror.table_path(dr=2,table='gaia_source')
+    os.makedirs(local_dir)
+    # One file present and correct, one present but corrupted
+    names= sorted(contents)
+    with open(os.path.join(local_dir,names[0]),'wb') as f:
+        f.write(contents[names[0]])
+    with open(os.path.join(local_dir,names[1]),'wb') as f:
+        f.write(b'corrupted')
+    with _http_server(serve_dir) as (url,requests):
+        filePaths= mirror.mirror(dr=2,base_url=url,verbose=False)
+        assert filePaths == [os.path.join(local_dir,name) for name in names], 'mirror does not return the mirrored files'
+        for name in names:
+            with open(os.path.join(local_dir,name),'rb') as f:
+                assert f.read() == contents[name], 'Mirrored file does not have the right contents'
+        downloaded= [r for r in requests if not 'Range' in r]
+        assert len(downloaded) == len(names), 'mirror does not only download the missing or mismatched files'
+        assert manifest.checksum(filePaths[2]) == hashlib.md5(contents[names[2]]).hexdigest(), 'mirror does not record the checksums in the manifest'
+        # Mirroring again only downloads the MD5SUM file and does not hash
+        nrequests= len(requests)
+        file_checksum= mirror.file_checksum
+        def _fail(*args,**kwargs):
+            raise AssertionError('mirror hashes files that were already verified')
+        mirror.file_checksum= _fail
+        try:
+            mirror.mirror(dr=2,base_url=url,verbose=False)
+        finally:
+            mirror.file_checksum= file_checksum
+        assert len(requests) == nrequests+1, 'mirror downloads files that were already verified'
+        assert mirror.read_md5sum(os.path.join(local_dir,'MD5SUM.txt')) \
+            == dict([(name,hashlib.md5(content).hexdigest())
+                     for name,content in contents.items()]), 'read_md5sum does not parse the MD5SUM file'
+        # Processes that mirror the same table at the same time download
+        # each file only once
+        import shutil, subprocess, sys
+        shutil.rmtree(local_dir)
+        nrequests= len(requests)
+        procs= [subprocess.Popen([sys.executable,'-c',
+                                  'from gaia_tools.load import mirror; '
+                                  'mirror.mirror(dr=2,base_url={!r},'
+                                  'verbose=False)'.format(url)],
+                                 env=dict(os.environ,GAIA_TOOLS_DATA=data_dir))
+                for ii in range(4)]
+        assert all([proc.wait() == 0 for proc in procs]), 'Concurrent mirrors of the same table fail'
+        for name in names:
+            with open(os.path.join(local_dir,name),'rb') as f:
+                assert f.read() == contents[name], 'Concurrently mirrored file does not have the right contents'
+        assert len([r for r in requests[nrequests:]
+                    if r['method'] == 'GET' and not 'Range' in r]) == len(names)+4, 'Concurrent mirrors download the same file more than once'
+        # Any directory of a data release can be mirrored, also when it does
+        # not have an MD5SUM file
+        other_dir= os.path.join(serve_dir,'gdr2','other','sub')
+        os.makedirs(other_dir)
+        for name in ['a.txt','b.txt']:
+            with open(os.path.join(other_dir,name),'w') as f: f.write(name)
+        assert mirror.directories(dr=2,base_url=url) \
+            == ['gaia_source/csv','other/sub'], 'directories does not list all directories with files'
+        filePaths= mirror.mirror(dr=2,table='other/sub',base_url=url,
+                                 verbose=False)
+        assert filePaths == [os.path.join(data_dir,'Gaia','gdr2','other','sub',
+                                          name) for name in ['a.txt','b.txt']], 'mirror of a directory does not return the mirrored files'
+        with open(filePaths[1],'r') as f:
+            assert f.read() == 'b.txt', 'Mirrored file of a directory without an MD5SUM file does not have the right contents'
+        nrequests= len(requests)
+        mirror.mirror(dr=2,table='other/sub',base_url=url,verbose=False)
+        assert not any([r['method'] == 'GET' and r['path'].endswith('/a.txt')
+                        for r in requests[nrequests:]]), 'mirror downloads files without checksums that are present'
+    # The journal only parses the lines that were appended since it was
+    # last read, also when they are appended by another process
+    journal_dir= tempfile.mkdtemp()
+    filePath= os.path.join(journal_dir,'file.bin')
+    with open(filePath,'wb') as f: f.write(b'data')
+    journal,other= mirror._Journal(journal_dir),mirror._Journal(journal_dir)
+    for ii in range(100):
+        other.append('file{}'.format(ii),filePath,'md5')
+    assert len(journal.read()) == 100, 'Journal does not return all entries'
+    import json
+    nparsed= []
+    class _CountingJson(object):
+        dumps= staticmethod(json.dumps)
+        def loads(self,line):
+            nparsed.append(line)
+            return json.loads(line)
+    mirror.json= _CountingJson()
+    try:
+        other.append('new',filePath,'md5new')
+        assert journal.get('new')['md5'] == 'md5new', 'Journal does not see entries appended by another process'
+        assert journal.get('file3')['md5'] == 'md5', 'Journal does not keep the entries that were read before'
+    finally:
+        mirror.json= json
+    assert len(nparsed) == 1, 'Journal parses the whole file every time that it is read'
+    return None
+
+def test_gaia_source_region():
+    # Test that only the gaia_source files that overlap with a region are
+    # downloaded, for DR3 files that each cover two level-0 HEALPix pixels
+    import hashlib
+    import healpy
+    from gaia_tools.load import download, mirror
+    data_dir= _setup_data_dir()
+    serve_dir= tempfile.mkdtemp()
+    remote_dir= os.path.join(serve_dir,'gdr3','gaia_source')
+    os.makedirs(remote_dir)
+    names= ['GaiaSource_{:06d}-{:06d}.csv.gz'.format(ii*2*4**8,
+                                                      (ii+1)*2*4**8-1)
+            for ii in range(6)]
+    with open(os.path.join(remote_dir,'_MD5SUM.txt'),'w') as md5file:
+        for name in names:
+            with open(os.path.join(remote_dir,name),'wb') as f:
+                f.write(name.encode())
+            md5file.write('{}  {}\n'.format(hashlib.md5(name.encode())\
+                                                .hexdigest(),name))
+    local_dir= mirror.table_path(dr=3,table='gaia_source')
+    ra,dec= healpy.pix2ang(1,5,nest=True,lonlat=True) # in the third file
+    with _http_server(serve_dir) as (url,requests):
+        for region in [{'cone':(ra,dec,1.)},
+                       {'polygon':[(ra-1.,dec-1.),(ra+1.,dec-1.),
+                                   (ra,dec+1.)]},
+                       {'healpix':[5*4**4+7],'level':4}]:
+            filePaths= download.gaia_source(dr=3,region=region,
+                                            base_url=url,verbose=False)
+            assert filePaths == [os.path.join(local_dir,names[2])], 'gaia_source does not download the files that overlap with region {}'.format(region)
+        assert not any([os.path.exists(os.path.join(local_dir,name))
+                        for name in names if name != names[2]]), 'gaia_source downloads files outside of the region'
+        filePaths= download.gaia_source(dr=3,region={'healpix':[0,11],
+                                                     'level':0},
+                                        base_url=url,verbose=False)
+        assert filePaths == [os.path.join(local_dir,names[ii])
+                             for ii in [0,5]], 'gaia_source does not download the files that overlap with a HEALPix region'
+    # DR2 file names contain the source_id range directly
+    assert download._source_id_range('GaiaSource_34359738368_68719476735.csv.gz',2) == (2**35,2**36-1), 'source_id range of DR2 files not parsed correctly'
+    assert numpy.all(download._overlaps_region(\
+            numpy.array([[0,2**35-1],[2**35,2**36-1]]),
+            (numpy.array([1]),12)) == [False,True]), 'Overlap of source_id ranges with HEALPix pixels not computed correctly'
+    return None
+
+def test_join():
+    # Test the key join against a brute-force join
+    from gaia_tools.load import join
+    rng= numpy.random.default_rng(2)
+    data1= numpy.empty(50,dtype=[('id','i8'),('x','f8'),('y','f4')])
+    data1['id']= rng.integers(0,40,size=50)
+    data1['x']= rng.normal(size=50)
+    data2= numpy.empty(30,dtype=[('id','i8'),('y','f8'),('z','i4')])
+    data2['id']= rng.integers(0,40,size=30)
+    data2['y']= rng.normal(size=30)
+    data2['z']= numpy.arange(30)
+    expected= [(ii,jj) for ii in range(len(data1)) for jj in range(len(data2))
+               if data1['id'][ii] == data2['id'][jj]]
+    out= join.join(data1,data2,'id')
+    assert out.dtype.names == ('id','x','y_1','y_2','z'), 'join does not rename columns present in both catalogs'
+    assert sorted([(ii,jj) for ii,jj in zip(*join.join_index(data1['id'],
+                                                            data2['id']))]) \
+        == expected, 'join_index does not return all matches'
+    assert numpy.all(out['x'] == data1['x'][[e[0] for e in expected]]), 'join does not return the columns of the first catalog'
+    assert numpy.all(out['z'] == data2['z'][[e[1] for e in expected]]), 'join does not return the columns of the second catalog'
+    # Left join
+    out= join.join(data1,data2,'id',join_type='left',
+                   index2=join.sorted_index(data2['id']))
+    nomatch= ~numpy.isin(data1['id'],data2['id'])
+    assert len(out) == len(expected)+numpy.sum(nomatch), 'Left join does not return all entries of the first catalog'
+    assert numpy.all(numpy.isnan(out['y_2'][numpy.isin(out['id'],data1['id'][nomatch])])), 'Left join does not fill missing entries with NaN'
+    return None
+
+def test_apogee_astroNN_ages():
+    # Test that astroNN ages are matched to the primary allStar entries
+    data_dir= _setup_data_dir()
+    allstar,ages= _write_fake_apogee()
+    import warnings
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        data= gaia_tools.load.apogee(use_astroNN_ages=True,
+                                     columns=['APOGEE_ID','TEFF'])
+    assert data.dtype.names == ('APOGEE_ID','TEFF','astroNN_age',
+                                'astroNN_age_total_std',
+                                'astroNN_age_predictive_std',
+                                'astroNN_age_model_std'), 'apogee(use_astroNN_ages=True) does not add the ages'
+    assert isinstance(data,numpy.ndarray) and data.ndim == 1 \
+        and data.size == len(allstar), 'apogee(use_astroNN_ages=True) does not return a structured array'
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        cols= gaia_tools.load.apogee(use_astroNN_ages=True,as_columns=True,
+                                     columns=['APOGEE_ID','TEFF'])
+    assert isinstance(cols,colstore.ColumnCatalog), 'apogee(use_astroNN_ages=True,as_columns=True) does not return a ColumnCatalog'
+    assert numpy.all(numpy.asarray(cols) == data), 'ColumnCatalog returned by apogee(use_astroNN_ages=True,as_columns=True) does not contain the same data as the structured array'
+    for ii in range(len(allstar)):
+        match= (ages['APOGEE_ID'] == allstar['APOGEE_ID'][ii]).nonzero()[0]
+        if allstar['EXTRATARG'][ii] & 2**4 or len(match) == 0:
+            assert data['astroNN_age'][ii] == -9999., 'apogee(use_astroNN_ages=True) adds ages to non-matching or non-primary entries'
+        else:
+            assert data['astroNN_age'][ii] == ages['astroNN_age'][match[-1]], 'apogee(use_astroNN_ages=True) does not add the correct ages'
+    assert os.path.exists(gaia_tools.load.astroNN_ages_index_cache_filename(path.apogeePath())), 'astroNN ages index not cached'
+    # Distances are matched line-by-line
+    dist= numpy.empty(len(allstar),dtype=[(f,'>f4') for f in ['dist','dist_model_error','dist_error','weighted_dist','weighted_dist_error']])
+    for name in dist.dtype.names:
+        dist[name]= numpy.arange(len(allstar))
+    pyfits.writeto(path.astroNNDistancesPath(),dist)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        data= gaia_tools.load.apogee(use_astroNN_distances=True)
+    assert data.dtype.names == allstar.dtype.names+dist.dtype.names, 'apogee(use_astroNN_distances=True) does not add the distances'
+    assert numpy.all(data['weighted_dist'] == dist['weighted_dist']), 'apogee(use_astroNN_distances=True) does not add the correct distances'
+    assert numpy.all(data['TEFF'] == allstar['TEFF']), 'apogee(use_astroNN_distances=True) does not return the allStar data'
+    # Index is recomputed when the ages file changes
+    ages['APOGEE_ID']= ages['APOGEE_ID'][::-1]
+    pyfits.writeto(path.astroNNAgesPath(),ages,overwrite=True)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        data= gaia_tools.load.apogee(use_astroNN_ages=True,columns=['TEFF'])
+    match= (ages['APOGEE_ID'] == allstar['APOGEE_ID'][0]).nonzero()[0][-1]
+    assert data['astroNN_age'][0] == ages['astroNN_age'][match], 'astroNN ages index not recomputed when the ages file changes'
+    return None
+
+def test_apogeerc_astroNN_xmatch_cache():
+    # Test that the RC--astroNN cross-match is cached and re-used
+    data_dir= _setup_data_dir()
+    rng= numpy.random.default_rng(3)
+    rc= numpy.empty(20,dtype=[('RA','>f8'),('DEC','>f8'),('TEFF','>f4')])
+    rc['RA']= rng.uniform(0.,360.,size=20)
+    rc['DEC']= rng.uniform(-60.,60.,size=20)
+    rc['TEFF']= numpy.arange(20)
+    indx= rng.permutation(20)[:15] # astroNN entries, in a different order
+    dist= numpy.empty(15,dtype=[('ra_apogee','>f8'),('dec_apogee','>f8')]
+                      +[(f,'>f4') for f in ['dist','dist_model_error',
+                                            'dist_error','weighted_dist',
+                                            'weighted_dist_error']])
+    dist['ra_apogee']= rc['RA'][indx]
+    dist['dec_apogee']= rc['DEC'][indx]
+    for name in dist.dtype.names[2:]:
+        dist[name]= indx
+    os.makedirs(os.path.dirname(path.apogeercPath()))
+    pyfits.writeto(path.apogeercPath(),rc)
+    pyfits.writeto(path.astroNNDistancesPath(),dist)
+    import warnings
+    import gaia_tools.xmatch
+    xmatch= gaia_tools.xmatch.xmatch
+    try:
+        for ii in range(2):
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                data= gaia_tools.load.apogeerc(use_astroNN_distances=True,
+                                               columns=['TEFF'])
+            assert data.dtype.names == ('TEFF','dist','dist_model_error',
+                                        'dist_error','weighted_dist',
+                                        'weighted_dist_error'), 'apogeerc(use_astroNN_distances=True,columns=) does not return the right columns'
+            assert numpy.all(data['TEFF'] == numpy.sort(indx)), 'apogeerc(use_astroNN_distances=True) does not return the matching entries'
+            assert numpy.all(data['dist'] == data['TEFF']), 'apogeerc(use_astroNN_distances=True) does not match the distances correctly'
+            # Second time, the cached match should be used
+            def _fail(*args,**kwargs):
+                raise AssertionError('Cached RC--astroNN cross-match not used')
+            gaia_tools.xmatch.xmatch= _fail
+    finally:
+        gaia_tools.xmatch.xmatch= xmatch
+    return None
+
+def test_spec():
+    # Test reading spectra from fake DR3 spectra files against the spectra
+    # that were written
+    import warnings
+    from gaia_tools.load import spec
+    data_dir= _setup_data_dir()
+    base_path,source_ids,flux,flux_error= _write_fake_spec(data_dir)
+    wavelength_grid= numpy.arange(5.)
+    rng= numpy.random.default_rng(7)
+    indx= rng.integers(0,len(source_ids),size=40) # with duplicates
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        wave,out_flux,out_flux_error= spec.read_spec_internal(\
+            source_ids[indx],False,base_path,wavelength_grid)
+    assert numpy.all(wave == wavelength_grid), 'read_spec_internal does not return the wavelength grid'
+    assert numpy.all(out_flux == flux[indx]) \
+        and numpy.all(out_flux_error == flux_error[indx]), 'read_spec_internal does not return the right spectra'
+    # Duplicates are read once and expanded, which gives the same result as
+    # reading the unique source ids
+    unique_indx= numpy.unique(indx)
+    wave,unique_flux,unique_flux_error= spec.read_spec_internal(\
+        source_ids[unique_indx],True,base_path,wavelength_grid)
+    inverse= numpy.searchsorted(unique_indx,indx)
+    assert numpy.all(unique_flux[inverse] == out_flux) \
+        and numpy.all(unique_flux_error[inverse] == out_flux_error), 'read_spec_internal does not handle duplicated source ids correctly'
+    # Files are converted to sorted, memory-mapped binary stores upon the
+    # first read, which are used afterwards
+    for filename in os.listdir(base_path):
+        if not filename.endswith('.csv.gz'): continue
+        store= colstore.read(spec._store_path(base_path,filename))
+        assert isinstance(store['flux'],numpy.memmap) \
+            and store['flux'].dtype == numpy.float32, 'Spectra not stored as memory-mapped float32 arrays'
+        assert numpy.all(numpy.diff(store['source_id']) > 0), 'Spectra not stored in source_id order'
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        wave,out_flux2,out_flux_error2= spec.read_spec_internal(\
+            source_ids[indx],False,base_path,wavelength_grid)
+    assert numpy.all(out_flux2 == out_flux) \
+        and numpy.all(out_flux_error2 == out_flux_error), 'read_spec_internal does not return the same spectra from the binary stores'
+    # Reading (and converting) the files in parallel gives the same result
+    import shutil
+    shutil.rmtree(os.path.join(base_path,'npy'))
+    wave,out_flux2,out_flux_error2= spec.read_spec_internal(\
+        source_ids[indx],False,base_path,wavelength_grid,ncpu=2)
+    assert numpy.all(out_flux2 == out_flux) \
+        and numpy.all(out_flux_error2 == out_flux_error), 'read_spec_internal with ncpu > 1 does not return the same spectra'
+    unique_ids,first= numpy.unique(source_ids[indx],return_index=True)
+    wave,out_flux2,out_flux_error2= spec.read_spec_internal(\
+        unique_ids,True,base_path,wavelength_grid,ncpu=2)
+    assert numpy.all(out_flux2 == out_flux[first]), 'read_spec_internal with ncpu > 1 does not return the same spectra'
+    assert type(out_flux2) is numpy.ndarray \
+        and type(out_flux2) is type(out_flux), 'read_spec_internal returns a different type of array with ncpu > 1'
+    out_flux2[0]= -1. # returned arrays are writeable
+    assert not any([f.startswith('.scratch_')
+                    for f in os.listdir(os.path.join(base_path,'npy'))]), 'Scratch files of the parallel read not removed'
+    # Also when a worker fails
+    os.rename(os.path.join(base_path,'npy'),os.path.join(base_path,'npy.bak'))
+    os.makedirs(os.path.join(base_path,'npy'))
+    badfile= [f for f in os.listdir(base_path) if f.endswith('.csv.gz')][0]
+    os.rename(os.path.join(base_path,badfile),
+              os.path.join(base_path,badfile+'.bak'))
+    with open(os.path.join(base_path,badfile),'w') as f:
+        f.write('not a spectra file')
+    try:
+        spec.read_spec_internal(unique_ids,True,base_path,wavelength_grid,
+                                ncpu=2)
+    except Exception: pass
+    else:
+        raise AssertionError('read_spec_internal with ncpu > 1 does not raise an error when a worker fails')
+    assert not any([f.startswith('.scratch_')
+                    for f in os.listdir(os.path.join(base_path,'npy'))]), 'Scratch files of a failed parallel read not removed'
+    os.replace(os.path.join(base_path,badfile+'.bak'),
+               os.path.join(base_path,badfile))
+    shutil.rmtree(os.path.join(base_path,'npy'))
+    os.rename(os.path.join(base_path,'npy.bak'),os.path.join(base_path,'npy'))
+    # Processes that convert the same file at the same time wait for the
+    # one that converts it
+    import subprocess, sys
+    shutil.rmtree(os.path.join(base_path,'npy'))
+    filename= [f for f in os.listdir(base_path) if f.endswith('.csv.gz')][0]
+    procs= [subprocess.Popen([sys.executable,'-W','error','-c',
+                              'from gaia_tools.load import spec; '
+                              'spec._read_spec_file({!r},{!r})'\
+                                  .format(base_path,filename)])
+            for ii in range(4)]
+    assert all([proc.wait() == 0 for proc in procs]), 'Concurrent conversions of a spectra file fail'
+    assert colstore.is_current(spec._store_path(base_path,filename),
+                               [os.path.join(base_path,filename)]), 'Spectra file not converted by concurrent processes'
+    # Iterating over batches returns the same spectra, in file order
+    batches= list(spec.iter_spec_internal(source_ids[indx],base_path,
+                                          len(wavelength_grid),batch_size=7,
+                                          nprefetch=2))
+    assert all([len(b[0]) <= 7 for b in batches]), 'iter_spec_internal returns batches that are too large'
+    batch_indx= numpy.concatenate([b[0] for b in batches])
+    assert numpy.all(numpy.sort(batch_indx) == numpy.arange(len(indx))), 'iter_spec_internal does not return every source once'
+    assert numpy.all(numpy.diff(source_ids[indx][batch_indx]) >= 0), 'iter_spec_internal does not return the spectra in file order'
+    assert numpy.all(numpy.concatenate([b[1] for b in batches]) == out_flux[batch_indx]) \
+        and numpy.all(numpy.concatenate([b[2] for b in batches]) == out_flux_error[batch_indx]), 'iter_spec_internal does not return the right spectra'
+    # Missing spectra are zero, with a warning
+    with warnings.catch_warnings(record=True) as w:
+        warnings.simplefilter('always')
+        wave,out_flux,out_flux_error= spec.read_spec_internal(\
+            [source_ids[3],source_ids[3]+1],False,base_path,wavelength_grid)
+    assert len(w) == 1, 'read_spec_internal does not warn about missing spectra'
+    assert numpy.all(out_flux[0] == flux[3]) and numpy.all(out_flux[1] == 0.), 'read_spec_internal does not return zero for missing spectra'
+    # Source ids outside of all files raise an error
+    try:
+        spec.read_spec_internal([source_ids[0],300*2**43],False,base_path,
+                                wavelength_grid)
+    except ValueError: pass
+    else:
+        raise AssertionError('read_spec_internal does not raise ValueError for invalid source ids')
+    # Spectra stored as variable-length arrays (object columns) are read
+    base_path,source_ids,flux,flux_error= \
+        _write_fake_spec(data_dir,object_columns=True,name='rvs_mean_spectrum')
+    wave,out_flux,out_flux_error= spec.read_spec_internal(\
+        source_ids[indx],False,base_path,wavelength_grid)
+    assert out_flux.dtype == numpy.float32 \
+        and numpy.all(out_flux == flux[indx]) \
+        and numpy.all(out_flux_error == flux_error[indx]), 'read_spec_internal does not read spectra stored as object columns'
+    return None
+
+def _setup_data_dir():
+    data_dir= tempfile.mkdtemp()
+    path._GAIA_TOOLS_DATA= data_dir
+    return data_dir
+
+def _fake_catalog(nrows,offset=0,seed=1):
+    rng= numpy.random.default_rng(seed)
+    out= numpy.empty(nrows,dtype=[('source_id','>i8'),('ra','>f8'),
+                                  ('dec','>f8'),('parallax','>f4'),
+                                  ('pos','>f8',(2,)),('name','S8')])
+    out['source_id']= offset+numpy.arange(nrows)
+    out['ra']= rng.uniform(0.,360.,size=nrows)
+    out['dec']= rng.uniform(-90.,90.,size=nrows)
+    out['parallax']= rng.uniform(0.,2.,size=nrows)
+    out['pos'][:,0]= out['ra']
+    out['pos'][:,1]= out['dec']
+    out['name']= [('s%i' % ii).encode() for ii in out['source_id']]
+    return out
+
+def _write_fake_tgas(data_dir):
+    shards= []
+    for ii,filePath in enumerate(path.tgasPath()):
+        os.makedirs(os.path.dirname(filePath),exist_ok=True)
+        shard= _fake_catalog(10,offset=10*ii,seed=ii)
+        pyfits.writeto(filePath,shard)
+        shards.append(shard)
+    return shards
+
+def _write_fake_spec(data_dir,nspec=60,npix=5,object_columns=False,
+                     name='xp_sampled_mean_spectrum'):
+    # Write fake DR3 spectra files (gzipped ECSV with array columns, or with
+    # variable-length array columns like the archive's files if
+    # object_columns) that cover HEALPix level-8 pixels 0-99, 100-199, and
+    # 200-299 (none beyond)
+    from astropy.table import Table
+    base_path= os.path.join(data_dir,'Gaia','gdr3','Spectroscopy',name)
+    os.makedirs(base_path)
+    rng= numpy.random.default_rng(6)
+    source_ids= numpy.sort(rng.choice(300*2**43,size=nspec,replace=False))
+    flux= rng.normal(size=(nspec,npix)).astype('float32')
+    flux_error= rng.uniform(size=(nspec,npix)).astype('float32')
+    for ii in range(3):
+        infile= (source_ids//2**43 >= 100*ii) & (source_ids//2**43 < 100*(ii+1))
+        table= Table()
+        table['source_id']= source_ids[infile]
+        for colname,col in zip(['flux','flux_error'],[flux,flux_error]):
+            if object_columns:
+                table[colname]= numpy.empty(numpy.sum(infile),dtype=object)
+                for jj,row in enumerate(col[infile]): table[colname][jj]= row
+            else:
+                table[colname]= col[infile]
+        filePath= os.path.join(base_path,
+                               'XpSampledMeanSpectrum_{:06d}-{:06d}.csv'\
+                                   .format(100*ii,100*(ii+1)-1))
+        table.write(filePath,format='ascii.ecsv')
+        with open(filePath,'rb') as f, gzip.open(filePath+'.gz','wb') as g:
+            g.write(f.read())
+        os.remove(filePath)
+    return (base_path,source_ids,flux,flux_error)
+
+def _write_fake_apogee():
+    allstar= numpy.empty(20,dtype=[('APOGEE_ID','S18'),('TEFF','>f4'),
+                                   ('EXTRATARG','>i2')])
+    allstar['APOGEE_ID']= [('2M%08i' % (ii % 15)).encode() for ii in range(20)]
+    allstar['TEFF']= 4000.+numpy.arange(20)
+    allstar['EXTRATARG']= 0
+    allstar['EXTRATARG'][15:]= 2**4 # duplicates
+    allstar['EXTRATARG'][3]= 2**4
+    ages= numpy.empty(12,dtype=[('APOGEE_ID','S20')]
+                      +[(f,'>f8') for f in ['astroNN_age',
+                                            'astroNN_age_total_std',
+                                            'astroNN_age_predictive_std',
+                                            'astroNN_age_model_std']])
+    ages['APOGEE_ID']= [('2M%08i' % (2*ii)).encode() for ii in range(11)]\
+        +[b'2M00000004']
+    for name in ages.dtype.names[1:]:
+        ages[name]= numpy.arange(12)
+    os.makedirs(os.path.dirname(path.apogeePath()))
+    pyfits.writeto(path.apogeePath(),allstar)
+    pyfits.writeto(path.astroNNAgesPath(),ages)
+    return (allstar,ages)
+
+@contextlib.contextmanager
+def _http_server(directory):
+    """Local HTTP server that supports Range requests and drops the first connection for each file halfway"""
+    import threading
+    import hashlib
+    import email.utils
+    import http.server
+    requests= []
+    dropped= set()
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def log_message(self,*args): pass
+        def do_HEAD(self): self._serve(body=False)
+        def do_GET(self): self._serve(body=True)
+        def _serve(self,body=True):
+            requests.append(dict(self.headers.items(),method=self.command,
+                                 path=self.path))
+            filePath= os.path.join(directory,self.path.lstrip('/'))
+            if not os.path.exists(filePath):
+                self.send_error(404)
+                return None
+            if os.path.isdir(filePath): # directory listing
+                content= ''.join(['<a href="/">Top</a><a href="../">Up</a>']
+                                 +['<a href="{}{}">{}</a>'.format(\
+                                        name,'/' if os.path.isdir(\
+                                            os.path.join(filePath,name)) else '',
+                                        name)
+                                   for name in sorted(os.listdir(filePath))])\
+                                   .encode()
+                self.send_response(200)
+                self.send_header('Content-Length',str(len(content)))
+                self.end_headers()
+                if body: self.wfile.write(content)
+                return None
+            with open(filePath,'rb') as f:
+                content= f.read()
+            etag= '"{}"'.format(hashlib.md5(content).hexdigest())
+            mtime= int(os.path.getmtime(filePath))
+            since= self.headers.get('If-Modified-Since')
+            if self.headers.get('If-None-Match') == etag \
+                    or (not 'If-None-Match' in self.headers
+                        and not since is None and mtime <= \
+                            email.utils.parsedate_to_datetime(since)\
+                            .timestamp()):
+                self.send_response(304)
+                self.send_header('ETag',etag)
+                self.end_headers()
+                return None
+            start= 0
+            if 'Range' in self.headers \
+                    and self.headers.get('If-Range',etag) == etag:
+                start= int(self.headers['Range'].split('=')[1].split('-')[0])
+                self.send_response(206)
+                self.send_header('Content-Range','bytes {}-{}/{}'.format(\
+                        start,len(content)-1,len(content)))
+            else:
+                self.send_response(200)
+            self.send_header('Content-Length',str(len(content)-start))
+            self.send_header('ETag',etag)
+            self.send_header('Last-Modified',
+                             email.utils.formatdate(mtime,usegmt=True))
+            self.end_headers()
+            if not body: return None
+            if not self.path in dropped:
+                dropped.add(self.path)
+                self.wfile.write(content[start:start+(len(content)-start)//2])
+                self.wfile.flush()
+                self.close_connection= True
+                return None
+            self.wfile.write(content[start:])
+    server= http.server.ThreadingHTTPServer(('127.0.0.1',0),Handler)
+    thread= threading.Thread(target=server.serve_forever,daemon=True)
+    thread.start()
+    try:
+        yield ('http://127.0.0.1:{}'.format(server.server_address[1]),requests)
+    finally:
+        server.shutdown()
+        server.server_close()
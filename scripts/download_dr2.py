@@ -1,20 +1,22 @@
 # Script to sniff whether DR2 has appeared and grab everything once it appears
+#
+# Every directory under http://cdn.gea.esac.esa.int/Gaia/gdr2/ is mirrored
+# with gaia_tools.load.mirror (all files except the VOTable versions, as
+# before), but into $GAIA_TOOLS_DATA/Gaia/gdr2/ (e.g.,
+# $GAIA_TOOLS_DATA/Gaia/gdr2/gaia_source/csv) rather than into the current
+# directory.
 import os
 import time
-from datetime import datetime, timedelta
+from datetime import datetime
 import pytz
-import subprocess
-import hashlib
+from gaia_tools.load import mirror
 
 _DR2_URL= 'http://cdn.gea.esac.esa.int/Gaia/gdr2/'
-_MD5_FILENAME= 'MD5SUM.txt'
 
 _CEST= pytz.timezone('Europe/Brussels')
 _TIME_START_CHECKING= _CEST.localize(datetime(2018,4,25,11,55,0))
 _TIME_START_CHECKING_MORE= _CEST.localize(datetime(2018,4,25,11,59,30))
-_DT_UNTIL_DOWNLOAD_ALL= 10*60 # seconds
 _MAX_DOWNLOAD_TRIES= 50 # don't try to download and fail more than this
-_CUT_DIRS= 2
 download_tries= 0
 _VERBOSE= True
 _HOLD_OFF_UNTIL_SOON_BEFORE= True
@@ -27,13 +29,6 @@ def dr2_available(dr2_url=_DR2_URL):
     except:
         return False
 
-def md5(fname):
-    hash_md5 = hashlib.md5()
-    with open(fname, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
-
 while True:
     # Only start checking soon before the official release date, sleep until
     if _HOLD_OFF_UNTIL_SOON_BEFORE:
@@ -49,47 +44,20 @@ while True:
             time.sleep(30)
         else:
             time.sleep(5)
-            # If nothing seems to appear, switch to just really grabbing all
-            if datetime.now(_CEST) > (_TIME_START_CHECKING_MORE\
-                                      +timedelta(0,_DT_UNTIL_DOWNLOAD_ALL)):
-                os.chdir('../')
-                _DR2_URL= 'http://cdn.gea.esac.esa.int/Gaia/'
-                _CUT_DIRS= 1
         continue
-    # Once it's available, start grabbing it
+    # Once it's available, start grabbing it; mirror only downloads files
+    # that are missing or whose MD5 checksum does not match and keeps track
+    # of the files that were already verified
     try:
-        subprocess.check_call(['wget','-r','-nH','-nc',
-                               '--cut-dirs=%i' % _CUT_DIRS,
-                               '--no-parent',
-                               '--reject="index.html*",vot.gz',
-                               _DR2_URL])
+        for directory in mirror.directories(dr=2):
+            files= [f for f in mirror.remote_checksums(dr=2,table=directory)
+                    if not f.endswith('vot.gz')]
+            if len(files) > 0:
+                mirror.mirror(dr=2,table=directory,files=files,
+                              verbose=_VERBOSE)
     except: # Any issue, just try again 10 seconds later
         time.sleep(10)
         download_tries+= 1
         if download_tries > _MAX_DOWNLOAD_TRIES: break
         else: continue
-    # Once we think we've downloaded it all, go into directories and check MD5
-    all_dirs= [x[0] for x in os.walk('./')]
-    all_dirs.append('./') # Just to make sure we check the main dir...
-    _CONTINUE= False
-    for dir in all_dirs:       
-        if 'votable' in dir or 'vo' in dir: continue
-        if _VERBOSE: print("Checking directory %s" % (dir))
-        if not os.path.exists(os.path.join(dir,_MD5_FILENAME)):
-            continue
-        with open(os.path.join(dir,_MD5_FILENAME),'r') as md5file:
-            for line in md5file:
-                target_hash,tfile= line.split()
-                if not os.path.exists(os.path.join(dir,tfile)): continue
-                current_hash= md5(os.path.join(dir,tfile))
-                if _VERBOSE:
-                    print("md5sums of file %s:" % tfile)
-                    print("%s" % target_hash)
-                    print("%s" % current_hash)
-                if target_hash.strip() != current_hash:
-                    print('MD5 does not match for %s' % tfile)
-                    # Remove the file
-                    os.remove(os.path.join(dir,tfile))
-                    _CONTINUE= True
-    if _CONTINUE: continue
-    else: break
+    break